@@ -0,0 +1,222 @@
+"""
+Bulk approve/reject for the borrow-request and collection-access queues.
+
+A whole selection is handled in one transaction with a fixed number of
+queries. The requests are locked in one query. Stock is checked against the
+items' reservation calendars, which are loaded with one query, and taken with
+one conditional UPDATE per distinct item. Statuses are written with
+bulk_update() and loans and notifications with bulk_create(). Each function
+returns one BulkResult per requested id, in the order given.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.urls import reverse
+
+from .catalog_cache import stock_changed
+from .events import queue_changed
+from .inventory import InventoryError, lock_items
+from .models import BorrowedItem, BorrowRequest, CollectionRequest, Item
+from .notifications import build_message, send_messages
+from .reservations import ItemCalendar, request_window
+from .waitlist import allocate
+
+
+class BulkResult:
+    def __init__(self, request_id, ok, label='', code='', message=''):
+        self.request_id = request_id
+        self.ok = ok
+        self.label = label
+        self.code = code
+        self.message = message
+
+
+def _parse_ids(request_ids):
+    ids = []
+    for value in request_ids:
+        try:
+            request_id = int(value)
+        except (TypeError, ValueError):
+            continue
+        if request_id not in ids:
+            ids.append(request_id)
+    return ids
+
+
+def _not_pending(request_id):
+    return BulkResult(request_id, False, code=InventoryError.NOT_PENDING,
+                      message="Request not found or already handled.")
+
+
+def _lock_pending(model, ids, *related, statuses=None):
+    return {
+        obj.pk: obj
+        for obj in model.objects.select_for_update().select_related(*related).filter(
+            pk__in=ids, status__in=statuses or [model.PENDING]
+        )
+    }
+
+
+def approve_borrow_requests(request_ids, librarian):
+    ids = _parse_ids(request_ids)
+    results = {}
+    with transaction.atomic():
+        pending = _lock_pending(BorrowRequest, ids, 'item', 'borrower')
+        item_ids = {r.item_id for r in pending.values()}
+        windows = {r.pk: request_window(r) for r in pending.values()}
+        # Lock the items and load every calendar in one query, then decide
+        # oldest request first against the calendars kept up to date in memory
+        lock_items(item_ids)
+        calendars = {}
+        if windows:
+            horizon = (min(start for start, _ in windows.values()), max(end for _, end in windows.values()))
+            calendars = ItemCalendar.load(item_ids, *horizon)
+        taken = defaultdict(int)
+        approved, lent, loans, notices = [], [], [], []
+        for borrow_request in sorted(pending.values(), key=lambda r: (r.date, r.pk)):
+            item = borrow_request.item
+            # Individual items are always lent one at a time
+            quantity = 1 if item.kind == Item.COMPLEX else borrow_request.quantity
+            label = f"{borrow_request.borrower.name}: {quantity} × {item.name}"
+            start, end = windows[borrow_request.pk]
+            item_calendar = calendars.setdefault(item.pk, ItemCalendar(item.pk))
+            if quantity < 1 or item_calendar.free(start, end) < quantity:
+                results[borrow_request.pk] = BulkResult(
+                    borrow_request.pk, False, label, InventoryError.OUT_OF_STOCK,
+                    f"Not enough of {item.name} free for the requested dates.",
+                )
+                continue
+            borrow_request.status = BorrowRequest.APPROVED
+            approved.append(borrow_request)
+            if borrow_request.is_reservation:
+                item_calendar.book(start, end, quantity)
+                message = f"Reserved from {start:%b %d}."
+            else:
+                item_calendar.lend(end, quantity)
+                taken[item.pk] += quantity
+                lent.append(borrow_request)
+                loans.append(BorrowedItem(
+                    borrower=borrow_request.borrower,
+                    item=item,
+                    quantity=quantity,
+                    due_date=end,
+                    item_type=item.kind,
+                ))
+                message = "Approved."
+            notices.append(build_message(
+                recipient=borrow_request.borrower,
+                subject=f"Borrow Request Approved: {item.name}",
+                content=f"Your request to borrow {item.name} has been approved.",
+                sender=librarian,
+            ))
+            results[borrow_request.pk] = BulkResult(borrow_request.pk, True, label, message=message)
+
+        for item_pk, quantity in taken.items():
+            # Still conditional, in case the backend could not lock the rows (SQLite)
+            updated = Item.objects.filter(pk=item_pk, quantity__gte=quantity).update(
+                quantity=F('quantity') - quantity
+            )
+            if not updated:
+                raise InventoryError(InventoryError.OUT_OF_STOCK, "Stock changed during approval; nothing was approved.")
+        if taken:
+            stock_changed()
+        BorrowedItem.objects.bulk_create(loans)
+        for borrow_request, loan in zip(lent, loans):
+            borrow_request.loan = loan
+        BorrowRequest.objects.bulk_update(approved, ['status', 'loan'])
+        send_messages(notices)
+
+    if pending:
+        queue_changed('borrow')
+    return [results.get(request_id) or _not_pending(request_id) for request_id in ids]
+
+
+def reject_borrow_requests(request_ids, librarian):
+    """Reject pending or waitlisted requests; waiters behind a rejected one get any stock it held back."""
+    ids = _parse_ids(request_ids)
+    results = {}
+    with transaction.atomic():
+        pending = _lock_pending(
+            BorrowRequest, ids, 'item', 'borrower', statuses=[BorrowRequest.PENDING, BorrowRequest.WAITLISTED]
+        )
+        unblocked = {r.item_id for r in pending.values() if r.status == BorrowRequest.WAITLISTED}
+        notices = []
+        for borrow_request in pending.values():
+            borrow_request.status = BorrowRequest.REJECTED
+            notices.append(build_message(
+                recipient=borrow_request.borrower,
+                subject=f"Borrow Request Rejected: {borrow_request.item.name}",
+                content=f"Your request to borrow {borrow_request.item.name} has been rejected.",
+                sender=librarian,
+            ))
+            label = f"{borrow_request.borrower.name}: {borrow_request.quantity} × {borrow_request.item.name}"
+            results[borrow_request.pk] = BulkResult(borrow_request.pk, True, label, message="Rejected.")
+        BorrowRequest.objects.bulk_update(pending.values(), ['status'])
+        send_messages(notices)
+        if unblocked:
+            allocate(unblocked, sender=librarian)
+
+    if pending:
+        queue_changed('borrow')
+    return [results.get(request_id) or _not_pending(request_id) for request_id in ids]
+
+
+def approve_collection_requests(request_ids, librarian):
+    ids = _parse_ids(request_ids)
+    results = {}
+    with transaction.atomic():
+        pending = _lock_pending(CollectionRequest, ids, 'collection', 'user')
+        grants = defaultdict(set)
+        collections = {}
+        notices = []
+        for collection_request in pending.values():
+            collection = collection_request.collection
+            collection_request.status = CollectionRequest.APPROVED
+            collections[collection.pk] = collection
+            grants[collection.pk].add(collection_request.user_id)
+            notices.append(build_message(
+                recipient=collection_request.user,
+                subject=f"Collection Request Approved: {collection.title}",
+                content=f"Your request to join the collection '{collection.title}' has been approved. You now have access to it.",
+                link=reverse('borrow:collection_detail', args=[collection.pk]),
+                sender=librarian,
+            ))
+            label = f"{collection_request.user.name}: {collection.title}"
+            results[collection_request.pk] = BulkResult(collection_request.pk, True, label, message="Approved.")
+
+        CollectionRequest.objects.bulk_update(pending.values(), ['status'])
+        # One multi-row insert per collection; add() skips existing grants and
+        # sends m2m_changed so caches of the grants stay current
+        for collection_pk, patron_ids in grants.items():
+            collections[collection_pk].allowed_users.add(*patron_ids)
+        send_messages(notices)
+
+    if pending:
+        queue_changed('collection')
+    return [results.get(request_id) or _not_pending(request_id) for request_id in ids]
+
+
+def reject_collection_requests(request_ids, librarian):
+    ids = _parse_ids(request_ids)
+    results = {}
+    with transaction.atomic():
+        pending = _lock_pending(CollectionRequest, ids, 'collection', 'user')
+        notices = []
+        for collection_request in pending.values():
+            collection = collection_request.collection
+            collection_request.status = CollectionRequest.REJECTED
+            notices.append(build_message(
+                recipient=collection_request.user,
+                subject=f"Collection Request Rejected: {collection.title}",
+                content=f"Your request to join the collection '{collection.title}' has been rejected.",
+                sender=librarian,
+            ))
+            label = f"{collection_request.user.name}: {collection.title}"
+            results[collection_request.pk] = BulkResult(collection_request.pk, True, label, message="Rejected.")
+        CollectionRequest.objects.bulk_update(pending.values(), ['status'])
+        send_messages(notices)
+
+    if pending:
+        queue_changed('collection')
+    return [results.get(request_id) or _not_pending(request_id) for request_id in ids]
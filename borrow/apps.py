@@ -1,6 +1,27 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def repair_search_index(sender, using, **kwargs):
+    from django.db import connections
+    from .search import install_sqlite_index
+
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        install_sqlite_index(connection)
 
 
 class BorrowConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'borrow'
+
+    def ready(self):
+        post_migrate.connect(repair_search_index, sender=self)
+        # Connects the signal handlers that keep the autocomplete index current
+        from . import autocomplete  # noqa: F401
+        # ...and the ones that publish live updates and keep unread counters current
+        from . import events, notifications  # noqa: F401
+        # ...and the ones that invalidate the catalog cache and keep private collections disjoint
+        from . import catalog_cache, membership  # noqa: F401
+        # ...and the one that resizes uploaded photos
+        from . import images  # noqa: F401
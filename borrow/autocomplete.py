@@ -0,0 +1,407 @@
+"""
+Search-as-you-type suggestions served from a per-process, in-memory index.
+
+The index holds item names, item locations and collection titles, broken into
+trigrams for typo-tolerant matching plus a sorted word list for prefix
+matching. It is built with a handful of queries on first use and then kept up
+to date incrementally by model signals, so answering a keystroke never touches
+the database. Signal handlers apply their change once the transaction commits,
+so a write that is rolled back never reaches the index. It also mirrors the
+data needed for visibility (librarians, private-collection membership and
+grants) so suggestions respect private collections.
+
+Each worker process holds its own copy. Signals only reach the process that
+made the change, so the index is also rebuilt once it is older than
+AUTOCOMPLETE_MAX_AGE seconds.
+"""
+import bisect
+import heapq
+import itertools
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.urls import reverse
+
+from .models import Collections, Item, Librarian, Patron
+
+MIN_SIMILARITY = 0.3
+MAX_CANDIDATES = 300
+PREFIX_SCAN = 200
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.lower().split())
+
+
+def trigrams(text):
+    """pg_trgm-style trigrams: each word padded with two leading spaces and one trailing."""
+    grams = set()
+    for word in text.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class Entry:
+    __slots__ = ('key', 'kind', 'label', 'norm', 'grams', 'item_ids', 'is_private')
+
+    def __init__(self, key, kind, label):
+        self.key = key
+        self.kind = kind
+        self.label = label
+        self.norm = normalize(label)
+        self.grams = trigrams(self.norm)
+        # Locations are shared by several items and visible if any of them is
+        self.item_ids = set()
+        self.is_private = False
+
+    @property
+    def url(self):
+        if self.kind == 'item':
+            return reverse('borrow:detail', args=[self.key[1]])
+        if self.kind == 'collection':
+            return reverse('borrow:collection_detail', args=[self.key[1]])
+        return f"{reverse('borrow:index')}?{urlencode({'q': self.label})}"
+
+
+class AutocompleteIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self.built_at = None
+        self.entries = {}
+        self.postings = defaultdict(set)
+        self.words = []
+        self.item_private_collection = {}
+        self.item_location = {}
+        self.librarian_user_ids = set()
+        self.grants = defaultdict(set)
+
+    # -- building -------------------------------------------------------------
+
+    def reset(self):
+        with self.lock:
+            self._clear()
+
+    def is_stale(self):
+        max_age = getattr(settings, 'AUTOCOMPLETE_MAX_AGE', 300)
+        return self.built_at is None or time.monotonic() - self.built_at > max_age
+
+    def build(self):
+        memberships = Collections.items_list.through.objects.filter(collections__is_collection_private=True)
+        grants = Collections.allowed_users.through.objects.filter(collections__is_collection_private=True)
+
+        items = list(Item.objects.values_list('pk', 'name', 'location'))
+        collections = list(Collections.objects.values_list('pk', 'title', 'is_collection_private'))
+        private_items = dict(memberships.values_list('item_id', 'collections_id'))
+        granted = list(grants.values_list('collections_id', 'patron__user_id'))
+        librarians = set(Librarian.objects.values_list('user_id', flat=True))
+
+        with self.lock:
+            self._clear()
+            self.librarian_user_ids = librarians
+            for collection_id, user_id in granted:
+                self.grants[collection_id].add(user_id)
+            for pk, title, is_private in collections:
+                self.set_collection(pk, title, is_private, sort=False)
+            for pk, name, location in items:
+                self.set_item(pk, name, location, private_items.get(pk), sort=False)
+            self.words.sort()
+            self.built_at = time.monotonic()
+
+    def ensure_built(self):
+        if self.is_stale():
+            self.build()
+
+    # -- incremental updates --------------------------------------------------
+
+    def _add(self, entry, sort=True):
+        self.entries[entry.key] = entry
+        for gram in entry.grams:
+            self.postings[gram].add(entry.key)
+        for word in set(entry.norm.split()):
+            if sort:
+                bisect.insort(self.words, (word, entry.key))
+            else:
+                # Bulk build: sorted once at the end
+                self.words.append((word, entry.key))
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        for gram in entry.grams:
+            keys = self.postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[gram]
+        for word in set(entry.norm.split()):
+            index = bisect.bisect_left(self.words, (word, key))
+            if index < len(self.words) and self.words[index] == (word, key):
+                del self.words[index]
+        return entry
+
+    def set_item(self, pk, name, location, private_collection=None, sort=True):
+        with self.lock:
+            self.remove_item(pk)
+            entry = Entry(('item', pk), 'item', name)
+            entry.item_ids.add(pk)
+            self._add(entry, sort)
+            self.item_private_collection[pk] = private_collection
+
+            location_norm = normalize(location)
+            if location_norm:
+                key = ('location', location_norm)
+                location_entry = self.entries.get(key)
+                if location_entry is None:
+                    location_entry = Entry(key, 'location', location)
+                    self._add(location_entry, sort)
+                location_entry.item_ids.add(pk)
+                self.item_location[pk] = key
+
+    def remove_item(self, pk):
+        with self.lock:
+            self._remove(('item', pk))
+            self.item_private_collection.pop(pk, None)
+            key = self.item_location.pop(pk, None)
+            location_entry = self.entries.get(key) if key else None
+            if location_entry is not None:
+                location_entry.item_ids.discard(pk)
+                if not location_entry.item_ids:
+                    self._remove(key)
+
+    def set_item_private_collection(self, pk, private_collection):
+        with self.lock:
+            if pk in self.item_private_collection:
+                self.item_private_collection[pk] = private_collection
+
+    def set_collection(self, pk, title, is_private, sort=True):
+        with self.lock:
+            self._remove(('collection', pk))
+            entry = Entry(('collection', pk), 'collection', title)
+            entry.is_private = is_private
+            self._add(entry, sort)
+
+    def remove_collection(self, pk):
+        with self.lock:
+            self._remove(('collection', pk))
+            self.grants.pop(pk, None)
+            for item_pk, collection_pk in list(self.item_private_collection.items()):
+                if collection_pk == pk:
+                    self.set_item_private_collection(item_pk, None)
+
+    # -- querying -------------------------------------------------------------
+
+    def _item_visible(self, item_pk, user):
+        private_collection = self.item_private_collection.get(item_pk)
+        if private_collection is None:
+            return True
+        if not user.is_authenticated:
+            return False
+        return user.pk in self.librarian_user_ids or user.pk in self.grants.get(private_collection, ())
+
+    def _visible(self, entry, user):
+        if entry.kind == 'collection':
+            # Matches the catalog: private collections are listed for signed-in users
+            return not entry.is_private or user.is_authenticated
+        return any(self._item_visible(pk, user) for pk in entry.item_ids)
+
+    def _prefix_range(self, prefix):
+        start = bisect.bisect_left(self.words, (prefix,))
+        end = bisect.bisect_left(self.words, (prefix + '\uffff',), start)
+        return start, end
+
+    def _prefix_matches(self, query, words, user):
+        # Walk the sorted word list for the query word with the fewest index
+        # words starting with it, and keep entries where every query word is a
+        # prefix of one of the label's words. Only PREFIX_SCAN rows are looked at
+        # so a one-letter query costs the same as a long one.
+        start, end = min((self._prefix_range(word) for word in words), key=lambda r: r[1] - r[0])
+        matches = {}
+        for _, key in self.words[start:min(end, start + PREFIX_SCAN)]:
+            if key in matches:
+                continue
+            entry = self.entries[key]
+            padded = ' ' + entry.norm
+            if not all(' ' + word in padded for word in words) or not self._visible(entry, user):
+                continue
+            # Whole-label prefix first, then shorter labels
+            matches[key] = (2.0 if entry.norm.startswith(query) else 1.0) - len(entry.norm) / 1000
+        return matches
+
+    def _trigram_matches(self, grams, user, exclude):
+        # A match must share at least `needed` trigrams with the query, so by the
+        # pigeonhole principle it appears in one of the (len - needed + 1) rarest
+        # posting lists. Skipping the common trigrams keeps the candidate set small.
+        needed = max(1, int(len(grams) * MIN_SIMILARITY))
+        lists = sorted((self.postings.get(gram, ()) for gram in grams), key=len)
+        candidates = set()
+        for keys in lists[:len(lists) - needed + 1]:
+            candidates.update(itertools.islice(keys, MAX_CANDIDATES - len(candidates)))
+            if len(candidates) >= MAX_CANDIDATES:
+                break
+
+        matches = {}
+        for key in candidates - exclude.keys():
+            entry = self.entries[key]
+            shared = len(grams & entry.grams)
+            similarity = shared / (len(grams) + len(entry.grams) - shared)
+            if similarity >= MIN_SIMILARITY and self._visible(entry, user):
+                matches[key] = similarity
+        return matches
+
+    def suggest(self, query, user, limit=8):
+        query = normalize(query)
+        if not query:
+            return []
+
+        with self.lock:
+            # Prefix matches always outrank fuzzy ones (scores >= 1 vs. < 1), so
+            # the trigram pass only runs when prefixes did not fill the list,
+            # i.e. usually when the query contains a typo.
+            matches = self._prefix_matches(query, query.split(), user)
+            if len(matches) < limit and len(query) >= 3:
+                matches.update(self._trigram_matches(trigrams(query), user, matches))
+
+            best = heapq.nlargest(limit, matches.items(), key=lambda match: (match[1], self.entries[match[0]].label))
+            return [
+                {'type': entry.kind, 'label': entry.label, 'url': entry.url}
+                for entry in (self.entries[key] for key, _ in best)
+            ]
+
+
+index = AutocompleteIndex()
+
+
+def suggest(query, user, limit=8):
+    index.ensure_built()
+    return index.suggest(query, user, limit)
+
+
+# -- signal handlers keeping the index current ----------------------------------
+
+def _on_commit(change):
+    """Run `change` once the current transaction commits, if the index has been built by then."""
+    def apply():
+        if index.built_at is not None:
+            change()
+    transaction.on_commit(apply)
+
+
+def _private_collection_of(item_pk):
+    memberships = Collections.items_list.through.objects.filter(
+        item_id=item_pk, collections__is_collection_private=True
+    )
+    return memberships.values_list('collections_id', flat=True).first()
+
+
+@receiver(post_save)
+def item_saved(sender, instance, raw=False, **kwargs):
+    if raw or not isinstance(instance, Item):
+        return
+    pk, name, location = instance.pk, instance.name, instance.location
+    _on_commit(lambda: index.set_item(pk, name, location, index.item_private_collection.get(pk)))
+
+
+@receiver(post_delete)
+def item_deleted(sender, instance, **kwargs):
+    if isinstance(instance, Item):
+        pk = instance.pk
+        _on_commit(lambda: index.remove_item(pk))
+
+
+@receiver(post_save, sender=Collections)
+def collection_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    pk, title, is_private = instance.pk, instance.title, instance.is_collection_private
+
+    def change():
+        previous = index.entries.get(('collection', pk))
+        if previous is not None and previous.is_private != is_private:
+            # Privacy changes which items are restricted; simplest to reload everything
+            index.build()
+        else:
+            index.set_collection(pk, title, is_private)
+    _on_commit(change)
+
+
+@receiver(post_delete, sender=Collections)
+def collection_deleted(sender, instance, **kwargs):
+    pk = instance.pk
+    _on_commit(lambda: index.remove_collection(pk))
+
+
+@receiver(m2m_changed, sender=Collections.items_list.through)
+def collection_items_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    pk, pk_set = instance.pk, set(pk_set) if pk_set is not None else None
+
+    def change():
+        if reverse:
+            item_pks = [pk]
+        elif pk_set is not None:
+            item_pks = pk_set
+        else:
+            # post_clear does not report which items were removed
+            item_pks = [item_pk for item_pk, collection in index.item_private_collection.items() if collection == pk]
+        for item_pk in item_pks:
+            index.set_item_private_collection(item_pk, _private_collection_of(item_pk))
+    _on_commit(change)
+
+
+@receiver(m2m_changed, sender=Collections.allowed_users.through)
+def collection_grants_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # Changed from the Patron side; just reload all grants for that user
+        _on_commit(index.build)
+        return
+    pk, pk_set = instance.pk, set(pk_set or ())
+
+    def change():
+        user_ids = set(Patron.objects.filter(pk__in=pk_set).values_list('user_id', flat=True))
+        with index.lock:
+            if action == 'post_add':
+                index.grants[pk] |= user_ids
+            elif action == 'post_remove':
+                index.grants[pk] -= user_ids
+            else:
+                index.grants.pop(pk, None)
+    _on_commit(change)
+
+
+@receiver(post_save, sender=Librarian)
+def librarian_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    user_id = instance.user_id
+
+    def change():
+        with index.lock:
+            index.librarian_user_ids.add(user_id)
+    _on_commit(change)
+
+
+@receiver(post_delete, sender=Librarian)
+def librarian_deleted(sender, instance, **kwargs):
+    user_id = instance.user_id
+
+    def change():
+        with index.lock:
+            index.librarian_user_ids.discard(user_id)
+    _on_commit(change)
@@ -0,0 +1,211 @@
+"""
+Version-stamped caching for the catalog.
+
+Every entry is stamped with the versions of the namespaces it depends on.
+Invalidating a namespace means bumping its version, which is one cache
+write, and entries with an older stamp count as stale from then on. Three
+namespaces are used:
+
+* CATALOG is bumped when items, collections, collection membership or access
+  grants change. This is driven by post_save/post_delete/m2m_changed signals.
+* STOCK is bumped when quantities change through the conditional UPDATEs in
+  borrow.inventory, which send no signals.
+* ACCESS is bumped when collections, their membership or their grants change,
+  i.e. whenever who may see an item can change.
+
+What is cached:
+
+* The ordered list of visible item ids, for each (scope, filter signature,
+  visibility class). Catalog pages are cut from this list, so a page costs
+  one query by primary key.
+* The rendered HTML of each item card, for each visibility class.
+* The sidebar facet counts, and the summary of current loans on item pages.
+
+A visibility class is one of 'librarian', 'anonymous', or 'patron:' plus a
+digest of the private collections the patron was granted. Patrons with the
+same grants therefore share entries.
+
+The expensive values go through cached(), which recomputes on one worker at
+a time. When an entry goes stale (a version bump, or CATALOG_CACHE_SOFT_TIMEOUT
+passing), the first worker takes a short lock and recomputes. Meanwhile the
+other workers are served the previous value, or wait for the new one if
+there is none. An invalidation under load therefore costs one recomputation
+instead of one per concurrent request. Within one cache, values are never
+served stale across an ACCESS bump.
+
+This works with any Django cache backend, but a bump only reaches the
+workers sharing the cache. With the default per-process memory cache, other
+workers may keep serving an older id list for up to
+CATALOG_CACHE_SOFT_TIMEOUT. Catalog pages are therefore loaded through the
+request's own visibility filter (see views.paginate_items), so an item that
+just became private never appears, even from a stale list. Set REDIS_URL or
+CACHE_DIR to share the cache between workers.
+"""
+import hashlib
+import time
+import uuid
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Collections, Item
+from .roles import get_role
+
+CATALOG = 'catalog'
+STOCK = 'stock'
+ACCESS = 'access'
+
+# Longer lists are not worth holding in the cache; those pages query the database directly
+MAX_CACHED_IDS = 5000
+# Seconds a recomputation may hold its lock before another worker takes over
+LOCK_TIMEOUT = 10
+# How long a worker with nothing to serve waits for another worker's result
+WAIT_TIMEOUT = 2
+WAIT_INTERVAL = 0.05
+
+
+def timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 600)
+
+
+def soft_timeout():
+    return getattr(settings, 'CATALOG_CACHE_SOFT_TIMEOUT', 60)
+
+
+def _version_key(namespace):
+    return f'borrow:{namespace}:version'
+
+
+def version(namespace):
+    """The namespace's current version, starting it if the cache has none."""
+    key = _version_key(namespace)
+    current = cache.get(key)
+    if current is None:
+        # Start from the clock, not 1, so a version evicted from the cache can
+        # never come back as a number that old entries were stored under
+        current = time.time_ns()
+        if not cache.add(key, current, None):
+            current = cache.get(key, current)
+    return current
+
+
+def bump(*namespaces):
+    for namespace in namespaces:
+        try:
+            cache.incr(_version_key(namespace))
+        except ValueError:
+            cache.set(_version_key(namespace), time.time_ns(), None)
+
+
+def bump_on_commit(*namespaces):
+    # Straight away, so the rest of this transaction sees its own changes, and
+    # again after commit, so nothing cached from the old rows in between survives
+    bump(*namespaces)
+    transaction.on_commit(lambda: bump(*namespaces))
+
+
+def stock_changed():
+    """Call after changing Item.quantity with update()."""
+    bump_on_commit(STOCK)
+
+
+def cached(namespaces, parts, compute, fresh_for=None):
+    """
+    compute(), cached until any of `namespaces` is bumped or `fresh_for`
+    seconds (default CATALOG_CACHE_SOFT_TIMEOUT) pass, and recomputed by a
+    single worker at a time (see above).
+    """
+    fresh_for = soft_timeout() if fresh_for is None else fresh_for
+    stamp = tuple(version(namespace) for namespace in namespaces)
+    key = f"borrow:sf:{ACCESS}{version(ACCESS)}:{hashlib.md5(repr(parts).encode()).hexdigest()}"
+    entry = cache.get(key)
+    if entry is not None and entry[0] == stamp and time.time() < entry[1]:
+        return entry[2]
+
+    single_flight = getattr(settings, 'CATALOG_SINGLE_FLIGHT', True)
+    token = uuid.uuid4().hex
+    if not single_flight or cache.add(f'{key}:lock', token, LOCK_TIMEOUT):
+        try:
+            if single_flight:
+                # Another worker may have refreshed it between our read and our lock
+                entry = cache.get(key)
+                if entry is not None and entry[0] == stamp and time.time() < entry[1]:
+                    return entry[2]
+            value = compute()
+            cache.set(key, (stamp, time.time() + fresh_for, value), timeout())
+        finally:
+            if single_flight and cache.get(f'{key}:lock') == token:
+                cache.delete(f'{key}:lock')
+        return value
+
+    if entry is not None:
+        # Stale, but another worker is already refreshing it
+        return entry[2]
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[2]
+    # The other worker is taking too long; do not keep the request waiting
+    return compute()
+
+
+def visibility_class(request):
+    """Which users see exactly the same catalog as this one. Memoized on the request."""
+    if not hasattr(request, '_visibility_class'):
+        role = get_role(request)
+        if not request.user.is_authenticated:
+            visibility = 'anonymous'
+        elif role.is_librarian:
+            visibility = 'librarian'
+        else:
+            grants = sorted(role.granted_collection_ids)
+            visibility = 'patron:' + hashlib.md5(repr(grants).encode()).hexdigest()
+        request._visibility_class = visibility
+    return request._visibility_class
+
+
+def filter_signature(item_filter):
+    return urlencode(sorted(item_filter.as_params().items())) if item_filter else ''
+
+
+def item_ids(request, scope, queryset, item_filter, ordering):
+    """
+    The ordered pks of `queryset` (already limited to what the request may see
+    and filtered by `item_filter`), cached per scope, filter and visibility
+    class. Returns None when the list is too long to cache.
+    """
+    # Only a quantity filter makes the list depend on stock
+    namespaces = (CATALOG, STOCK) if item_filter and item_filter.min_quantity is not None else (CATALOG,)
+    parts = ('ids', scope, visibility_class(request), filter_signature(item_filter), ordering)
+
+    def compute():
+        ids = list(queryset.order_by(*ordering).values_list('pk', flat=True)[:MAX_CACHED_IDS + 1])
+        return ids if len(ids) <= MAX_CACHED_IDS else None
+    return cached(namespaces, parts, compute)
+
+
+def card_parts(request, item):
+    # The quantity is part of the key, so stock changes never show a stale badge
+    return ('card', item.pk, item.quantity, visibility_class(request))
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def item_changed(sender, **kwargs):
+    if issubclass(sender, Collections):
+        bump_on_commit(CATALOG, ACCESS)
+    elif issubclass(sender, Item):
+        bump_on_commit(CATALOG)
+
+
+@receiver(m2m_changed, sender=Collections.items_list.through)
+@receiver(m2m_changed, sender=Collections.allowed_users.through)
+def membership_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_on_commit(CATALOG, ACCESS)
@@ -0,0 +1,143 @@
+"""
+Live updates for open pages, streamed as Server-Sent Events.
+
+A small in-process publish/subscribe broker stands between the code that
+changes things and the browsers watching for them. Messages being sent or
+read publish 'unread' on the recipient's channel (or on the librarians'
+channel for a broadcast). Borrow and collection requests changing state
+publish 'queue' on the librarians' channel. Events are published only once
+the transaction commits.
+
+Events are hints, not data. An 'unread' event makes the stream re-read the
+patron's unread counter, and several events that arrive together are
+handled with a single read. Idle tabs therefore cost nothing, instead of
+a query every 30 seconds.
+
+The stream needs an ASGI server; under WSGI the endpoint answers 204 and
+clients fall back to polling. The broker lives in one process, so a
+deployment with several processes needs a shared one (e.g. Redis pub/sub or
+PostgreSQL LISTEN/NOTIFY) behind the same publish() call.
+"""
+import asyncio
+import json
+import threading
+
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import BorrowRequest, CollectionRequest, Librarian, Patron
+
+LIBRARIANS = 'librarians'
+UNREAD = 'unread'
+QUEUE = 'queue'
+
+# Seconds between keep-alive comments, so proxies do not close an idle stream
+KEEPALIVE = 25
+# Events a slow subscriber may fall behind by before further ones are dropped
+MAX_PENDING = 100
+
+
+def patron_channel(patron_id):
+    return f'patron:{patron_id}'
+
+
+def _offer(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        pass
+
+
+class Broker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}  # channel -> {(loop, queue)}
+
+    def subscribe(self, channels):
+        """A queue receiving every event published on `channels`. Call from the event loop."""
+        subscription = (asyncio.get_running_loop(), asyncio.Queue(maxsize=MAX_PENDING))
+        with self.lock:
+            for channel in channels:
+                self.subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel, subscriptions in list(self.subscribers.items()):
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscribers[channel]
+
+    def publish(self, channel, event):
+        """Hand `event` to every subscriber of `channel`. Safe to call from any thread."""
+        with self.lock:
+            subscriptions = list(self.subscribers.get(channel, ()))
+        for loop, queue in subscriptions:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                # The subscriber's loop has shut down; it unsubscribes on its way out
+                pass
+
+
+broker = Broker()
+
+
+def publish(channel, event, **data):
+    """Publish once the current transaction commits (straight away outside one)."""
+    transaction.on_commit(lambda: broker.publish(channel, {'event': event, **data}))
+
+
+def unread_changed(recipients=(), librarians=False):
+    for patron_id in set(recipients):
+        publish(patron_channel(patron_id), UNREAD)
+    if librarians:
+        publish(LIBRARIANS, UNREAD)
+
+
+def queue_changed(queue):
+    publish(LIBRARIANS, QUEUE, queue=queue)
+
+
+def _format(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _unread_count(patron):
+    return await Patron.objects.filter(pk=patron.pk).values_list('unread_count', flat=True).aget()
+
+
+async def stream(patron):
+    """The event-stream body for `patron`: an initial unread count, then updates as they happen."""
+    is_librarian = await Librarian.objects.filter(pk=patron.pk).aexists()
+    channels = [patron_channel(patron.pk)] + ([LIBRARIANS] if is_librarian else [])
+    subscription = broker.subscribe(channels)
+    queue = subscription[1]
+    try:
+        yield "retry: 10000\n\n"
+        yield _format(UNREAD, {'count': await _unread_count(patron)})
+        while True:
+            try:
+                events = [await asyncio.wait_for(queue.get(), KEEPALIVE)]
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            while not queue.empty():
+                events.append(queue.get_nowait())
+            if any(event['event'] == UNREAD for event in events):
+                yield _format(UNREAD, {'count': await _unread_count(patron)})
+            for queue_name in sorted({event['queue'] for event in events if event['event'] == QUEUE}):
+                yield _format(QUEUE, {'queue': queue_name})
+    finally:
+        broker.unsubscribe(subscription)
+
+
+@receiver(post_save, sender=BorrowRequest)
+def borrow_request_saved(sender, instance, **kwargs):
+    queue_changed('borrow')
+
+
+@receiver(post_save, sender=CollectionRequest)
+def collection_request_saved(sender, instance, **kwargs):
+    queue_changed('collection')
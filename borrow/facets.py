@@ -0,0 +1,91 @@
+"""
+Live counts for the catalog filter sidebar.
+
+Every facet value is counted with its own conditional aggregate, so all counts
+for a page come from a single query instead of one COUNT per option. Each facet
+is counted under all the *other* active filters but not its own, so choosing a
+category still shows how many items the other categories would return.
+
+Results are cached per scope (catalog or collection), per visibility class
+(viewers who see the same catalog share an entry) and per filter signature
+through catalog_cache.cached(), so they are refreshed as soon as the catalog
+or stock changes, and at most every FACET_CACHE_TIMEOUT seconds (default 60)
+otherwise.
+"""
+from django.conf import settings
+from django.db.models import Count
+
+from . import catalog_cache
+from .filters import ItemFilter
+from .models import ComplexItem, Item
+
+ITEM_TYPES = ('simple', 'complex')
+QUANTITY_STEPS = range(0, 11)
+
+
+def _aggregates(item_filter):
+    """(facet, value) -> Count expression for every option shown in the sidebar."""
+    counted = {('total', None): item_filter.filters_q()}
+    for value, _ in Item.CATEGORY_CHOICES:
+        counted['category', value] = ItemFilter.facet_q('category', value) & item_filter.filters_q(exclude=('category',))
+    # Condition only narrows complex items, so it is dropped along with the item type
+    without_type = item_filter.filters_q(exclude=('item_type', 'condition'))
+    counted['item_type', ''] = without_type
+    for value in ITEM_TYPES:
+        counted['item_type', value] = ItemFilter.facet_q('item_type', value) & without_type
+    for value, _ in ComplexItem.CONDITION_CHOICES:
+        counted['condition', value] = ItemFilter.facet_q('condition', value) & item_filter.filters_q(exclude=('condition',))
+    for value in QUANTITY_STEPS:
+        counted['min_quantity', value] = ItemFilter.facet_q('min_quantity', value) & item_filter.filters_q(exclude=('min_quantity',))
+    return counted
+
+
+def compute_facet_counts(queryset, item_filter):
+    """
+    Count every facet option over `queryset` (already limited to what the viewer
+    may see) in one query. Returns a dict like
+    {'total': 12, 'category': {'BALLS': 3, ...}, 'item_type': {'': 12, 'simple': 8, ...}, ...}.
+    """
+    counted = _aggregates(item_filter)
+    aliases = {f'facet_{i}': key for i, key in enumerate(counted)}
+    row = queryset.filter(item_filter.search_q()).aggregate(**{
+        alias: Count('pk', filter=counted[key]) for alias, key in aliases.items()
+    })
+
+    counts = {'category': {}, 'item_type': {}, 'condition': {}, 'min_quantity': {}}
+    for alias, (facet, value) in aliases.items():
+        if facet == 'total':
+            counts['total'] = row[alias]
+        else:
+            counts[facet][value] = row[alias]
+    return counts
+
+
+def cache_parts(request, scope, item_filter):
+    visibility = catalog_cache.visibility_class(request)
+    return ('facets', scope, visibility, catalog_cache.filter_signature(item_filter))
+
+
+def facet_counts(request, scope, queryset, item_filter):
+    """compute_facet_counts(), cached per scope, visibility class and filter signature."""
+    return catalog_cache.cached(
+        (catalog_cache.CATALOG, catalog_cache.STOCK),
+        cache_parts(request, scope, item_filter),
+        lambda: compute_facet_counts(queryset, item_filter),
+        fresh_for=getattr(settings, 'FACET_CACHE_TIMEOUT', 60),
+    )
+
+
+def facet_context(counts):
+    """Template context for the sidebar: choice lists paired with their counts."""
+    return {
+        'facet_total': counts['total'],
+        'category_facets': [
+            (value, label, counts['category'][value]) for value, label in Item.CATEGORY_CHOICES
+        ],
+        'condition_facets': [
+            (value, label, counts['condition'][value]) for value, label in ComplexItem.CONDITION_CHOICES
+        ],
+        'item_type_counts': {'all': counts['item_type'][''], **counts['item_type']},
+        'quantity_counts': {str(value): count for value, count in counts['min_quantity'].items()},
+    }
@@ -0,0 +1,77 @@
+from django.db.models import Q
+
+from .models import Item
+from .search import item_search_q
+
+
+class ItemFilter:
+    """
+    Parses the catalog filter parameters (q, category, item_type, condition,
+    min_quantity) shared by the browse pages and their fragment/JSON endpoints.
+    """
+
+    PARAMS = ('q', 'category', 'item_type', 'condition', 'min_quantity')
+
+    def __init__(self, params):
+        self.q = params.get('q', '').strip()
+
+        category = params.get('category', '')
+        self.category = category if category in dict(Item.CATEGORY_CHOICES) else ''
+
+        item_type = params.get('item_type', '')
+        self.item_type = item_type if item_type in ('simple', 'complex') else ''
+
+        # Condition only applies to complex (individual) items
+        self.condition = params.get('condition', '') if self.item_type == 'complex' else ''
+
+        try:
+            self.min_quantity = int(params.get('min_quantity'))
+        except (TypeError, ValueError):
+            self.min_quantity = None
+
+    def search_q(self):
+        if not self.q:
+            return Q()
+        return item_search_q(self.q)
+
+    FACETS = ('category', 'item_type', 'condition', 'min_quantity')
+
+    @staticmethod
+    def facet_q(facet, value):
+        """The condition for one facet set to `value`; empty values do not filter."""
+        if value in ('', None):
+            return Q()
+        if facet == 'category':
+            return Q(category=value)
+        if facet == 'item_type':
+            return Q(kind=Item.SIMPLE if value == 'simple' else Item.COMPLEX)
+        if facet == 'condition':
+            return Q(complexitem__condition=value)
+        if facet == 'min_quantity':
+            return Q(quantity__gte=value)
+        raise ValueError(f"Unknown facet {facet!r}")
+
+    def filters_q(self, exclude=()):
+        """The active facet filters (not the search query), leaving out those in `exclude`."""
+        query = Q()
+        for facet in self.FACETS:
+            if facet not in exclude:
+                query &= self.facet_q(facet, getattr(self, facet))
+        return query
+
+    def as_q(self):
+        return self.search_q() & self.filters_q()
+
+    def apply(self, queryset):
+        return queryset.filter(self.as_q())
+
+    def as_params(self):
+        """The active filters as query parameters, e.g. for building "next page" links."""
+        params = {
+            'q': self.q,
+            'category': self.category,
+            'item_type': self.item_type,
+            'condition': self.condition,
+            'min_quantity': self.min_quantity,
+        }
+        return {key: value for key, value in params.items() if value not in ('', None)}
@@ -1,6 +1,43 @@
 from django import forms
+from django.core.validators import MaxValueValidator
+from django.urls import reverse_lazy
+from django.utils import timezone
 from .models import SimpleItem, ComplexItem, Collections, Patron, Review
 
+
+class LazyMultipleSelect(forms.SelectMultiple):
+    """
+    A searchable multi-select that renders only the selected options.
+
+    The rest are fetched a page at a time from `lookup_url` (see
+    views.item_lookup and views.patron_lookup) while the user searches, and
+    the picks are posted as plain ids. Rendering costs one query for the
+    selected rows however large the catalog or the patron list is, and
+    ModelMultipleChoiceField validates the posted ids with one more.
+    """
+    template_name = 'borrow/widgets/lazy_select.html'
+
+    def __init__(self, lookup_url, attrs=None):
+        super().__init__(attrs)
+        self.lookup_url = lookup_url
+
+    def optgroups(self, name, value, attrs=None):
+        ids = [pk for pk in value if str(pk).isdigit()]
+        if not ids:
+            return []
+        field = self.choices.field
+        options = [
+            self.create_option(name, obj.pk, field.label_from_instance(obj), True, index, attrs=attrs)
+            for index, obj in enumerate(self.choices.queryset.filter(pk__in=ids).order_by('name', 'pk'))
+        ]
+        return [(None, options, 0)]
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['lookup_url'] = str(self.lookup_url)
+        return context
+
+
 class SimpleItemForm(forms.ModelForm):
     class Meta:
         model = SimpleItem
@@ -19,6 +56,34 @@ class ComplexItemForm(forms.ModelForm):
 class QuantityForm(forms.Form):
     quantity = forms.IntegerField(min_value=1, label="Quantity", required=True)
 
+    def __init__(self, *args, max_quantity=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # No more than the library owns, or the request could never be met
+        if max_quantity is not None:
+            field = self.fields['quantity']
+            field.max_value = max_quantity
+            field.widget.attrs['max'] = max_quantity
+            field.validators.append(MaxValueValidator(
+                max_quantity, message=f"The library only has {max_quantity} of this item."
+            ))
+
+class ReservationForm(forms.Form):
+    """Optional dates to book an item ahead of time; leave both empty to borrow now."""
+    start_date = forms.DateField(required=False, label="From", widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
+    end_date = forms.DateField(required=False, label="Until", widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date = cleaned_data.get('start_date')
+        end_date = cleaned_data.get('end_date')
+        if bool(start_date) != bool(end_date):
+            raise forms.ValidationError("Pick both a start and an end date, or neither.")
+        if start_date and start_date < timezone.localdate():
+            raise forms.ValidationError("The start date cannot be in the past.")
+        if start_date and end_date < start_date:
+            raise forms.ValidationError("The end date must be on or after the start date.")
+        return cleaned_data
+
 class CollectionForm(forms.ModelForm):
     class Meta:
         model = Collections
@@ -26,9 +91,9 @@ class CollectionForm(forms.ModelForm):
         widgets = {
             'title': forms.TextInput(attrs={'class': 'form-control'}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
-            'items_list': forms.CheckboxSelectMultiple(),
+            'items_list': LazyMultipleSelect(reverse_lazy('borrow:item_lookup')),
             'is_collection_private': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
-            'allowed_users': forms.CheckboxSelectMultiple(),
+            'allowed_users': LazyMultipleSelect(reverse_lazy('borrow:patron_lookup')),
         }
 
     def __init__(self, *args, librarian=None, is_librarian=True, editing=False, **kwargs):
@@ -50,6 +115,14 @@ class CollectionForm(forms.ModelForm):
             else:
                 self.fields['allowed_users'].queryset = Patron.objects.all()
 
+    def clean(self):
+        cleaned_data = super().clean()
+        # Public collections are open to everyone, so only private ones keep grants
+        private = cleaned_data.get('is_collection_private', self.instance.is_collection_private)
+        if 'allowed_users' in cleaned_data and not private:
+            cleaned_data['allowed_users'] = Patron.objects.none()
+        return cleaned_data
+
 class ReviewForm(forms.ModelForm):
     class Meta:
         model = Review
@@ -0,0 +1,154 @@
+"""
+Resized copies of item and profile photos.
+
+Uploads are often multi-megabyte phone photos, but cards show them 150 px
+high and the navbar 30 px wide. Once a photo is saved and committed,
+make_variants() writes smaller copies next to it, in the photo's own storage:
+
+* a WebP and a JPEG for each width bucket of the field (never wider than the
+  original). The EXIF orientation is applied first, because the copies carry
+  no metadata.
+* a 16 px wide blurred placeholder, inlined as a data URI and shown until
+  the real image has loaded.
+
+What was made is recorded in a JSON column next to the photo (photo_variants,
+profile_photo_variants). Templates therefore build srcset without asking the
+storage what exists. The record names the photo it was made from, and a
+record for a different photo is ignored, so the original is served until the
+new copies are in place. Photos that cannot be decoded are recorded with no
+copies and keep being served as they are.
+
+Run make_photo_variants to process photos uploaded before this existed.
+"""
+import base64
+import io
+import posixpath
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from PIL import Image, ImageFilter, ImageOps
+
+from .models import Item, Patron
+
+# Widths to make for each photo field. Cards are at most ~400 px wide and the
+# navbar avatar is 30 px, so these cover 1x to 2x screens
+WIDTHS = {
+    'photo': (160, 320, 640),
+    'profile_photo': (32, 64, 128),
+}
+FORMATS = (('webp', 'WEBP', 'image/webp'), ('jpeg', 'JPEG', 'image/jpeg'))
+QUALITY = 80
+PLACEHOLDER_WIDTH = 16
+
+
+def variants_field(field_name):
+    return f'{field_name}_variants'
+
+
+def current_variants(fieldfile, record):
+    """`record` if it was made from the photo now in `fieldfile`, else None."""
+    if fieldfile and record and record.get('source') == fieldfile.name:
+        return record
+    return None
+
+
+def _open(fieldfile):
+    with fieldfile.open('rb') as f:
+        image = Image.open(f)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        # JPEG has no alpha; put transparent photos on white, as browsers show them
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _encode(image, pil_format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, quality=QUALITY, **options)
+    return buffer.getvalue()
+
+
+def _placeholder(image):
+    height = max(1, round(image.height * PLACEHOLDER_WIDTH / image.width))
+    tiny = image.resize((PLACEHOLDER_WIDTH, height), Image.Resampling.BILINEAR).filter(ImageFilter.GaussianBlur(1))
+    data = base64.b64encode(_encode(tiny, 'JPEG')).decode()
+    return f'data:image/jpeg;base64,{data}'
+
+
+def build_variants(fieldfile, widths):
+    """Write the resized copies of `fieldfile` to its storage and return their record."""
+    record = {'source': fieldfile.name}
+    try:
+        image = _open(fieldfile)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return record
+
+    # Smaller photos get a single copy at their own width
+    widths = sorted({min(width, image.width) for width in widths})
+    stem, _ = posixpath.splitext(fieldfile.name)
+    directory, base = posixpath.split(stem)
+    record.update({'width': image.width, 'height': image.height, 'placeholder': _placeholder(image)})
+    for key, pil_format, _ in FORMATS:
+        record[key] = []
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.Resampling.LANCZOS)
+        for key, pil_format, _ in FORMATS:
+            options = {'method': 4} if pil_format == 'WEBP' else {'optimize': True, 'progressive': True}
+            name = posixpath.join(directory, 'variants', f'{base}-{width}.{key}')
+            name = fieldfile.storage.save(name, ContentFile(_encode(resized, pil_format, **options)))
+            record[key].append([width, name])
+    return record
+
+
+def variant_names(record):
+    return {name for key, _, _ in FORMATS for _, name in (record or {}).get(key, ())}
+
+
+def delete_variants(storage, record, keep=()):
+    for name in variant_names(record) - set(keep):
+        storage.delete(name)
+
+
+def make_variants(instance, field_name):
+    """
+    Make and record the copies of instance.<field_name>, replacing any older
+    ones. Returns the new record.
+    """
+    fieldfile = getattr(instance, field_name)
+    old = getattr(instance, variants_field(field_name)) or {}
+    record = build_variants(fieldfile, WIDTHS[field_name]) if fieldfile else {}
+    type(instance)._base_manager.filter(pk=instance.pk).update(**{variants_field(field_name): record})
+    setattr(instance, variants_field(field_name), record)
+    delete_variants(fieldfile.storage, old, keep=variant_names(record))
+    if isinstance(instance, Item):
+        # Cards are cached with their <img> tags
+        from .catalog_cache import CATALOG, bump
+        bump(CATALOG)
+    return record
+
+
+def needs_variants(instance, field_name):
+    fieldfile = getattr(instance, field_name)
+    record = getattr(instance, variants_field(field_name)) or {}
+    return bool(fieldfile) and record.get('source') != fieldfile.name
+
+
+@receiver(post_save)
+def photo_saved(sender, instance, **kwargs):
+    if issubclass(sender, Item):
+        field_name = 'photo'
+    elif issubclass(sender, Patron):
+        field_name = 'profile_photo'
+    else:
+        return
+    if needs_variants(instance, field_name):
+        # After commit, so the resizing never holds the transaction open,
+        # and a storage error is logged instead of failing a request that already succeeded
+        transaction.on_commit(lambda: make_variants(instance, field_name), robust=True)
@@ -0,0 +1,123 @@
+"""
+Stock changes for borrowing and returning items.
+
+Every change to Item.quantity is a single conditional UPDATE with an F()
+expression, e.g. "quantity = quantity - 2 WHERE quantity >= 2". It runs in a
+transaction together with the BorrowedItem/BorrowRequest rows it belongs to,
+so concurrent workers can neither oversell nor lose updates. Status changes
+are guarded the same way, so a reservation is only handed out (and a loan
+returned) once. Failures raise InventoryError with a machine-readable code.
+
+Librarians approve requests through approvals.py, which checks them against
+the reservation calendar and takes stock with the same conditional UPDATE.
+Stock that comes back is offered to the item's waitlist in the same
+transaction.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .catalog_cache import stock_changed
+from .models import BorrowedItem, BorrowRequest, Item
+
+
+class InventoryError(Exception):
+    OUT_OF_STOCK = 'out_of_stock'
+    INVALID_QUANTITY = 'invalid_quantity'
+    NOT_PENDING = 'not_pending'
+    NOT_BORROWED = 'not_borrowed'
+    ALREADY_RETURNED = 'already_returned'
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def reserve(patron, item, quantity, days_to_return=7, item_type=None, due_date=None):
+    """Take `quantity` of `item` out of stock and record the loan. Returns the BorrowedItem."""
+    if quantity < 1:
+        raise InventoryError(InventoryError.INVALID_QUANTITY, "Quantity must be at least 1.")
+
+    with transaction.atomic():
+        taken = Item.objects.filter(pk=item.pk, quantity__gte=quantity).update(quantity=F('quantity') - quantity)
+        if not taken:
+            raise InventoryError(InventoryError.OUT_OF_STOCK, f"Not enough of {item.name} available.")
+        stock_changed()
+        borrowed_item = BorrowedItem.objects.create(
+            borrower=patron,
+            item=item,
+            quantity=quantity,
+            due_date=due_date or timezone.now() + timedelta(days=days_to_return),
+            item_type=item_type or item.kind,
+        )
+    item.refresh_from_db(fields=['quantity'])
+    return borrowed_item
+
+
+def total_stock(item):
+    """Units of `item` the library owns: those on the shelf plus those out on loan."""
+    lent = BorrowedItem.objects.filter(item=item, returned=False).aggregate(units=Sum('quantity'))['units']
+    return item.quantity + (lent or 0)
+
+
+def lock_items(item_ids):
+    """Serialise stock decisions per item until the end of the transaction (a no-op on SQLite)."""
+    list(Item.objects.select_for_update().filter(pk__in=item_ids).values_list('pk', flat=True))
+
+
+def start_reservation(borrow_request):
+    """Lend the units of an approved reservation whose window has begun. Returns the BorrowedItem."""
+    item = borrow_request.item
+    quantity = 1 if item.kind == Item.COMPLEX else borrow_request.quantity
+    with transaction.atomic():
+        borrowed_item = reserve(borrow_request.borrower, item, quantity, due_date=borrow_request.end_date)
+        # Linking the loan is the claim: if someone else got there first this rolls back
+        claimed = BorrowRequest.objects.filter(
+            pk=borrow_request.pk, status=BorrowRequest.APPROVED, loan__isnull=True
+        ).update(loan=borrowed_item)
+        if not claimed:
+            raise InventoryError(InventoryError.NOT_PENDING, "This reservation has already been handed out.")
+    borrow_request.loan = borrowed_item
+    return borrowed_item
+
+
+def return_borrowed_item(borrowed_item):
+    """Mark a loan as returned and put its whole quantity back in stock, or lend it to the waitlist."""
+    from .waitlist import allocate
+    with transaction.atomic():
+        returned = BorrowedItem.objects.filter(pk=borrowed_item.pk, returned=False).update(returned=True)
+        if not returned:
+            raise InventoryError(InventoryError.ALREADY_RETURNED, "This item has already been returned.")
+        Item.objects.filter(pk=borrowed_item.item_id).update(quantity=F('quantity') + borrowed_item.quantity)
+        stock_changed()
+        allocate([borrowed_item.item_id])
+    borrowed_item.returned = True
+
+
+def return_quantity(patron, item, quantity):
+    """Return part of `patron`'s loan of `item`; the loan is deleted once nothing is left on it."""
+    from .waitlist import allocate
+    if quantity < 1:
+        raise InventoryError(InventoryError.INVALID_QUANTITY, "Quantity must be at least 1.")
+
+    with transaction.atomic():
+        borrowed_item = (
+            BorrowedItem.objects.select_for_update()
+            .filter(borrower=patron, item=item, returned=False)
+            .first()
+        )
+        if borrowed_item is None:
+            raise InventoryError(InventoryError.NOT_BORROWED, f"{item.name} is not on loan to {patron.name}.")
+        reduced = BorrowedItem.objects.filter(pk=borrowed_item.pk, quantity__gte=quantity).update(
+            quantity=F('quantity') - quantity
+        )
+        if not reduced:
+            raise InventoryError(InventoryError.INVALID_QUANTITY, f"Cannot return {quantity} of {item.name}.")
+        BorrowedItem.objects.filter(pk=borrowed_item.pk, quantity=0).delete()
+        Item.objects.filter(pk=item.pk).update(quantity=F('quantity') + quantity)
+        stock_changed()
+        allocate([item.pk])
+    item.refresh_from_db(fields=['quantity'])
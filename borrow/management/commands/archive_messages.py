@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from borrow.notifications import archive_messages
+
+
+class Command(BaseCommand):
+    help = "Move read messages (broadcasts once every librarian has read them) older than the retention window into the archive table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'MESSAGE_RETENTION_DAYS', 90))
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        archived = archive_messages(options['days'], batch_size=options['batch_size'])
+        self.stdout.write(f"Archived {archived} message(s) older than {options['days']} days.")
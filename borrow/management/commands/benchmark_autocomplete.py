@@ -0,0 +1,65 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+
+from borrow.autocomplete import AutocompleteIndex
+
+WORDS = (
+    "ball basket soccer tennis racket net goal frisbee stick hockey lacrosse cone "
+    "pump bat glove helmet pad whistle rope hurdle mat shuttlecock paddle volleyball"
+).split()
+PLACES = "gym court field shed pool locker storage track".split()
+
+
+def typo(word, rng):
+    if len(word) < 4:
+        return word
+    i = rng.randrange(len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+class Command(BaseCommand):
+    help = "Measure autocomplete latency on a synthetic in-memory index (no database access)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100_000)
+        parser.add_argument('--queries', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(7)
+        index = AutocompleteIndex()
+
+        start = time.perf_counter()
+        with index.lock:
+            for pk in range(options['items']):
+                name = " ".join(rng.sample(WORDS, 2)).title() + f" {pk}"
+                location = f"{rng.choice(PLACES).title()} {rng.randint(1, 200)}"
+                private_collection = pk % 50 if pk % 10 == 0 else None
+                index.set_item(pk, name, location, private_collection, sort=False)
+            index.words.sort()
+            index.built_at = time.monotonic()
+        self.stdout.write(f"Built index of {options['items']} items in {time.perf_counter() - start:.1f}s")
+
+        user = AnonymousUser()
+        samples = []
+        for _ in range(options['queries']):
+            words = rng.sample(WORDS, 2)
+            query = rng.choice([
+                words[0][:rng.randint(1, len(words[0]))],
+                typo(words[0], rng),
+                f"{words[0]} {words[1][:3]}",
+                f"{typo(words[0], rng)} {typo(words[1], rng)}",
+            ])
+            start = time.perf_counter()
+            index.suggest(query, user)
+            samples.append((time.perf_counter() - start) * 1000)
+
+        samples.sort()
+        p99 = samples[int(len(samples) * 0.99) - 1]
+        self.stdout.write(
+            f"{len(samples)} queries: p50 {statistics.median(samples):.2f} ms, "
+            f"p99 {p99:.2f} ms, max {samples[-1]:.2f} ms"
+        )
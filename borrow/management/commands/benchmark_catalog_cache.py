@@ -0,0 +1,74 @@
+import threading
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from borrow.models import Item, SimpleItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire rounds of concurrent catalog requests around an Item.save() and report the database "
+        "queries each round costs, with and without single-flight recomputation. "
+        "The items it creates are deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--rounds', type=int, default=3)
+        parser.add_argument('--items', type=int, default=200)
+
+    def handle(self, *args, **options):
+        items = [
+            SimpleItem.objects.create(
+                name=f'Benchmark Item {n:04}', quantity=5, location='Shed', instructions='-', photo='benchmark.jpg',
+            )
+            for n in range(options['items'])
+        ]
+        try:
+            with override_settings(ALLOWED_HOSTS=['*']):
+                for single_flight in (True, False):
+                    with override_settings(CATALOG_SINGLE_FLIGHT=single_flight):
+                        self.run(items[0], options['concurrency'], options['rounds'], single_flight)
+        finally:
+            Item.objects.filter(pk__in=[item.pk for item in items]).delete()
+            cache.clear()
+
+    def run(self, item, concurrency, rounds, single_flight):
+        cache.clear()
+        self.round(concurrency)
+        before = [self.round(concurrency) for _ in range(rounds)]
+        item.save()
+        after = [self.round(concurrency) for _ in range(rounds)]
+        label = 'on ' if single_flight else 'off'
+        self.stdout.write(
+            f"single-flight {label}: {concurrency} concurrent requests per round, "
+            f"queries per round before save {before}, after save {after}"
+        )
+
+    def round(self, concurrency):
+        barrier = threading.Barrier(concurrency)
+        counts = []
+
+        def count_queries(execute, sql, params, many, context):
+            counts.append(1)
+            return execute(sql, params, many, context)
+
+        def fetch():
+            client = Client()
+            try:
+                with connection.execute_wrapper(count_queries):
+                    barrier.wait()
+                    client.get(reverse('borrow:index'), secure=True)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=fetch) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(counts)
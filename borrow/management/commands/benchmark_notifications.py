@@ -0,0 +1,65 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from borrow.models import Librarian, Patron, SimpleItem
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the borrow POST, which notifies every librarian, as the librarian team grows. "
+        "Everything it creates is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--teams', type=int, nargs='+', default=[1, 10, 100, 500])
+        parser.add_argument('--requests', type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=['*']):
+                self.run(options['teams'], options['requests'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, teams, requests):
+        user = User.objects.create_user(username='benchmark-borrower')
+        Patron.objects.create(user=user, name='Benchmark Borrower', email='borrower@example.com')
+        item = SimpleItem.objects.create(
+            name='Benchmark Balls', quantity=10**6, location='Shed', instructions='-', photo='benchmark.jpg',
+        )
+        client = Client()
+        client.force_login(user)
+        url = reverse('borrow:borrow_item', args=[item.pk])
+
+        librarians = 0
+        for team in sorted(teams):
+            for n in range(librarians, team):
+                Librarian.objects.create(
+                    user=User.objects.create_user(username=f'benchmark-librarian-{n}'),
+                    name=f'Librarian {n}',
+                    email=f'librarian{n}@example.com',
+                )
+            librarians = team
+
+            samples = []
+            for _ in range(requests):
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    client.post(url, {'quantity': 1}, secure=True)
+                    samples.append((time.perf_counter() - start) * 1000)
+            self.stdout.write(
+                f"{team:>5} librarians: p50 {statistics.median(samples):.1f} ms, "
+                f"max {max(samples):.1f} ms, {len(queries)} queries per POST"
+            )
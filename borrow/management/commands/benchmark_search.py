@@ -0,0 +1,74 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from borrow.models import Item
+from borrow.search import FallbackSearch, ITEM_FIELDS, get_search
+
+WORDS = (
+    "ball basket soccer tennis racket net goal frisbee stick hockey lacrosse cone "
+    "pump bat glove helmet pad whistle rope hurdle mat shuttlecock paddle volleyball"
+).split()
+PLACES = "gym court field shed pool locker storage track".split()
+QUERIES = ["tennis", "hockey stick", "volleyball net", "paddle", "zzz no match"]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Time full-text search against icontains on a generated catalog (rolled back afterwards)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100_000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.seed(options['items'])
+                self.run(options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, count):
+        rng = random.Random(42)
+        start = time.perf_counter()
+        Item.objects.bulk_create(
+            (
+                Item(
+                    name=" ".join(rng.sample(WORDS, 2)).title(),
+                    location=rng.choice(PLACES),
+                    instructions=" ".join(rng.choices(WORDS, k=8)),
+                    photo='item_photos/benchmark.jpg',
+                )
+                for _ in range(count)
+            ),
+            batch_size=5000,
+        )
+        self.stdout.write(f"Seeded {count} items in {time.perf_counter() - start:.1f}s ({connection.vendor})")
+
+    def time(self, repeat, fn):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - start) * 1000)
+        return statistics.median(samples)
+
+    def run(self, repeat):
+        backend = get_search(Item)
+        fallback = FallbackSearch(Item, ITEM_FIELDS)
+        items = Item.objects.all()
+
+        self.stdout.write(f"{'query':<16}{'icontains count':>18}{'fts count':>12}{'fts top 10':>12}")
+        for query in QUERIES:
+            icontains = self.time(repeat, lambda: items.filter(fallback.matching_q(query)).count())
+            fts = self.time(repeat, lambda: items.filter(backend.matching_q(query)).count())
+            ranked = self.time(repeat, lambda: backend.ranked(items, query, 10))
+            self.stdout.write(f"{query:<16}{icontains:>15.1f} ms{fts:>9.1f} ms{ranked:>9.1f} ms")
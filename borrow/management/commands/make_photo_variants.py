@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from borrow.images import make_variants, needs_variants
+from borrow.models import Item, Patron
+
+
+def process(instance, field_name):
+    try:
+        return bool(make_variants(instance, field_name).get('jpeg'))
+    finally:
+        # Each worker thread has its own connection
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Make the resized WebP/JPEG copies and placeholders of every item and profile photo that has none "
+        "for its current file (or of all of them with --force), several photos at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--force', action='store_true', help="Remake copies that are already up to date.")
+
+    def handle(self, *args, **options):
+        jobs = []
+        for model, field_name in ((Item, 'photo'), (Patron, 'profile_photo')):
+            for instance in model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True}).iterator():
+                if options['force'] or needs_variants(instance, field_name):
+                    jobs.append((instance, field_name))
+
+        # Resizing and uploading spend their time in Pillow and network I/O, outside the GIL
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            results = list(pool.map(lambda job: process(*job), jobs))
+        made = sum(results)
+        self.stdout.write(f"Processed {len(jobs)} photo(s): {made} resized, {len(jobs) - made} could not be decoded.")
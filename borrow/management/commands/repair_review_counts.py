@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from borrow.reviews import recount_ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute every item's review count, rating sum and histogram from its reviews and fix the ones that drifted."
+
+    def handle(self, *args, **options):
+        fixed = recount_ratings()
+        self.stdout.write(f"Fixed {fixed} item(s).")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from borrow.notifications import recount_unread
+
+
+class Command(BaseCommand):
+    help = "Recompute every patron's unread-message counter from their messages and fix the ones that drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        fixed = recount_unread(batch_size=options['batch_size'])
+        self.stdout.write(f"Fixed {fixed} unread counter(s).")
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from borrow.loans import BATCH_SIZE, scan_loans
+from borrow.models import BorrowedItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Mark loans as due soon or overdue and remind their borrowers. Run it every few minutes, "
+        "from a scheduler or as a process with --every (see the loans entry in the Procfile)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--every', type=int, default=0, help="Keep scanning, waiting this many seconds between scans.")
+
+    def handle(self, *args, **options):
+        while True:
+            moved = scan_loans(batch_size=options['batch_size'])
+            self.stdout.write(
+                f"{moved[BorrowedItem.DUE_SOON]} loan(s) now due soon, {moved[BorrowedItem.OVERDUE]} now overdue."
+            )
+            if not options['every']:
+                break
+            time.sleep(options['every'])
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from borrow.inventory import InventoryError, start_reservation
+from borrow.models import BorrowRequest
+
+
+class Command(BaseCommand):
+    help = (
+        "Turn approved reservations whose window has started into loans. Run it every few minutes, "
+        "from a scheduler or as a process with --every (see the reservations entry in the Procfile)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=int, default=0, help="Keep going, waiting this many seconds between runs.")
+
+    def handle(self, *args, **options):
+        while True:
+            self.start_due()
+            if not options['every']:
+                break
+            time.sleep(options['every'])
+
+    def start_due(self):
+        now = timezone.now()
+        due = BorrowRequest.objects.filter(
+            status=BorrowRequest.APPROVED, loan__isnull=True, start_date__lte=now, end_date__gt=now,
+        ).select_related('item', 'borrower')
+
+        started = failed = 0
+        for borrow_request in due:
+            try:
+                start_reservation(borrow_request)
+                started += 1
+            except InventoryError as e:
+                failed += 1
+                self.stderr.write(f"Reservation {borrow_request.pk} ({borrow_request.item.name}): {e.message}")
+        self.stdout.write(f"Started {started} reservation(s), {failed} could not be handed out.")
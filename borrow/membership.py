@@ -0,0 +1,150 @@
+"""
+Keeping private collections disjoint.
+
+An item in a private collection may not be in any other collection. Each
+item carries this rule itself:
+
+* private_collection names the single private collection that owns it. It
+  is one column, so an item can never have two private owners.
+* shared_count counts the public collections it is in.
+* A check constraint forbids having both.
+
+The m2m_changed receivers below keep both columns in step for every way of
+changing membership (forms, admin, shell). Items are claimed with
+conditional UPDATEs, like the stock changes in borrow.inventory, so a
+conflict shows up in the row count. When two edits race, they serialize on
+the item rows and the loser fails instead of breaking the rule.
+
+collection_conflicts() checks a whole candidate item set in one query and
+reports every conflict together with the collection it conflicts with.
+Forms and views use it to explain a refusal up front.
+"""
+from django.core.exceptions import ValidationError
+from django.db.models import F
+from django.db.models.signals import m2m_changed, pre_delete
+from django.dispatch import receiver
+
+from .models import Collections, Item
+
+Membership = Collections.items_list.through
+
+
+class Conflict:
+    def __init__(self, item_name, collection_title, private, collection_id=None):
+        self.item_name = item_name
+        self.collection_title = collection_title
+        self.private = private
+        self.collection_id = collection_id
+
+    @property
+    def message(self):
+        if self.private:
+            return f"'{self.item_name}' is already in '{self.collection_title}'; private collections must be disjoint."
+        return f"'{self.item_name}' lives in private '{self.collection_title}'; public collections cannot include it."
+
+    def __str__(self):
+        return self.message
+
+
+class CollectionConflict(ValidationError):
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+        super().__init__([conflict.message for conflict in conflicts])
+
+
+def _ids(items):
+    return {item if isinstance(item, int) else item.pk for item in items}
+
+
+def collection_conflicts(items, private, collection=None):
+    """
+    Every reason `items` (Items or pks) cannot be in a collection that is
+    `private` or not. Items that are already in `collection` are not
+    checked, so an edit is only held back by what it adds. One query.
+    """
+    rows = Membership.objects.filter(item_id__in=_ids(items)).values_list(
+        'item_id', 'item__name', 'collections_id', 'collections__title', 'collections__is_collection_private'
+    ).order_by('item__name', 'collections__title')
+    current = {item_id for item_id, _, collection_id, _, _ in rows if collection and collection_id == collection.pk}
+    conflicts = []
+    for item_id, item_name, collection_id, title, other_private in rows:
+        if item_id in current:
+            continue
+        if private:
+            conflicts.append(Conflict(item_name, title, private=True, collection_id=collection_id))
+        elif other_private:
+            conflicts.append(Conflict(item_name, title, private=False, collection_id=collection_id))
+    return conflicts
+
+
+def claim(collection, item_ids):
+    """Record that `item_ids` join `collection`; raises CollectionConflict if any of them may not."""
+    item_ids = _ids(item_ids)
+    if not item_ids:
+        return
+    items = Item.objects.filter(pk__in=item_ids, private_collection__isnull=True)
+    if collection.is_collection_private:
+        claimed = items.filter(shared_count=0).update(private_collection=collection)
+    else:
+        claimed = items.update(shared_count=F('shared_count') + 1)
+    if claimed != len(item_ids):
+        # The UPDATE has changed only the rows that were free; raising rolls them back.
+        # Report the other collections holding them, including for items already in
+        # this one (a privacy switch claims the collection's own items)
+        conflicts = [
+            conflict for conflict in collection_conflicts(item_ids, collection.is_collection_private)
+            if conflict.collection_id != collection.pk
+        ]
+        raise CollectionConflict(conflicts)
+
+
+def release(collection, item_ids, private=None):
+    """Record that `item_ids` leave `collection` (which was `private`, by default its current setting)."""
+    item_ids = _ids(item_ids)
+    if not item_ids:
+        return
+    private = collection.is_collection_private if private is None else private
+    if private:
+        Item.objects.filter(pk__in=item_ids, private_collection=collection).update(private_collection=None)
+    else:
+        Item.objects.filter(pk__in=item_ids, shared_count__gt=0).update(shared_count=F('shared_count') - 1)
+
+
+def privacy_changed(collection):
+    """Move the collection's items over after it switched between public and private."""
+    item_ids = list(collection.items_list.values_list('pk', flat=True))
+    release(collection, item_ids, private=not collection.is_collection_private)
+    claim(collection, item_ids)
+
+
+@receiver(m2m_changed, sender=Membership)
+def items_list_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # pre_add runs inside the same transaction as the INSERT, so a conflict stops it
+    if action == 'pre_add':
+        if reverse:
+            for collection in Collections.objects.filter(pk__in=pk_set):
+                claim(collection, [instance.pk])
+        else:
+            claim(instance, pk_set)
+    elif action == 'pre_remove':
+        # remove() passes every id it was given, members or not; only release
+        # the real memberships, read before the DELETE in the same transaction
+        if reverse:
+            member_of = Membership.objects.filter(item_id=instance.pk, collections_id__in=pk_set)
+            for collection in Collections.objects.filter(pk__in=member_of.values('collections_id')):
+                release(collection, [instance.pk])
+        else:
+            release(instance, Membership.objects.filter(
+                collections_id=instance.pk, item_id__in=pk_set
+            ).values_list('item_id', flat=True))
+    elif action == 'pre_clear':
+        if reverse:
+            Item.objects.filter(pk=instance.pk).update(private_collection=None, shared_count=0)
+        else:
+            release(instance, instance.items_list.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Collections)
+def collection_deleted(sender, instance, **kwargs):
+    # Deleting a collection removes its memberships without m2m_changed
+    release(instance, instance.items_list.values_list('pk', flat=True))
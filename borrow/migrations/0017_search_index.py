@@ -0,0 +1,92 @@
+from django.db import migrations
+
+# Frozen copy of the index definitions in borrow.search as of this migration,
+# so later changes there do not alter what this migration does. Changing the
+# definitions needs a new migration.
+TABLES = {
+    'borrow_item': ('name', 'location', 'instructions'),
+    'borrow_collections': ('title', 'description'),
+}
+
+
+def install_postgres_index(cursor):
+    for table, fields in TABLES.items():
+        vector = ' || '.join(
+            f"setweight(to_tsvector('english', coalesce({field}, '')), '{weight}')"
+            for field, weight in zip(fields, 'ABC')
+        )
+        cursor.execute(
+            f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector '
+            f'GENERATED ALWAYS AS ({vector}) STORED'
+        )
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {table}_search_idx ON {table} USING GIN (search_vector)')
+
+
+def uninstall_postgres_index(cursor):
+    for table in TABLES:
+        cursor.execute(f'DROP INDEX IF EXISTS {table}_search_idx')
+        cursor.execute(f'ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector')
+
+
+def install_sqlite_index(cursor):
+    for table, fields in TABLES.items():
+        fts = f'{table}_fts'
+        columns = ', '.join(fields)
+        new_values = ', '.join(f'new.{field}' for field in fields)
+        old_values = ', '.join(f'old.{field}' for field in fields)
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({columns}, content='{table}', "
+            f"content_rowid='id', tokenize='porter unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN '
+            f'INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values}); END'
+        )
+        cursor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN '
+            f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END"
+        )
+        cursor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN '
+            f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+            f'INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values}); END'
+        )
+        # Index the rows that already exist
+        cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def uninstall_sqlite_index(cursor):
+    for table in TABLES:
+        fts = f'{table}_fts'
+        for suffix in ('ai', 'ad', 'au'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+        cursor.execute(f'DROP TABLE IF EXISTS {fts}')
+
+
+def forwards(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    with schema_editor.connection.cursor() as cursor:
+        if vendor == 'postgresql':
+            install_postgres_index(cursor)
+        elif vendor == 'sqlite':
+            install_sqlite_index(cursor)
+
+
+def backwards(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    with schema_editor.connection.cursor() as cursor:
+        if vendor == 'postgresql':
+            uninstall_postgres_index(cursor)
+        elif vendor == 'sqlite':
+            uninstall_sqlite_index(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrow', '0016_item_name_id_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
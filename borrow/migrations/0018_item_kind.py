@@ -0,0 +1,27 @@
+# Generated by Django 5.1.5 on 2026-10-18 14:09
+
+from django.db import migrations, models
+
+
+def set_kinds(apps, schema_editor):
+    Item = apps.get_model('borrow', 'Item')
+    SimpleItem = apps.get_model('borrow', 'SimpleItem')
+    ComplexItem = apps.get_model('borrow', 'ComplexItem')
+    Item.objects.filter(pk__in=SimpleItem.objects.values('pk')).update(kind='SIMPLE')
+    Item.objects.filter(pk__in=ComplexItem.objects.values('pk')).update(kind='COMPLEX')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrow', '0017_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='kind',
+            field=models.CharField(blank=True, choices=[('SIMPLE', 'Simple Item'), ('COMPLEX', 'Complex Item')], db_index=True, editable=False, help_text='Which subclass (SimpleItem/ComplexItem) this item is', max_length=7),
+        ),
+        migrations.RunPython(set_kinds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.5 on 2026-10-18 14:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrow', '0018_item_kind'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='borrowrequest',
+            name='end_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='borrowrequest',
+            name='loan',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='borrow_request', to='borrow.borroweditem'),
+        ),
+        migrations.AddField(
+            model_name='borrowrequest',
+            name='start_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='borroweditem',
+            index=models.Index(fields=['item', 'due_date'], name='borroweditem_item_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowrequest',
+            index=models.Index(fields=['item', 'start_date', 'end_date'], name='borrowrequest_window_idx'),
+        ),
+    ]
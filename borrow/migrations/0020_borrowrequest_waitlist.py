@@ -0,0 +1,22 @@
+# Generated by Django 5.1.5 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrow', '0019_reservation_windows'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='borrowrequest',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('APPROVED', 'Approved'), ('REJECTED', 'Rejected'), ('WAITLISTED', 'Waitlisted')], default='PENDING', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='borrowrequest',
+            index=models.Index(fields=['item', 'status', 'date'], name='borrowrequest_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.5 on 2026-10-18 14:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrow', '0020_borrowrequest_waitlist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='borroweditem',
+            name='status',
+            field=models.CharField(choices=[('ON_LOAN', 'On loan'), ('DUE_SOON', 'Due soon'), ('OVERDUE', 'Overdue')], default='ON_LOAN', max_length=8),
+        ),
+        migrations.AddIndex(
+            model_name='borroweditem',
+            index=models.Index(fields=['returned', 'due_date'], name='borroweditem_returned_due_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.5 on 2026-10-18 14:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrow', '0021_borroweditem_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='audience',
+            field=models.CharField(blank=True, choices=[('LIBRARIANS', 'All librarians')], max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='recipient',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='borrow.patron'),
+        ),
+        migrations.CreateModel(
+            name='MessageReceipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('read_at', models.DateTimeField(auto_now_add=True)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='receipts', to='borrow.message')),
+                ('patron', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_receipts', to='borrow.patron')),
+            ],
+            options={
+                'unique_together': {('message', 'patron')},
+            },
+        ),
+    ]
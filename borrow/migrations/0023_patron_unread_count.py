@@ -0,0 +1,37 @@
+# Generated by Django 5.1.5 on 2026-10-18 14:28
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_unread(apps, schema_editor):
+    Patron = apps.get_model('borrow', 'Patron')
+    Librarian = apps.get_model('borrow', 'Librarian')
+    Message = apps.get_model('borrow', 'Message')
+    MessageReceipt = apps.get_model('borrow', 'MessageReceipt')
+    broadcasts = Message.objects.filter(recipient__isnull=True).count()
+    for row in Message.objects.filter(read=False, recipient__isnull=False).values('recipient').annotate(n=Count('pk')):
+        Patron.objects.filter(pk=row['recipient']).update(unread_count=row['n'])
+    read = dict(
+        MessageReceipt.objects.values('patron').annotate(n=Count('pk')).values_list('patron', 'n')
+    )
+    for librarian_id in Librarian.objects.values_list('pk', flat=True):
+        Patron.objects.filter(pk=librarian_id).update(
+            unread_count=models.F('unread_count') + broadcasts - read.get(librarian_id, 0)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrow', '0022_message_broadcasts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patron',
+            name='unread_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_unread, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.5 on 2026-10-18 14:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrow', '0024_message_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='digest_key',
+            field=models.CharField(blank=True, max_length=30),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='digest_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='event_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['digest_key', 'digest_until'], name='message_digest_idx'),
+        ),
+    ]
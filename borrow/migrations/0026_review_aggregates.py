@@ -0,0 +1,68 @@
+# Generated by Django 5.1.5 on 2026-10-18 14:50
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_reviews(apps, schema_editor):
+    Item = apps.get_model('borrow', 'Item')
+    Review = apps.get_model('borrow', 'Review')
+    rows = Review.objects.values('item', 'rating').annotate(n=Count('pk')).order_by()
+    totals = {}
+    for row in rows:
+        total = totals.setdefault(row['item'], {'rating_sum': 0, 'review_count': 0})
+        total['rating_sum'] += row['rating'] * row['n']
+        total['review_count'] += row['n']
+        total[f"rating_{row['rating']}"] = row['n']
+    for item_id, fields in totals.items():
+        Item.objects.filter(pk=item_id).update(**fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrow', '0025_message_digests'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='rating_1',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_2',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_3',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_4',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_5',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_sum',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='review_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['item', '-created_at', '-id'], name='review_item_created_idx'),
+        ),
+        migrations.RunPython(count_reviews, migrations.RunPython.noop),
+    ]
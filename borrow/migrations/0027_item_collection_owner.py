@@ -0,0 +1,48 @@
+# Generated by Django 5.1.5 on 2026-10-18 14:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def record_owners(apps, schema_editor):
+    Item = apps.get_model('borrow', 'Item')
+    Membership = apps.get_model('borrow', 'Collections').items_list.through
+    counts = Membership.objects.values('item_id').annotate(
+        shared=Count('pk', filter=Q(collections__is_collection_private=False)),
+        private=Count('pk', filter=Q(collections__is_collection_private=True)),
+    ).order_by()
+    owners = dict(
+        Membership.objects.filter(collections__is_collection_private=True).values_list('item_id', 'collections_id')
+    )
+    for row in counts:
+        fields = {'shared_count': row['shared']}
+        # Items that already broke the rule keep their memberships but get no owner
+        if row['private'] == 1 and row['shared'] == 0:
+            fields['private_collection_id'] = owners[row['item_id']]
+        Item.objects.filter(pk=row['item_id']).update(**fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrow', '0026_review_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='private_collection',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='owned_items', to='borrow.collections'),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='shared_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(record_owners, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='item',
+            constraint=models.CheckConstraint(condition=models.Q(('private_collection__isnull', True), ('shared_count', 0), _connector='OR'), name='item_private_collection_exclusive'),
+        ),
+    ]
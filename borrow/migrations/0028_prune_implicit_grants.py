@@ -0,0 +1,24 @@
+from django.db import migrations
+from django.db.models import Q
+
+
+def prune_grants(apps, schema_editor):
+    Collections = apps.get_model('borrow', 'Collections')
+    Librarian = apps.get_model('borrow', 'Librarian')
+    Grant = Collections.allowed_users.through
+    # Public collections are open to everyone and librarians open any
+    # collection, so these rows only ever copied what access already implies
+    Grant.objects.filter(
+        Q(collections__is_collection_private=False) | Q(patron_id__in=Librarian.objects.values('pk'))
+    ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrow', '0027_item_collection_owner'),
+    ]
+
+    operations = [
+        migrations.RunPython(prune_grants, migrations.RunPython.noop),
+    ]
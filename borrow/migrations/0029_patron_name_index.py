@@ -0,0 +1,19 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrow', '0028_prune_implicit_grants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patron',
+            index=models.Index(fields=['name', 'id'], name='patron_name_id_idx'),
+        ),
+    ]
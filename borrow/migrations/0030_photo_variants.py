@@ -0,0 +1,23 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrow', '0029_patron_name_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='photo_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='patron',
+            name='profile_photo_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+
+
+def backfill_status(apps, schema_editor):
+    # Loans already late or nearly due when the status column was added. Moving
+    # them here, and not in the first scan_loans run, also means no reminders
+    # go out for loans that were overdue long before reminders existed
+    BorrowedItem = apps.get_model('borrow', 'BorrowedItem')
+    now = timezone.now()
+    outstanding = BorrowedItem.objects.filter(returned=False)
+    outstanding.filter(due_date__lt=now).exclude(status='OVERDUE').update(status='OVERDUE')
+    window = timedelta(hours=getattr(settings, 'LOAN_DUE_SOON_HOURS', 48))
+    outstanding.filter(due_date__gte=now, due_date__lt=now + window, status='ON_LOAN').update(status='DUE_SOON')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrow', '0031_borrowrequest_cancelled'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_status, migrations.RunPython.noop),
+    ]
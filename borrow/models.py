@@ -1,8 +1,74 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Exists, F, OuterRef, Q, When
 from django.utils import timezone
 from datetime import timedelta
 from django.contrib.auth.models import User
-from django.core.exceptions import ValidationError
+
+
+class ItemQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        """
+        Restrict to the items `user` may see, without a per-item permission check.
+
+        Items outside every private collection are always visible, librarians see
+        everything, and other signed-in users additionally see items from the
+        private collections they were granted. This costs one Librarian lookup
+        plus a single query with membership subqueries.
+        """
+        if user.is_authenticated and Librarian.objects.filter(user=user).exists():
+            return self
+
+        memberships = Collections.items_list.through.objects.filter(
+            collections__is_collection_private=True
+        )
+        private_items = memberships.values('item_id')
+        if not user.is_authenticated:
+            return self.exclude(pk__in=private_items)
+
+        granted_items = memberships.filter(
+            collections__allowed_users__user=user
+        ).values('item_id')
+        return self.exclude(Q(pk__in=private_items) & ~Q(pk__in=granted_items))
+
+    def polymorphic(self):
+        """
+        Yield SimpleItem/ComplexItem instances instead of plain Items, picked by
+        the `kind` column. The subclasses' own fields are joined into the same
+        query, so telling the kinds apart never costs extra queries.
+        """
+        annotations = {}
+        for model in Item.kind_models().values():
+            for field in model._meta.local_concrete_fields:
+                if not field.primary_key:
+                    annotations[f'{model._meta.model_name}_{field.attname}'] = F(f'{model._meta.model_name}__{field.attname}')
+        queryset = self.annotate(**annotations)
+        queryset._iterable_class = PolymorphicItemIterable
+        return queryset
+
+
+class PolymorphicItemIterable(models.query.ModelIterable):
+    def __iter__(self):
+        kind_models = Item.kind_models()
+        for item in super().__iter__():
+            model = kind_models.get(item.kind)
+            yield item if model is None else self.downcast(item, model)
+
+    @staticmethod
+    def downcast(item, model):
+        prefix = f'{model._meta.model_name}_'
+        values = []
+        for field in model._meta.concrete_fields:
+            if field.primary_key:
+                values.append(item.pk)
+            elif field.model is model:
+                values.append(getattr(item, prefix + field.attname))
+            else:
+                values.append(getattr(item, field.attname))
+        child = model.from_db(item._state.db, None, values)
+        # Keep other annotations and cached relations
+        for key, value in item.__dict__.items():
+            child.__dict__.setdefault(key, value)
+        return child
 
 
 class Item(models.Model):
@@ -18,6 +84,17 @@ class Item(models.Model):
         (CATEGORY_OTHER,  'Other Sporting Equipment'),
     ]
 
+    SIMPLE  = 'SIMPLE'
+    COMPLEX = 'COMPLEX'
+
+    KIND_CHOICES = [
+        (SIMPLE,  'Simple Item'),
+        (COMPLEX, 'Complex Item'),
+    ]
+
+    # Set by the subclasses so every row records which child table it has
+    KIND = ''
+
     name = models.CharField(max_length=200)
     quantity = models.IntegerField(default=1)
     location = models.CharField(max_length=200)
@@ -32,6 +109,84 @@ class Item(models.Model):
         help_text="Used for grouping in browse and picking the right form"
     )
 
+    kind = models.CharField(
+        max_length=7,
+        choices=KIND_CHOICES,
+        blank=True,
+        editable=False,
+        db_index=True,
+        help_text="Which subclass (SimpleItem/ComplexItem) this item is"
+    )
+
+    # Review aggregates, kept in step by borrow.reviews in the same transaction
+    # as the review itself, so item pages never scan the reviews to show them
+    rating_sum = models.IntegerField(default=0, editable=False)
+    review_count = models.IntegerField(default=0, editable=False)
+    rating_1 = models.IntegerField(default=0, editable=False)
+    rating_2 = models.IntegerField(default=0, editable=False)
+    rating_3 = models.IntegerField(default=0, editable=False)
+    rating_4 = models.IntegerField(default=0, editable=False)
+    rating_5 = models.IntegerField(default=0, editable=False)
+
+    # Collection membership, kept in step by borrow.membership: the private
+    # collection that owns the item (at most one) and how many public ones it is in
+    private_collection = models.ForeignKey(
+        'Collections', null=True, blank=True, on_delete=models.SET_NULL, editable=False, related_name='owned_items'
+    )
+    shared_count = models.IntegerField(default=0, editable=False)
+
+    # Resized copies of the photo, recorded by borrow.images
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    # Only ever changed with update(); save() leaves them alone so a stale
+    # instance cannot write old values back
+    COUNTER_FIELDS = (
+        'rating_sum', 'review_count', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5',
+        'private_collection', 'shared_count', 'photo_variants',
+    )
+
+    objects = ItemQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Backs keyset pagination of the catalog, which orders by (name, id)
+            models.Index(fields=['name', 'id'], name='item_name_id_idx'),
+        ]
+        constraints = [
+            # An item owned by a private collection is in no other collection
+            models.CheckConstraint(
+                condition=Q(private_collection__isnull=True) | Q(shared_count=0),
+                name='item_private_collection_exclusive',
+            ),
+        ]
+
+    @staticmethod
+    def kind_models():
+        return {Item.SIMPLE: SimpleItem, Item.COMPLEX: ComplexItem}
+
+    @property
+    def is_simple(self):
+        return self.kind == Item.SIMPLE
+
+    @property
+    def is_complex(self):
+        return self.kind == Item.COMPLEX
+
+    @property
+    def average_rating(self):
+        if not self.review_count:
+            return 0
+        return round(self.rating_sum / self.review_count, 1)
+
+    @property
+    def rating_histogram(self):
+        """(stars, count, percent) from 5 stars down to 1."""
+        histogram = []
+        for stars in range(5, 0, -1):
+            count = getattr(self, f'rating_{stars}')
+            histogram.append((stars, count, round(100 * count / self.review_count) if self.review_count else 0))
+        return histogram
+
     def list_borrowers(self):
         borrowed_items = BorrowedItem.objects.filter(item=self)
         borrowers = [borrowed_item.borrower for borrowed_item in borrowed_items]
@@ -41,25 +196,21 @@ class Item(models.Model):
     def is_in_private_collection(self):
         return self.collections.filter(is_collection_private=True).exists()
 
-    def can_view(self, user):
-        if not self.is_in_private_collection:
-            return True
-
-        if not user.is_authenticated:
-            return False
-
-        from .models import Librarian
-        if Librarian.objects.filter(user=user).exists():
-            return True
-
-        for col in self.collections.filter(is_collection_private=True):
-            if col.can_view(user):
-                return True
-        return False
+    def save(self, *args, **kwargs):
+        if self.KIND:
+            self.kind = self.KIND
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        # Delete the photo from AWS S3
+        # Delete the photo and its resized copies from AWS S3
+        from .images import delete_variants
         if self.photo:
+            delete_variants(self.photo.storage, self.photo_variants)
             self.photo.delete(save=False)
         
         # Call the parent class delete
@@ -69,6 +220,7 @@ class Item(models.Model):
         return self.name
 
 class SimpleItem(Item):
+    KIND = Item.SIMPLE
     
     def list_borrowers(self):
         borrowed_items = BorrowedItem.objects.filter(item=self)
@@ -79,6 +231,8 @@ class SimpleItem(Item):
         return self.name
 
 class ComplexItem(Item):
+    KIND = Item.COMPLEX
+
     NEW_CONDITION   = 'NEW'
     GOOD_CONDITION  = 'GOOD'
     FAIR_CONDITION    = 'FAIR'
@@ -112,72 +266,52 @@ class Patron(models.Model):
     name = models.CharField(max_length=200)
     email = models.CharField(max_length=200)
     profile_photo = models.ImageField(upload_to='profile_photos/', null=True, blank=True)
+    # Resized copies of the profile photo, recorded by borrow.images
+    profile_photo_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # Unread messages in this patron's inbox, kept in step by borrow.notifications and
+    # Message.mark_read(); repair_unread_counts fixes any drift
+    unread_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Backs keyset pagination of the patron picker, which orders by (name, id)
+            models.Index(fields=['name', 'id'], name='patron_name_id_idx'),
+        ]
     
+    # These go through borrow.inventory, which changes stock with conditional
+    # UPDATEs inside a transaction; they return False instead of raising.
+
     def borrow_simple_item(self, simple_item, quantity, days_to_return=7):
-        if simple_item.quantity >= quantity: 
-            due_date = timezone.now() + timedelta(days=days_to_return)
-            borrowed_item = BorrowedItem.objects.create(
-                borrower=self,
-                item=simple_item, 
-                quantity=quantity,
-                due_date=due_date,
-                item_type = 'SIMPLE'
-            )
-            simple_item.quantity -= quantity
-            simple_item.save()
-            return True
-        return False
+        from .inventory import InventoryError, reserve
+        try:
+            reserve(self, simple_item, quantity, days_to_return, item_type='SIMPLE')
+        except InventoryError:
+            return False
+        return True
 
     def borrow_complex_item(self, complex_item, days_to_return=7):
-        if complex_item.quantity >= 1:
-            due_date = timezone.now() + timedelta(days=days_to_return)
-            borrowed_item = BorrowedItem.objects.create(
-                borrower=self,
-                item=complex_item,
-                quantity=1,
-                due_date=due_date,
-                item_type='COMPLEX'
-            )
-            complex_item.quantity -= 1
-            complex_item.save()
-            return True
-        return False
+        from .inventory import InventoryError, reserve
+        try:
+            reserve(self, complex_item, 1, days_to_return, item_type='COMPLEX')
+        except InventoryError:
+            return False
+        return True
 
     def return_simple_item(self, simple_item, quantity):
-        borrowed_item = BorrowedItem.objects.filter(
-            borrower=self,
-            item=simple_item
-        ).first()
-
-        if borrowed_item and borrowed_item.quantity >= quantity:
-            borrowed_item.quantity -= quantity
-            borrowed_item.save()
-
-            if borrowed_item.quantity == 0:
-                borrowed_item.delete()
-            
-            simple_item.quantity += quantity
-            simple_item.save()
-            return True
-        return False
+        from .inventory import InventoryError, return_quantity
+        try:
+            return_quantity(self, simple_item, quantity)
+        except InventoryError:
+            return False
+        return True
 
     def return_complex_item(self, complex_item, quantity):
-        borrowed_item = BorrowedItem.objects.filter(
-            borrower=self,
-            item=complex_item
-        ).first()
-
-        if borrowed_item and borrowed_item.quantity >= quantity:
-            borrowed_item.quantity -= quantity
-            borrowed_item.save()
-
-            if borrowed_item.quantity == 0:
-                borrowed_item.delete()
-            
-            complex_item.quantity += quantity
-            complex_item.save()
-            return True
-        return False
+        from .inventory import InventoryError, return_quantity
+        try:
+            return_quantity(self, complex_item, quantity)
+        except InventoryError:
+            return False
+        return True
 
     def __str__(self):
         return self.name
@@ -189,17 +323,35 @@ class BorrowedItem(models.Model):
         ('COMPLEX', 'Complex Item'),
     ]
     
+    ON_LOAN = 'ON_LOAN'
+    DUE_SOON = 'DUE_SOON'
+    OVERDUE = 'OVERDUE'
+
+    STATUS_CHOICES = [
+        (ON_LOAN, 'On loan'),
+        (DUE_SOON, 'Due soon'),
+        (OVERDUE, 'Overdue'),
+    ]
+
     borrower = models.ForeignKey(Patron, on_delete=models.CASCADE)
     item = models.ForeignKey('Item', on_delete=models.CASCADE)
     quantity = models.IntegerField()
     due_date = models.DateTimeField()
     returned = models.BooleanField(default=False)
     item_type = models.CharField(max_length=7, choices=BORROWED_ITEM_TYPES)
+    # Kept up to date by the scan_loans command, which also sends the reminders
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=ON_LOAN)
+
+    class Meta:
+        indexes = [
+            # Scheduled returns per item, for the reservation calendar
+            models.Index(fields=['item', 'due_date'], name='borroweditem_item_due_idx'),
+            # Outstanding loans by due date, for the overdue/due-soon scan
+            models.Index(fields=['returned', 'due_date'], name='borroweditem_returned_due_idx'),
+        ]
 
     def __str__(self):
-        if self.item_type == 'SIMPLE':
-            return f"{self.borrower.name} borrowed {self.quantity} of {self.item.simpleitem.name}"
-        return f"{self.borrower.name} borrowed {self.quantity} of {self.item.complexitem.name}"
+        return f"{self.borrower.name} borrowed {self.quantity} of {self.item.name}"
 
     def is_late(self):
         if self.returned:
@@ -215,11 +367,17 @@ class BorrowRequest(models.Model):
     PENDING = 'PENDING'
     APPROVED = 'APPROVED'
     REJECTED = 'REJECTED'
+    # Filed while the item was out of stock; lent automatically, oldest first, once stock frees up
+    WAITLISTED = 'WAITLISTED'
+    # Withdrawn from the waitlist by the borrower
+    CANCELLED = 'CANCELLED'
 
     STATUS_CHOICES = [
         (PENDING, 'Pending'),
         (APPROVED, 'Approved'),
         (REJECTED, 'Rejected'),
+        (WAITLISTED, 'Waitlisted'),
+        (CANCELLED, 'Cancelled'),
     ]
 
     borrower = models.ForeignKey(Patron, on_delete=models.CASCADE)
@@ -231,10 +389,40 @@ class BorrowRequest(models.Model):
         choices=STATUS_CHOICES,
         default=PENDING
     )
+    # Optional reservation window; without one the item is lent as soon as the request is approved
+    start_date = models.DateTimeField(null=True, blank=True)
+    end_date = models.DateTimeField(null=True, blank=True)
+    # The loan this request turned into, once the item has been handed out
+    loan = models.OneToOneField(
+        'BorrowedItem',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='borrow_request'
+    )
+
+    class Meta:
+        indexes = [
+            # Backs the overlap lookups of the reservation calendar
+            models.Index(fields=['item', 'start_date', 'end_date'], name='borrowrequest_window_idx'),
+            # Walks an item's waitlist in arrival order
+            models.Index(fields=['item', 'status', 'date'], name='borrowrequest_queue_idx'),
+        ]
 
     def __str__(self):
         return f"Request by {self.borrower.name} for {self.quantity} of {self.item.name} - {self.status}"
 
+    @property
+    def is_reservation(self):
+        return self.start_date is not None and self.start_date > timezone.now()
+
+    @property
+    def last_day(self):
+        """The last calendar day of the window; end_date itself is exclusive."""
+        if self.end_date is None:
+            return None
+        return timezone.localtime(self.end_date - timedelta(microseconds=1)).date()
+
     def approve(self):
         self.status = self.APPROVED
         self.save()
@@ -264,6 +452,8 @@ class Collections(models.Model):
     items_list = models.ManyToManyField(Item, blank=True, related_name="collections")
     is_collection_private = models.BooleanField(default=False)
     creator = models.ForeignKey(Patron, on_delete=models.CASCADE, related_name='creator')
+    # Only real grants: public collections are open to everyone and librarians
+    # may open any collection without a row here
     allowed_users = models.ManyToManyField(
         Patron,
         blank=True,
@@ -271,51 +461,27 @@ class Collections(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True, null=True)
 
-    def can_view(self, user):
-        if not self.is_collection_private:
+    def is_open_to(self, patron, is_librarian=False):
+        """Whether `patron` (None when signed out) may see the items: by role, by being the creator, or by a grant."""
+        if not self.is_collection_private or is_librarian:
             return True
-        if not user.is_authenticated:
+        if patron is None:
             return False
-        from .models import Librarian
-        if Librarian.objects.filter(user=user).exists():
-            return True
-        return self.allowed_users.filter(pk=user.patron.pk).exists()
-
-    def clean(self):
-        """
-        Only validate *newly added* items against the private/public-collection rules.
-        This lets you remove items freely even if they were previously in a private collection.
-        """
-        if not self.pk:
-            return
-        
-        orig = Collections.objects.get(pk=self.pk)
-        old_items = set(orig.items_list.all())
-        new_items = set(self.items_list.all()) - old_items
-        for item in new_items:
-            qs = Collections.objects.filter(items_list=item)
-            if self.pk:
-                qs = qs.exclude(pk=self.pk)
-
-            if self.is_collection_private:
-                if qs.exists():
-                    raise ValidationError(
-                        f"Item '{item.name}' is already in another collection "
-                        f"and cannot be added to a private collection."
-                    )
-            else:
-                priv = qs.filter(is_collection_private=True).first()
-                if priv:
-                    raise ValidationError(
-                        f"Item '{item.name}' is in private collection "
-                        f"'{priv.title}' and cannot be added to this public collection."
-                    )
-
-        super().clean()
+        return patron.pk == self.creator_id or self.allowed_users.filter(pk=patron.pk).exists()
 
     def save(self, *args, **kwargs):
-        self.full_clean()
-        super().save(*args, **kwargs)
+        # Which items may join is checked by borrow.membership as they are added
+        from .membership import privacy_changed
+        was_private = None
+        if self.pk:
+            was_private = Collections.objects.filter(pk=self.pk).values_list('is_collection_private', flat=True).first()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if was_private is not None and was_private != self.is_collection_private:
+                privacy_changed(self)
+                if not self.is_collection_private:
+                    # Everyone may see a public collection; its grants mean nothing now
+                    self.allowed_users.clear()
 
     def __str__(self):
         return self.title
@@ -368,21 +534,134 @@ class Review(models.Model):
     
     class Meta:
         unique_together = ('item', 'reviewer')
-        
+        indexes = [
+            # Backs the item page's keyset-paginated review list, newest first
+            models.Index(fields=['item', '-created_at', '-id'], name='review_item_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.reviewer.name}'s review of {self.item.name}"
 
+class MessageQuerySet(models.QuerySet):
+    def inbox(self, patron):
+        """
+        What `patron` sees in their inbox: messages addressed to them plus, for
+        librarians, every librarian broadcast. Each row is annotated with
+        is_read, which for a broadcast comes from the patron's own receipt.
+        """
+        is_librarian = Exists(Librarian.objects.filter(pk=patron.pk))
+        has_receipt = Exists(MessageReceipt.objects.filter(message=OuterRef('pk'), patron=patron))
+        return self.filter(
+            Q(recipient=patron) | Q(recipient__isnull=True, audience=Message.LIBRARIANS) & Q(is_librarian)
+        ).annotate(
+            is_read=Case(
+                When(recipient__isnull=False, then=F('read')),
+                default=has_receipt,
+                output_field=models.BooleanField(),
+            )
+        )
+
+    def mark_read(self, patron):
+        """
+        Mark every message in this inbox queryset as read by `patron`: one
+        UPDATE for their own messages, one INSERT of receipts for broadcasts.
+        Returns how many changed.
+        """
+        unread = self.filter(is_read=False).order_by()
+        with transaction.atomic():
+            # Serialise read-state changes per patron so the counter stays exact
+            Patron.objects.select_for_update().filter(pk=patron.pk).exists()
+            direct = Message.objects.filter(
+                pk__in=unread.filter(recipient=patron).values('pk'), read=False
+            ).update(read=True)
+            receipts = MessageReceipt.objects.bulk_create([
+                MessageReceipt(message_id=message_id, patron=patron)
+                for message_id in unread.filter(recipient__isnull=True).values_list('pk', flat=True)
+            ])
+            changed = direct + len(receipts)
+            if changed:
+                Patron.objects.filter(pk=patron.pk).update(unread_count=F('unread_count') - changed)
+        return changed
+
+
 class Message(models.Model):
-    recipient = models.ForeignKey(Patron, on_delete=models.CASCADE, related_name='messages')
+    # A broadcast is stored once with no recipient; each reader's read state lives in MessageReceipt
+    LIBRARIANS = 'LIBRARIANS'
+
+    AUDIENCE_CHOICES = [
+        (LIBRARIANS, 'All librarians'),
+    ]
+
+    recipient = models.ForeignKey(Patron, on_delete=models.CASCADE, related_name='messages', null=True, blank=True)
+    audience = models.CharField(max_length=10, choices=AUDIENCE_CHOICES, blank=True)
     sender = models.ForeignKey(Patron, on_delete=models.CASCADE, related_name='sent_messages', null=True, blank=True)
     subject = models.CharField(max_length=255)
     content = models.TextField()
     link = models.CharField(max_length=255, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     read = models.BooleanField(default=False)
+    # Digests: broadcasts that similar events are merged into until digest_until
+    digest_key = models.CharField(max_length=30, blank=True)
+    digest_until = models.DateTimeField(null=True, blank=True)
+    event_count = models.PositiveIntegerField(default=1)
+
+    objects = MessageQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pages of an inbox, newest first: one index for a patron's own
+            # messages, one for the librarian broadcasts
+            models.Index(fields=['recipient', '-created_at'], name='message_inbox_idx'),
+            models.Index(fields=['audience', '-created_at'], name='message_broadcast_idx'),
+            # Finds the digest still open for a kind of event
+            models.Index(fields=['digest_key', 'digest_until'], name='message_digest_idx'),
+        ]
         
     def __str__(self):
         return f"{self.subject} - {self.created_at.strftime('%Y-%m-%d %H:%M')}"
+
+    @property
+    def is_broadcast(self):
+        return self.recipient_id is None
+
+    def mark_read(self, patron, read=True):
+        """Set the read state as seen by `patron`, adjusting their unread count if it changed."""
+        with transaction.atomic():
+            if self.is_broadcast:
+                if read:
+                    _, changed = MessageReceipt.objects.get_or_create(message=self, patron=patron)
+                else:
+                    changed, _ = MessageReceipt.objects.filter(message=self, patron=patron).delete()
+            else:
+                changed = Message.objects.filter(pk=self.pk, read=not read).update(read=read)
+                self.read = read
+            if changed:
+                Patron.objects.filter(pk=patron.pk).update(unread_count=F('unread_count') + (-1 if read else 1))
+        self.is_read = read
+
+
+class MessageReceipt(models.Model):
+    """One librarian having read a broadcast Message."""
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='receipts')
+    patron = models.ForeignKey(Patron, on_delete=models.CASCADE, related_name='message_receipts')
+    read_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('message', 'patron')
+
+
+class ArchivedMessage(models.Model):
+    """
+    A message moved out of the inbox by archive_messages once it is past the
+    retention window. Only the content is kept: no read state, receipts or
+    inbox indexes.
+    """
+    recipient = models.ForeignKey(Patron, on_delete=models.CASCADE, related_name='archived_messages', null=True, blank=True)
+    audience = models.CharField(max_length=10, choices=Message.AUDIENCE_CHOICES, blank=True)
+    sender = models.ForeignKey(Patron, on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    subject = models.CharField(max_length=255)
+    content = models.TextField()
+    link = models.CharField(max_length=255, blank=True, null=True)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
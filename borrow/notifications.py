@@ -0,0 +1,215 @@
+"""
+Sending in-app messages.
+
+Every helper here also keeps Patron.unread_count in step, in the same
+transaction as the messages it creates. The unread badge then reads one
+column of one row instead of counting the inbox. recount_unread() rebuilds
+the counters from the messages themselves if they ever drift, and
+archive_messages() moves old messages out of the inbox tables.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import events
+from .models import ArchivedMessage, BorrowRequest, CollectionRequest, Librarian, Message, MessageReceipt, Patron
+
+# Kinds of librarian notification that are merged into digests: key -> subject once merged
+DIGESTS = {
+    'borrow_requests': "new borrow requests",
+    'collection_requests': "new collection access requests",
+}
+# The queue each digest links to, for its live count
+DIGEST_QUEUES = {
+    'borrow_requests': lambda: BorrowRequest.objects.filter(status=BorrowRequest.PENDING),
+    'collection_requests': lambda: CollectionRequest.objects.filter(status=CollectionRequest.PENDING),
+}
+
+
+def build_message(recipient, subject, content, link='', sender=None):
+    """An unsaved Message, for sending many at once with send_messages()."""
+    return Message(
+        recipient=recipient,
+        subject=subject,
+        content=content,
+        link=link,
+        sender=sender
+    )
+
+
+def _add_unread(recipient_ids):
+    """Bump the counters of `recipient_ids`, one UPDATE per distinct increment (usually one)."""
+    by_increment = defaultdict(list)
+    for patron_id, increment in Counter(recipient_ids).items():
+        by_increment[increment].append(patron_id)
+    for increment, patron_ids in by_increment.items():
+        Patron.objects.filter(pk__in=patron_ids).update(unread_count=F('unread_count') + increment)
+
+
+def send_messages(messages):
+    """Save a batch of unsaved Messages with one INSERT."""
+    with transaction.atomic():
+        messages = Message.objects.bulk_create(messages)
+        _add_unread([message.recipient_id for message in messages])
+    events.unread_changed(recipients=[message.recipient_id for message in messages])
+    return messages
+
+
+def send_message(recipient, subject, content, link='', sender=None):
+    """Helper function to send a message to a recipient"""
+    with transaction.atomic():
+        Message.objects.create(
+            recipient=recipient,
+            subject=subject,
+            content=content,
+            link=link,
+            sender=sender
+        )
+        _add_unread([recipient.pk])
+    events.unread_changed(recipients=[recipient.pk])
+
+
+def digest_window():
+    return timedelta(minutes=getattr(settings, 'LIBRARIAN_DIGEST_MINUTES', 15))
+
+
+def _merge_into_digest(digest, content, now):
+    """Fold one more event into an open digest and make it unread again for everyone."""
+    digest.event_count += 1
+    digest.subject = f"{digest.event_count} {DIGESTS[digest.digest_key]}"
+    digest.content = f"Latest: {content}"
+    digest.sender = None
+    # Newest first in every inbox
+    digest.created_at = now
+    Message.objects.filter(pk=digest.pk).update(
+        event_count=F('event_count') + 1,
+        subject=digest.subject,
+        content=digest.content,
+        sender=None,
+        created_at=now,
+    )
+    readers = list(MessageReceipt.objects.filter(message=digest).values_list('patron_id', flat=True))
+    if readers:
+        MessageReceipt.objects.filter(message=digest).delete()
+        Patron.objects.filter(pk__in=readers).update(unread_count=F('unread_count') + 1)
+    return digest
+
+
+def send_message_to_librarians(subject, content, link='', sender=None, digest=None):
+    """
+    Send a message to all librarians. It is stored once as a broadcast that
+    every librarian's inbox reads through Message.objects.inbox(), so the cost
+    does not grow with the number of librarians.
+
+    With a `digest` key (one of DIGESTS), messages sent within
+    LIBRARIAN_DIGEST_MINUTES of the first are merged into that one message
+    instead of adding a row each.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        open_digest = None
+        if digest and digest_window():
+            open_digest = Message.objects.select_for_update().filter(
+                recipient__isnull=True, digest_key=digest, digest_until__gt=now
+            ).order_by('-digest_until').first()
+        if open_digest is not None:
+            message = _merge_into_digest(open_digest, content, now)
+        else:
+            message = Message.objects.create(
+                audience=Message.LIBRARIANS,
+                subject=subject,
+                content=content,
+                link=link,
+                sender=sender,
+                digest_key=digest or '',
+                digest_until=now + digest_window() if digest else None,
+            )
+            Patron.objects.filter(librarian__isnull=False).update(unread_count=F('unread_count') + 1)
+    events.unread_changed(librarians=True)
+    return message
+
+
+def live_digest_counts(messages):
+    """
+    Attach `pending` (the current size of the queue a digest links to) to the
+    digests among `messages`. One COUNT per kind of digest shown.
+    """
+    digests = [message for message in messages if message.digest_key and message.event_count > 1]
+    queues = {}
+    for message in digests:
+        if message.digest_key not in queues:
+            queues[message.digest_key] = DIGEST_QUEUES[message.digest_key]().count()
+        message.pending = queues[message.digest_key]
+    return messages
+
+
+def recount_unread(patrons=None, batch_size=500):
+    """
+    Recompute unread_count for `patrons` (default: everyone) from their
+    messages in one query, and save the ones that had drifted in batches.
+    Returns how many were fixed.
+    """
+    patrons = Patron.objects.all() if patrons is None else patrons
+    broadcasts = Message.objects.filter(recipient__isnull=True, audience=Message.LIBRARIANS).count()
+    direct = Message.objects.filter(recipient=OuterRef('pk'), read=False).order_by().values('recipient').annotate(
+        n=Count('pk')
+    ).values('n')
+    read_broadcasts = MessageReceipt.objects.filter(
+        patron=OuterRef('pk'), message__recipient__isnull=True
+    ).order_by().values('patron').annotate(n=Count('pk')).values('n')
+    rows = patrons.annotate(
+        direct_unread=Coalesce(Subquery(direct, output_field=IntegerField()), 0),
+        read_broadcasts=Coalesce(Subquery(read_broadcasts, output_field=IntegerField()), 0),
+        is_librarian=Exists(Librarian.objects.filter(pk=OuterRef('pk'))),
+    ).values_list('pk', 'unread_count', 'direct_unread', 'read_broadcasts', 'is_librarian')
+
+    drifted = []
+    for patron_id, stored, direct_unread, read, is_librarian in rows.iterator(chunk_size=batch_size):
+        unread = direct_unread + (broadcasts - read if is_librarian else 0)
+        if unread != stored:
+            drifted.append(Patron(pk=patron_id, unread_count=unread))
+    Patron.objects.bulk_update(drifted, ['unread_count'], batch_size=batch_size)
+    return len(drifted)
+
+
+def archive_messages(days, batch_size=1000):
+    """
+    Move read messages older than `days` days into ArchivedMessage,
+    `batch_size` at a time. A broadcast counts as read once every librarian
+    has a receipt for it, so no unread count changes. Each batch is one
+    SELECT, one INSERT and one DELETE. Returns how many were archived.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    fields = ('pk', 'recipient_id', 'audience', 'sender_id', 'subject', 'content', 'link', 'created_at')
+    unread_by_someone = Librarian.objects.filter(
+        ~Exists(MessageReceipt.objects.filter(message=OuterRef(OuterRef('pk')), patron=OuterRef('pk')))
+    )
+    expired = Message.objects.filter(created_at__lt=cutoff).filter(
+        Q(recipient__isnull=False, read=True) | Q(recipient__isnull=True) & ~Exists(unread_by_someone)
+    ).order_by('pk')
+    archived = 0
+    while True:
+        with transaction.atomic():
+            rows = list(expired.values_list(*fields)[:batch_size])
+            if not rows:
+                break
+            ArchivedMessage.objects.bulk_create([
+                ArchivedMessage(**dict(zip(fields[1:], row[1:]))) for row in rows
+            ])
+            Message.objects.filter(pk__in=[row[0] for row in rows]).delete()
+        archived += len(rows)
+    return archived
+
+
+@receiver(post_save, sender=Librarian)
+def librarian_saved(sender, instance, created, **kwargs):
+    # A new librarian inherits every earlier broadcast as unread
+    if created:
+        recount_unread(Patron.objects.filter(pk=instance.pk))
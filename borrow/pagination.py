@@ -0,0 +1,96 @@
+import base64
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder rounds datetimes to milliseconds, which would skip rows
+    # whose timestamps differ only in the microseconds
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class KeysetPaginator:
+    """
+    Cursor (keyset) pagination over a fixed, unique ordering.
+
+    Instead of OFFSET, each page continues strictly after the last row of the
+    previous one, so fetching page 500 costs the same index range scan as page 1.
+    The ordering must end in a unique field (normally "pk") and should be
+    backed by a composite index. Cursors are opaque url-safe strings.
+    """
+
+    def __init__(self, ordering=('name', 'pk'), per_page=24):
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+
+    def _fields(self):
+        return [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    def encode_cursor(self, obj):
+        values = [getattr(obj, name) for name, _ in self._fields()]
+        raw = json.dumps(values, cls=CursorEncoder).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, queryset, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            values = json.loads(raw)
+        except (ValueError, TypeError) as exc:
+            raise InvalidCursor(cursor) from exc
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise InvalidCursor(cursor)
+
+        opts = queryset.model._meta
+        try:
+            return [
+                opts.pk.to_python(value) if name == 'pk' else opts.get_field(name).to_python(value)
+                for (name, _), value in zip(self._fields(), values)
+            ]
+        except Exception as exc:
+            raise InvalidCursor(cursor) from exc
+
+    def _after(self, values):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y), honouring descending fields
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(self._fields(), values):
+            lookup = f"{name}__lt" if descending else f"{name}__gt"
+            condition |= equal & Q(**{lookup: value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def paginate(self, queryset, cursor=None):
+        queryset = queryset.order_by(*self.ordering)
+        if cursor:
+            queryset = queryset.filter(self._after(self.decode_cursor(queryset, cursor)))
+
+        rows = list(queryset[:self.per_page + 1])
+        items = rows[:self.per_page]
+        next_cursor = self.encode_cursor(items[-1]) if len(rows) > self.per_page else None
+        return KeysetPage(items, next_cursor)
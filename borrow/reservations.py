@@ -0,0 +1,152 @@
+"""
+Reservation calendar: how many units of an item are free over a time window.
+
+An item's free units only change at a few instants: when a loan is due back,
+and when an approved reservation starts or ends. ItemCalendar loads just the
+events that can affect a window with one UNION ALL query. That query is
+backed by the (item, due_date) and (item, start_date, end_date) indexes.
+Availability is then answered with a sweep-line over those events, so the
+cost depends on what happens inside the window, not on the loan history.
+
+Loans are assumed to come back on their due date. Overdue loans count as gone
+until they are actually returned.
+"""
+import calendar
+from datetime import datetime, time, timedelta
+
+from django.db.models import CharField, DateTimeField, F, Value
+from django.utils import timezone
+
+from .models import BorrowedItem, BorrowRequest, Item
+
+SHELF = 'shelf'
+RETURN = 'return'
+BOOKING = 'booking'
+
+
+def _event_rows(queryset, kind, item, start, end, units):
+    """Shape one source of events as (kind, item_id, start, end, units) rows for the UNION."""
+    no_time = Value(None, output_field=DateTimeField())
+    return queryset.annotate(
+        event_kind=Value(kind, output_field=CharField()),
+        event_item=F(item),
+        event_start=F(start) if start else no_time,
+        event_end=F(end) if end else no_time,
+        event_units=F(units),
+    ).values_list('event_kind', 'event_item', 'event_start', 'event_end', 'event_units')
+
+
+class ItemCalendar:
+    def __init__(self, item_id, on_shelf=0):
+        self.item_id = item_id
+        self.on_shelf = on_shelf
+        self.returns = []   # (when, units)
+        self.bookings = []  # (start, end, units)
+
+    @classmethod
+    def load(cls, item_ids, start, end):
+        """Calendars for `item_ids` holding every event that can affect [start, end), from one query."""
+        now = timezone.now()
+        start = max(start, now)
+        shelf = _event_rows(Item.objects.filter(pk__in=item_ids), SHELF, 'pk', None, None, 'quantity')
+        returns = _event_rows(
+            BorrowedItem.objects.filter(item_id__in=item_ids, returned=False, due_date__gt=now, due_date__lt=end),
+            RETURN, 'item_id', 'due_date', None, 'quantity',
+        )
+        bookings = _event_rows(
+            BorrowRequest.objects.filter(
+                item_id__in=item_ids, status=BorrowRequest.APPROVED, loan__isnull=True,
+                start_date__lt=end, end_date__gt=start,
+            ),
+            BOOKING, 'item_id', 'start_date', 'end_date', 'quantity',
+        )
+
+        calendars = {}
+        for kind, item_id, event_start, event_end, units in shelf.union(returns, bookings, all=True):
+            item_calendar = calendars.setdefault(item_id, cls(item_id))
+            if kind == SHELF:
+                item_calendar.on_shelf = units
+            elif kind == RETURN:
+                item_calendar.returns.append((event_start, units))
+            else:
+                item_calendar.bookings.append((event_start, event_end, units))
+        return calendars
+
+    def book(self, start, end, units):
+        """Hold `units` over [start, end) for a reservation approved in memory."""
+        self.bookings.append((start, end, units))
+
+    def lend(self, due, units):
+        """Take `units` off the shelf now, to come back at `due`."""
+        self.on_shelf -= units
+        self.returns.append((due, units))
+
+    def _events(self):
+        events = list(self.returns)
+        for start, end, units in self.bookings:
+            events.append((start, -units))
+            events.append((end, units))
+        # Windows are half-open, so a unit coming back at t can go straight out again at t
+        events.sort(key=lambda event: (event[0], -event[1]))
+        return events
+
+    def free(self, start, end, events=None):
+        """The fewest units free at any moment of [start, end)."""
+        start = max(start, timezone.now())
+        events = self._events() if events is None else events
+        level = self.on_shelf
+        index = 0
+        while index < len(events) and events[index][0] <= start:
+            level += events[index][1]
+            index += 1
+        lowest = level
+        for when, delta in events[index:]:
+            if when >= end:
+                break
+            level += delta
+            lowest = min(lowest, level)
+        return max(lowest, 0)
+
+    def daily(self, first_day, days):
+        """[(date, free units)] for `days` consecutive local days from `first_day`."""
+        events = self._events()
+        result = []
+        for offset in range(days):
+            day = first_day + timedelta(days=offset)
+            start, end = day_window(day, day)
+            if end <= timezone.now():
+                result.append((day, None))
+            else:
+                result.append((day, self.free(start, end, events)))
+        return result
+
+
+def day_window(first_day, last_day):
+    """[start of `first_day`, start of the day after `last_day`) as aware datetimes."""
+    start = timezone.make_aware(datetime.combine(first_day, time.min))
+    end = timezone.make_aware(datetime.combine(last_day + timedelta(days=1), time.min))
+    return start, end
+
+
+def request_window(borrow_request, item=None):
+    """The [start, end) a request would hold its units for if approved now."""
+    item = item or borrow_request.item
+    now = timezone.now()
+    start = borrow_request.start_date if borrow_request.is_reservation else now
+    end = borrow_request.end_date or now + timedelta(days=item.days_to_return)
+    return start, max(end, start)
+
+
+def units_free(item, start, end):
+    """How many units of `item` are free for the whole of [start, end)."""
+    item_calendar = ItemCalendar.load([item.pk], start, end).get(item.pk)
+    return item_calendar.free(start, end) if item_calendar else 0
+
+
+def month_availability(item, year, month):
+    """[(date, free units)] for every day of a month; past days are None. One query."""
+    days = calendar.monthrange(year, month)[1]
+    first_day = datetime(year, month, 1).date()
+    start, end = day_window(first_day, first_day + timedelta(days=days - 1))
+    item_calendar = ItemCalendar.load([item.pk], start, end).get(item.pk, ItemCalendar(item.pk))
+    return item_calendar.daily(first_day, days)
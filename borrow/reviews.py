@@ -0,0 +1,85 @@
+"""
+Adding, changing and deleting reviews.
+
+Each item carries its review aggregates (rating_sum, review_count and a
+rating_1..rating_5 histogram). Every helper here changes them with F()
+updates in the same transaction as the review row, so the item page can
+show the average and the histogram straight from the Item it already loaded.
+recount_ratings() rebuilds them from the reviews if they ever drift, e.g.
+after reviews were deleted in the admin or along with their patron.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+from .models import Item, Review
+
+
+def _rating_field(rating):
+    return f'rating_{rating}'
+
+
+def _add_rating(item_id, rating, sign):
+    Item.objects.filter(pk=item_id).update(**{
+        'rating_sum': F('rating_sum') + sign * rating,
+        'review_count': F('review_count') + sign,
+        _rating_field(rating): F(_rating_field(rating)) + sign,
+    })
+
+
+def save_review(item, patron, rating, comment):
+    """Add `patron`'s review of `item`, or update the one they already wrote. Returns (review, created)."""
+    with transaction.atomic():
+        review = Review.objects.select_for_update().filter(item=item, reviewer=patron).first()
+        if review is None:
+            try:
+                # In a savepoint: a concurrent first review by the same patron
+                # can still win the unique (item, reviewer) constraint
+                with transaction.atomic():
+                    review = Review.objects.create(item=item, reviewer=patron, rating=rating, comment=comment)
+            except IntegrityError:
+                review = Review.objects.select_for_update().get(item=item, reviewer=patron)
+            else:
+                _add_rating(item.pk, rating, 1)
+                return review, True
+
+        previous = review.rating
+        review.rating = rating
+        review.comment = comment
+        review.save(update_fields=['rating', 'comment'])
+        if previous != rating:
+            _add_rating(item.pk, previous, -1)
+            _add_rating(item.pk, rating, 1)
+        return review, False
+
+
+def delete_review(review):
+    """Delete `review` and take it out of its item's aggregates, once."""
+    with transaction.atomic():
+        # The stored rating, in case `review` was loaded before it last changed
+        rating = Review.objects.select_for_update().filter(pk=review.pk).values_list('rating', flat=True).first()
+        if rating is None:
+            return False
+        Review.objects.filter(pk=review.pk).delete()
+        _add_rating(review.item_id, rating, -1)
+    return True
+
+
+def recount_ratings(items=None):
+    """Recompute the review aggregates of `items` (default: all) and save the ones that drifted. Returns how many."""
+    items = Item.objects.all() if items is None else items
+    fields = ['rating_sum', 'review_count'] + [_rating_field(stars) for stars in range(1, 6)]
+    counted = {}
+    rows = Review.objects.filter(item__in=items.values('pk')).values('item', 'rating').annotate(n=Count('pk')).order_by()
+    for row in rows:
+        totals = counted.setdefault(row['item'], dict.fromkeys(fields, 0))
+        totals['rating_sum'] += row['rating'] * row['n']
+        totals['review_count'] += row['n']
+        totals[_rating_field(row['rating'])] += row['n']
+
+    drifted = []
+    for item in items.only('pk', *fields):
+        totals = counted.get(item.pk, dict.fromkeys(fields, 0))
+        if any(getattr(item, field) != value for field, value in totals.items()):
+            drifted.append(Item(pk=item.pk, **totals))
+    Item.objects.bulk_update(drifted, fields, batch_size=500)
+    return len(drifted)
@@ -0,0 +1,129 @@
+"""
+Who the current user is, worked out once per request.
+
+RoleMiddleware sets request.role to a RequestRole. Nothing is queried until
+something asks. The first question loads the user's Patron together with
+its Librarian row (if any) in one query, and every later question in the
+same request (middleware, view, base template) reuses it. Templates see
+it as `current_role` through the role context processor.
+
+Collection permission checks work the same way. The first one loads the ids
+of the private collections the user was granted, and every later check is a
+set lookup. With CACHE_COLLECTION_ACCESS (the default) the set is also kept
+across requests in the catalog cache, stamped with the ACCESS version, so
+any change to grants or collections invalidates it.
+"""
+from django.conf import settings
+from django.utils.functional import cached_property
+
+from .models import Collections, Librarian, Patron
+
+ANONYMOUS = 'anonymous'
+# Signed in to the admin site only, with no Patron of their own
+ADMIN_ONLY = 'admin_only'
+# Signed in but no Patron yet (home creates one on first visit)
+NEW_USER = 'new_user'
+PATRON = 'patron'
+LIBRARIAN = 'librarian'
+
+
+class RequestRole:
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def _rows(self):
+        user = self.request.user
+        if not user.is_authenticated:
+            return None, None
+        patron = Patron.objects.select_related('librarian').filter(user_id=user.pk).first()
+        if patron is None:
+            return None, None
+        try:
+            return patron, patron.librarian
+        except Librarian.DoesNotExist:
+            return patron, None
+
+    @property
+    def patron(self):
+        return self._rows[0]
+
+    @property
+    def librarian(self):
+        return self._rows[1]
+
+    @property
+    def is_patron(self):
+        return self.patron is not None
+
+    @property
+    def is_librarian(self):
+        return self.librarian is not None
+
+    @property
+    def name(self):
+        user = self.request.user
+        if not user.is_authenticated:
+            return ANONYMOUS
+        if self.librarian is not None:
+            return LIBRARIAN
+        if self.patron is not None:
+            return PATRON
+        return ADMIN_ONLY if user.is_staff else NEW_USER
+
+    @cached_property
+    def granted_collection_ids(self):
+        """Ids of the private collections the user was granted. Librarians never need it."""
+        from .catalog_cache import ACCESS, cached
+        patron = self.patron
+        if patron is None:
+            return frozenset()
+
+        def load():
+            return frozenset(
+                Collections.objects.filter(is_collection_private=True, allowed_users=patron).values_list('pk', flat=True)
+            )
+        if getattr(settings, 'CACHE_COLLECTION_ACCESS', True):
+            return cached((ACCESS,), ('granted_collections', patron.pk), load)
+        return load()
+
+    def can_open(self, collection):
+        """Collections.is_open_to() for this user, without a query per collection."""
+        if not collection.is_collection_private or self.is_librarian:
+            return True
+        patron = self.patron
+        if patron is None:
+            return False
+        return collection.creator_id == patron.pk or collection.pk in self.granted_collection_ids
+
+    def get_patron(self):
+        """The user's Patron; raises Patron.DoesNotExist like Patron.objects.get(user=...)."""
+        if self.patron is None:
+            raise Patron.DoesNotExist("The current user has no patron.")
+        return self.patron
+
+    def get_librarian(self):
+        """The user's Librarian; raises Librarian.DoesNotExist like Librarian.objects.get(user=...)."""
+        if self.librarian is None:
+            raise Librarian.DoesNotExist("The current user is not a librarian.")
+        return self.librarian
+
+    def forget(self):
+        """Drop the cached answer, e.g. after creating the user's Patron."""
+        self.__dict__.pop('_rows', None)
+        self.__dict__.pop('granted_collection_ids', None)
+
+    def __str__(self):
+        return self.name
+
+
+def get_role(request):
+    """request.role, creating it for requests that did not pass through RoleMiddleware."""
+    if not hasattr(request, 'role'):
+        request.role = RequestRole(request)
+    return request.role
+
+
+def role(request):
+    """Context processor exposing the request's role as `current_role`."""
+    return {'current_role': get_role(request)}
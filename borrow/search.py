@@ -0,0 +1,282 @@
+"""
+Full-text search over items and collections.
+
+PostgreSQL keeps a weighted, generated ``search_vector`` tsvector column with a
+GIN index on each table; SQLite (local/dev) keeps FTS5 shadow tables that are
+maintained by triggers. Both are updated by the database itself on every
+insert/update/delete, including ``QuerySet.update()`` and bulk operations, so
+no signal handlers are needed. Other databases fall back to ``icontains``.
+
+On both backends every word of the query must match, as a prefix of a word in
+the row, so a query finds the same rows on either ("tenn" finds "Tennis").
+
+The schema is installed by migration 0017_search_index, which keeps its own
+frozen copy of the definitions below; changing them needs a new migration.
+SQLite drops a table's triggers whenever a migration rebuilds that table, so
+install_sqlite_index() also runs after every migrate to put them back.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Item, Collections
+
+# Highlight markers are control characters so that user content can be escaped
+# safely before they are swapped for <mark> tags.
+START_MARK = '\x02'
+STOP_MARK = '\x03'
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+ITEM_FIELDS = ('name', 'location', 'instructions')
+COLLECTION_FIELDS = ('title', 'description')
+
+
+def render_highlight(text):
+    """Escape `text` and turn the backend's match markers into <mark> tags."""
+    html = escape(text or '').replace(START_MARK, '<mark>').replace(STOP_MARK, '</mark>')
+    return mark_safe(html)
+
+
+class BaseSearch:
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self.table = model._meta.db_table
+
+    def matching_q(self, query):
+        """A Q restricting the model to rows matching `query`."""
+        raise NotImplementedError
+
+    def ranked(self, queryset, query, limit):
+        """
+        Up to `limit` rows of `queryset` matching `query`, best first, each with
+        `search_rank` and `search_highlight` attributes.
+        """
+        raise NotImplementedError
+
+    def _fetch_ranked(self, queryset, rows):
+        objects = queryset.in_bulk([pk for pk, _, _ in rows])
+        results = []
+        for pk, rank, highlight in rows:
+            obj = objects.get(pk)
+            if obj is None:
+                continue
+            obj.search_rank = rank
+            obj.search_highlight = render_highlight(highlight)
+            results.append(obj)
+        return results
+
+
+class PostgresSearch(BaseSearch):
+    @staticmethod
+    def match_expression(query):
+        # Quote every word so tsquery operators in user input are taken
+        # literally, and make each one a prefix match like SQLiteSearch does.
+        words = WORD_RE.findall(query)
+        return ' & '.join(f"'{word}':*" for word in words)
+
+    def matching_q(self, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return Q()
+        return Q(pk__in=RawSQL(
+            f'SELECT id FROM {self.table} '
+            f"WHERE search_vector @@ to_tsquery('english', %s)",
+            [expression],
+        ))
+
+    def ranked(self, queryset, query, limit):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        visible_sql, visible_params = queryset.order_by().values('pk').query.sql_with_params()
+        document = " || ' · ' || ".join(f"coalesce(t.{field}, '')" for field in self.fields)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT t.id, ts_rank(t.search_vector, q) AS rank, "
+                f"       ts_headline('english', {document}, q, %s) "
+                f"FROM {self.table} t, to_tsquery('english', %s) q "
+                f"WHERE t.search_vector @@ q AND t.id IN ({visible_sql}) "
+                f"ORDER BY rank DESC, t.id LIMIT %s",
+                [f'StartSel={START_MARK}, StopSel={STOP_MARK}, MaxFragments=2', expression,
+                 *visible_params, limit],
+            )
+            rows = cursor.fetchall()
+        return self._fetch_ranked(queryset, rows)
+
+
+class SQLiteSearch(BaseSearch):
+    # Column weights for bm25(); earlier fields matter more
+    WEIGHTS = {
+        Item: (10.0, 4.0, 1.0),
+        Collections: (10.0, 2.0),
+    }
+
+    @property
+    def fts_table(self):
+        return f'{self.table}_fts'
+
+    @staticmethod
+    def match_expression(query):
+        # Quote every word so FTS5 operators in user input are taken literally,
+        # and make each one a prefix match so partial words still find results.
+        words = WORD_RE.findall(query)
+        return ' '.join(f'"{word}"*' for word in words)
+
+    def matching_q(self, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return Q()
+        return Q(pk__in=RawSQL(
+            f'SELECT rowid FROM {self.fts_table} WHERE {self.fts_table} MATCH %s',
+            [expression],
+        ))
+
+    def ranked(self, queryset, query, limit):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        visible_sql, visible_params = queryset.order_by().values('pk').query.sql_with_params()
+        weights = ', '.join(str(weight) for weight in self.WEIGHTS[self.model])
+        highlight = " || ' · ' || ".join(
+            f"highlight({self.fts_table}, {index}, %s, %s)" for index in range(len(self.fields))
+        )
+        # The unary "+" keeps FTS5 from taking the rowid IN (...) constraint as an
+        # index lookup, which would re-run the MATCH once per visible row.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, -bm25({self.fts_table}, {weights}) AS rank, {highlight} "
+                f"FROM {self.fts_table} "
+                f"WHERE {self.fts_table} MATCH %s AND +rowid IN ({visible_sql}) "
+                f"ORDER BY rank DESC, rowid LIMIT %s",
+                [*([START_MARK, STOP_MARK] * len(self.fields)), expression, *visible_params, limit],
+            )
+            rows = cursor.fetchall()
+        return self._fetch_ranked(queryset, rows)
+
+
+class FallbackSearch(BaseSearch):
+    def matching_q(self, query):
+        condition = Q()
+        for field in self.fields:
+            condition |= Q(**{f'{field}__icontains': query})
+        return condition
+
+    def ranked(self, queryset, query, limit):
+        results = list(queryset.filter(self.matching_q(query))[:limit])
+        for obj in results:
+            obj.search_rank = 0
+            obj.search_highlight = escape(' · '.join(getattr(obj, field) for field in self.fields))
+        return results
+
+
+def _search_tables():
+    return {
+        Item._meta.db_table: ITEM_FIELDS,
+        Collections._meta.db_table: COLLECTION_FIELDS,
+    }
+
+
+def install_postgres_index(connection):
+    """Add a weighted, generated tsvector column with a GIN index to each searchable table."""
+    with connection.cursor() as cursor:
+        for table, fields in _search_tables().items():
+            vector = ' || '.join(
+                f"setweight(to_tsvector('english', coalesce({field}, '')), '{weight}')"
+                for field, weight in zip(fields, 'ABC')
+            )
+            cursor.execute(
+                f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector '
+                f'GENERATED ALWAYS AS ({vector}) STORED'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {table}_search_idx ON {table} USING GIN (search_vector)'
+            )
+
+
+def uninstall_postgres_index(connection):
+    with connection.cursor() as cursor:
+        for table in _search_tables():
+            cursor.execute(f'DROP INDEX IF EXISTS {table}_search_idx')
+            cursor.execute(f'ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector')
+
+
+def install_sqlite_index(connection):
+    """
+    Create the FTS5 shadow tables and their sync triggers. Idempotent; if any
+    trigger was missing the shadow table is rebuilt from the content table.
+    """
+    with connection.cursor() as cursor:
+        for table, fields in _search_tables().items():
+            fts = f'{table}_fts'
+            columns = ', '.join(fields)
+            new_values = ', '.join(f'new.{field}' for field in fields)
+            old_values = ', '.join(f'old.{field}' for field in fields)
+
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s AND name LIKE %s",
+                [table, f'{fts}_%'],
+            )
+            complete = cursor.fetchone()[0] == 3
+
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({columns}, content='{table}', "
+                f"content_rowid='id', tokenize='porter unicode61 remove_diacritics 2')"
+            )
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN '
+                f'INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values}); END'
+            )
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END"
+            )
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+                f'INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values}); END'
+            )
+            if not complete:
+                cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def uninstall_sqlite_index(connection):
+    with connection.cursor() as cursor:
+        for table in _search_tables():
+            fts = f'{table}_fts'
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+            cursor.execute(f'DROP TABLE IF EXISTS {fts}')
+
+
+BACKENDS = {
+    'postgresql': PostgresSearch,
+    'sqlite': SQLiteSearch,
+}
+
+
+def get_search(model):
+    backend = BACKENDS.get(connection.vendor, FallbackSearch)
+    fields = ITEM_FIELDS if model is Item else COLLECTION_FIELDS
+    return backend(model, fields)
+
+
+def item_search_q(query):
+    return get_search(Item).matching_q(query)
+
+
+def collection_search_q(query):
+    return get_search(Collections).matching_q(query)
+
+
+def search_catalog(query, items, collections, limit=10):
+    """Ranked, highlighted matches from both `items` and `collections` querysets."""
+    return {
+        'items': get_search(Item).ranked(items, query, limit),
+        'collections': get_search(Collections).ranked(collections, query, limit),
+    }
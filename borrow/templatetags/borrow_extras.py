@@ -1,16 +1,51 @@
 from django import template
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
 
-register = template.Library()
+from borrow import catalog_cache, images
+from borrow.roles import get_role
 
-@register.filter
-def can_view(item, user):
-    return item.can_view(user)
+register = template.Library()
 
 @register.filter
-def can_view_collection(collection, user):
-    return collection.can_view(user)
+def can_open_collection(collection, request):
+    """Whether the request's user may open `collection`; a set lookup after the first check (see RequestRole.can_open)."""
+    return get_role(request).can_open(collection)
 
 @register.filter
 def class_name(obj):
     """Returns the class name of an object"""
     return obj.__class__.__name__
+
+@register.simple_tag(takes_context=True)
+def item_card(context, item):
+    """An item's catalog card, rendered once per visibility class and cached (see borrow.catalog_cache)."""
+    request = context['request']
+    html = catalog_cache.cached(
+        (catalog_cache.CATALOG,),
+        catalog_cache.card_parts(request, item),
+        lambda: get_template('borrow/item_card.html').render({'item': item, 'request': request}),
+    )
+    return mark_safe(html)
+
+@register.inclusion_tag('borrow/photo.html')
+def photo(fieldfile, variants, alt='', sizes='100vw', css_class='', style='', lazy=True):
+    """
+    An <img> for `fieldfile` with WebP and JPEG srcsets over its resized copies
+    and a blurred placeholder (see borrow.images), or the original if it has none yet.
+    """
+    context = {'src': fieldfile.url, 'alt': alt, 'sizes': sizes, 'css_class': css_class, 'style': style, 'lazy': lazy}
+    variants = images.current_variants(fieldfile, variants)
+    if variants and variants.get('jpeg'):
+        url = fieldfile.storage.url
+        context.update({
+            'sources': [
+                {'type': mime, 'srcset': ', '.join(f'{url(name)} {width}w' for width, name in variants[key])}
+                for key, _, mime in images.FORMATS
+            ],
+            'src': url(variants['jpeg'][-1][1]),
+            'width': variants['width'],
+            'height': variants['height'],
+            'placeholder': variants['placeholder'],
+        })
+    return context
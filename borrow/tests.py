@@ -1,16 +1,50 @@
+import asyncio
+import importlib
+import random
+import threading
+import time
 from datetime import timedelta
-from django.contrib.auth.models import User
+from io import BytesIO, StringIO
+from PIL import Image
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps as django_apps
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
 from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase, override_settings
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
-from .models import SimpleItem, ComplexItem, Patron, BorrowedItem, Librarian
+from .models import SimpleItem, ComplexItem, Patron, BorrowedItem, Librarian, Item, Collections, BorrowRequest, CollectionRequest, Message, ArchivedMessage, Review
+from . import approvals, catalog_cache, events, views, waitlist
+from .reservations import month_availability, units_free
+from .search import PostgresSearch, SQLiteSearch
+from .facets import compute_facet_counts, facet_counts
+from .filters import ItemFilter
+from .inventory import InventoryError, reserve, return_borrowed_item
+from .loans import scan_loans
+from .images import make_variants
+from .membership import CollectionConflict, collection_conflicts
+from .reviews import delete_review, recount_ratings, save_review
+from .notifications import build_message, recount_unread, send_message, send_message_to_librarians, send_messages
 
 # Patch the 'photo' field storage on our models to use FileSystemStorage in tests.
 fs = FileSystemStorage(location='/tmp/django_test_media')
 SimpleItem._meta.get_field('photo').storage = fs
 ComplexItem._meta.get_field('photo').storage = fs
+Patron._meta.get_field('profile_photo').storage = fs
+
+
+def approve(borrow_request, librarian=None):
+    """Approve one request the way the librarians' queue does; returns its loan (None for a reservation)."""
+    result, = approvals.approve_borrow_requests([borrow_request.pk], librarian)
+    if not result.ok:
+        raise InventoryError(result.code, result.message)
+    return BorrowRequest.objects.get(pk=borrow_request.pk).loan
+
 
 @override_settings(
     DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
@@ -195,3 +229,1767 @@ class ViewTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'borrow/detail.html')
         self.assertContains(response, "Ping Pong")
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class ItemVisibilityTests(TestCase):
+    def setUp(self):
+        self.image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        self.librarian = Librarian.objects.create(
+            user=User.objects.create_user(username="librarian", password="password"),
+            name="Librarian",
+            email="librarian@example.com"
+        )
+        self.member = Patron.objects.create(
+            user=User.objects.create_user(username="member", password="password"),
+            name="Member",
+            email="member@example.com"
+        )
+        self.outsider = Patron.objects.create(
+            user=User.objects.create_user(username="outsider", password="password"),
+            name="Outsider",
+            email="outsider@example.com"
+        )
+        self.public_item = SimpleItem.objects.create(
+            name="Frisbee", quantity=3, location="Field", instructions="Throw it", photo=self.image,
+        )
+        self.private_item = SimpleItem.objects.create(
+            name="Goal Net", quantity=1, location="Shed", instructions="Set it up", photo=self.image,
+        )
+        self.collection = Collections.objects.create(
+            title="Varsity Gear",
+            description="Team only",
+            is_collection_private=True,
+            creator=self.librarian,
+        )
+        self.collection.items_list.add(self.private_item)
+        self.collection.allowed_users.add(self.member)
+
+    def visible_names(self, user):
+        return set(Item.objects.visible_to(user).values_list('name', flat=True))
+
+    # Tests that items in private collections are only visible to librarians and allowed patrons.
+    def test_visible_to(self):
+        from django.contrib.auth.models import AnonymousUser
+        self.assertEqual(self.visible_names(AnonymousUser()), {"Frisbee"})
+        self.assertEqual(self.visible_names(self.outsider.user), {"Frisbee"})
+        self.assertEqual(self.visible_names(self.member.user), {"Frisbee", "Goal Net"})
+        self.assertEqual(self.visible_names(self.librarian.user), {"Frisbee", "Goal Net"})
+
+    # Tests that visibility costs a fixed number of queries regardless of catalog size.
+    def test_visible_to_query_count(self):
+        for i in range(5):
+            item = SimpleItem.objects.create(
+                name=f"Cone {i}", quantity=1, location="Field", instructions="Stack", photo=self.image,
+            )
+            self.collection.items_list.add(item)
+        with self.assertNumQueries(2):
+            list(Item.objects.visible_to(self.outsider.user))
+
+    # Tests that the detail view forbids items from private collections the user cannot see.
+    def test_detail_view_forbidden(self):
+        self.client.force_login(self.outsider.user)
+        response = self.client.get(reverse('borrow:detail', kwargs={'pk': self.private_item.pk}))
+        self.assertEqual(response.status_code, 403)
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class CatalogPaginationTests(TestCase):
+    def setUp(self):
+        self.image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        # Duplicate names make sure the id tie-breaker keeps pages disjoint
+        for i in range(30):
+            SimpleItem.objects.create(
+                name=f"Ball {i % 10}", quantity=i, location="Gym", instructions="Bounce", photo=self.image,
+            )
+
+    # Tests that following next_cursor through the JSON endpoint returns every item exactly once, in order.
+    def test_json_pages_cover_catalog(self):
+        url = reverse('borrow:item_page_json')
+        seen = []
+        cursor = None
+        while True:
+            response = self.client.get(url, {'cursor': cursor} if cursor else {})
+            data = response.json()
+            seen.extend((item['name'], item['id']) for item in data['items'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(len(seen), 30)
+        self.assertEqual(seen, sorted(seen))
+
+    # Tests that the JSON endpoint applies the same filters as the browse page.
+    def test_json_filters(self):
+        response = self.client.get(reverse('borrow:item_page_json'), {'q': 'Ball 3', 'min_quantity': 10})
+        self.assertEqual([item['quantity'] for item in response.json()['items']], [13, 23])
+
+    # Tests that the browse page renders only the first page and links to the fragment endpoint.
+    def test_index_first_page(self):
+        response = self.client.get(reverse('borrow:index'))
+        self.assertEqual(len(response.context['borrow_items_list']), 24)
+        self.assertTrue(response.context['next_fragment_url'].startswith(reverse('borrow:item_page')))
+        fragment = self.client.get(response.context['next_fragment_url'])
+        self.assertEqual(fragment.content.decode().count('class="card h-100"'), 6)
+        self.assertNotIn('X-Next-Page', fragment)
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class SearchTests(TestCase):
+    def setUp(self):
+        self.image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        self.racket = SimpleItem.objects.create(
+            name="Tennis Racket", quantity=2, location="Court", instructions="Swing <gently>", photo=self.image,
+        )
+        self.balls = SimpleItem.objects.create(
+            name="Tennis Balls", quantity=20, location="Court", instructions="Use with a racket", photo=self.image,
+        )
+        self.owner = Patron.objects.create(
+            user=User.objects.create_user(username="owner", password="password"),
+            name="Owner",
+            email="owner@example.com"
+        )
+
+    def search(self, q):
+        return self.client.get(reverse('borrow:search'), {'q': q}).json()
+
+    # Tests that name matches outrank matches that only appear in the instructions, with escaped highlights.
+    def test_ranked_and_highlighted(self):
+        results = self.search("racket")
+        self.assertEqual([item['name'] for item in results['items']], ["Tennis Racket", "Tennis Balls"])
+        self.assertIn("<mark>Racket</mark>", results['items'][0]['highlight'])
+        self.assertIn("&lt;gently&gt;", results['items'][0]['highlight'])
+
+    # Tests that partial words match as prefixes, with the same literal-quoted query built for each backend.
+    def test_prefix_matching(self):
+        self.assertEqual([item['name'] for item in self.search("tenn bal")['items']], ["Tennis Balls"])
+        self.assertEqual(PostgresSearch.match_expression("tenn rack | !"), "'tenn':* & 'rack':*")
+        self.assertEqual(SQLiteSearch.match_expression("tenn rack | !"), '"tenn"* "rack"*')
+
+    # Tests that the index follows updates and deletes made through the ORM.
+    def test_index_stays_in_sync(self):
+        SimpleItem.objects.filter(pk=self.balls.pk).update(name="Shuttlecocks", instructions="Hit them")
+        self.assertEqual([item['name'] for item in self.search("shuttlecock")['items']], ["Shuttlecocks"])
+        self.racket.delete()
+        self.assertEqual(self.search("racket")['items'], [])
+
+    # Tests that the unified search returns collections and hides private ones from anonymous users.
+    def test_collections(self):
+        Collections.objects.create(title="Tennis Club", description="Open to all", creator=self.owner)
+        Collections.objects.create(
+            title="Tennis Team", description="Members only", creator=self.owner, is_collection_private=True,
+        )
+        titles = [collection['title'] for collection in self.search("tennis")['collections']]
+        self.assertEqual(titles, ["Tennis Club"])
+        self.client.force_login(self.owner.user)
+        titles = {collection['title'] for collection in self.search("tennis")['collections']}
+        self.assertEqual(titles, {"Tennis Club", "Tennis Team"})
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        from .autocomplete import index
+        self.index = index
+        self.index.reset()
+        self.addCleanup(self.index.reset)
+        self.image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        self.librarian = Librarian.objects.create(
+            user=User.objects.create_user(username="librarian", password="password"),
+            name="Librarian",
+            email="librarian@example.com"
+        )
+        SimpleItem.objects.create(
+            name="Tennis Racket", quantity=2, location="North Court", instructions="Swing", photo=self.image,
+        )
+        self.secret = SimpleItem.objects.create(
+            name="Tennis Ball Machine", quantity=1, location="Shed", instructions="Plug in", photo=self.image,
+        )
+        collection = Collections.objects.create(
+            title="Coaching Kit", description="Coaches only", is_collection_private=True, creator=self.librarian,
+        )
+        collection.items_list.add(self.secret)
+
+    def labels(self, q, user=None):
+        from django.contrib.auth.models import AnonymousUser
+        return [s['label'] for s in self.index.suggest(q, user or AnonymousUser())]
+
+    # Tests that misspelled and partial queries still find the right entries.
+    def test_typo_tolerant(self):
+        self.index.build()
+        self.assertEqual(self.labels("tenis rackt")[0], "Tennis Racket")
+        self.assertIn("North Court", self.labels("nort"))
+
+    # Tests that private collection items are only suggested to users who can see them.
+    def test_respects_visibility(self):
+        self.index.build()
+        self.assertNotIn("Tennis Ball Machine", self.labels("tennis"))
+        self.assertNotIn("Coaching Kit", self.labels("coach"))
+        self.assertIn("Tennis Ball Machine", self.labels("tennis", self.librarian.user))
+
+    # Tests that model changes update the built index without a rebuild and without querying per keystroke.
+    def test_incremental_updates(self):
+        self.index.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            item = SimpleItem.objects.create(
+                name="Lacrosse Stick", quantity=4, location="Field", instructions="Catch", photo=self.image,
+            )
+        with self.assertNumQueries(0):
+            self.assertEqual(self.labels("lacros"), ["Lacrosse Stick"])
+        with self.captureOnCommitCallbacks(execute=True):
+            item.delete()
+        self.assertEqual(self.labels("lacros"), [])
+
+    # Tests that a write that is rolled back never reaches the index.
+    def test_rolled_back_write_ignored(self):
+        self.index.build()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    SimpleItem.objects.create(
+                        name="Lacrosse Stick", quantity=4, location="Field", instructions="Catch", photo=self.image,
+                    )
+                    Collections.objects.filter(title="Coaching Kit").first().items_list.clear()
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.labels("lacros"), [])
+        self.assertNotIn("Tennis Ball Machine", self.labels("tennis"))
+
+    # Tests that the endpoint returns suggestions as JSON.
+    def test_endpoint(self):
+        response = self.client.get(reverse('borrow:autocomplete'), {'q': 'racket'})
+        suggestion = response.json()['suggestions'][0]
+        self.assertEqual((suggestion['type'], suggestion['label']), ("item", "Tennis Racket"))
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class FacetCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        self.librarian = Librarian.objects.create(
+            user=User.objects.create_user(username="librarian", password="password"),
+            name="Librarian",
+            email="librarian@example.com"
+        )
+        SimpleItem.objects.create(
+            name="Soccer Ball", quantity=5, location="Gym", instructions="Kick", photo=self.image,
+            category=Item.CATEGORY_BALLS,
+        )
+        SimpleItem.objects.create(
+            name="Cone", quantity=20, location="Field", instructions="Stack", photo=self.image,
+            category=Item.CATEGORY_OTHER,
+        )
+        ComplexItem.objects.create(
+            name="Tennis Racket", quantity=1, location="Court", instructions="Swing", photo=self.image,
+            category=Item.CATEGORY_STICKS, condition=ComplexItem.GOOD_CONDITION,
+        )
+        hidden = ComplexItem.objects.create(
+            name="Ball Machine", quantity=1, location="Court", instructions="Load", photo=self.image,
+            category=Item.CATEGORY_BALLS, condition=ComplexItem.NEW_CONDITION,
+        )
+        collection = Collections.objects.create(
+            title="Coaching", description="Staff", is_collection_private=True, creator=self.librarian,
+        )
+        collection.items_list.add(hidden)
+
+    def counts(self, params, user=None):
+        user = user or AnonymousUser()
+        return compute_facet_counts(Item.objects.visible_to(user), ItemFilter(params))
+
+    def request_for(self, user):
+        request = RequestFactory().get(reverse('borrow:index'))
+        request.user = user
+        return request
+
+    # Tests that every facet is counted in one query, ignoring its own filter but applying the others.
+    def test_counts_in_one_query(self):
+        queryset = Item.objects.visible_to(AnonymousUser())
+        with self.assertNumQueries(1):
+            counts = compute_facet_counts(queryset, ItemFilter({'category': Item.CATEGORY_BALLS, 'min_quantity': '2'}))
+        self.assertEqual(counts['total'], 1)
+        self.assertEqual(counts['category'][Item.CATEGORY_OTHER], 1)
+        self.assertEqual(counts['category'][Item.CATEGORY_STICKS], 0)
+        self.assertEqual(counts['min_quantity'][1], 1)
+        self.assertEqual(counts['item_type'], {'': 1, 'simple': 1, 'complex': 0})
+
+    # Tests that counts only include items the viewer may see.
+    def test_respects_visibility(self):
+        self.assertEqual(self.counts({})['category'][Item.CATEGORY_BALLS], 1)
+        self.assertEqual(self.counts({}, self.librarian.user)['category'][Item.CATEGORY_BALLS], 2)
+        self.assertEqual(self.counts({'q': 'ball'}, self.librarian.user)['condition'][ComplexItem.NEW_CONDITION], 1)
+
+    # Tests that the browse page shows the counts and serves repeat requests from the cache.
+    def test_sidebar_counts_cached(self):
+        response = self.client.get(reverse('borrow:index'))
+        self.assertContains(response, "Bulk Items (2)")
+        self.assertEqual(response.context['item_type_counts']['complex'], 1)
+        with self.assertNumQueries(0):
+            facet_counts(self.request_for(AnonymousUser()), 'catalog', Item.objects.none(), ItemFilter({}))
+
+    # Tests that viewers who see the same catalog share one cache entry instead of one each.
+    def test_cached_per_visibility_class(self):
+        first, second = [
+            Patron.objects.create(user=User.objects.create_user(username=f"patron{i}"), name=f"Patron {i}", email=f"p{i}@example.com")
+            for i in range(2)
+        ]
+        counts = facet_counts(self.request_for(first.user), 'catalog', Item.objects.visible_to(first.user), ItemFilter({}))
+        self.assertEqual(counts['total'], 3)
+        shared = facet_counts(self.request_for(second.user), 'catalog', Item.objects.none(), ItemFilter({}))
+        self.assertEqual(shared, counts)
+        librarian = facet_counts(self.request_for(self.librarian.user), 'catalog', Item.objects.none(), ItemFilter({}))
+        self.assertEqual(librarian['total'], 0)
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class PolymorphicItemTests(TestCase):
+    def setUp(self):
+        self.image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        self.simple = SimpleItem.objects.create(
+            name="Cones", quantity=20, location="Field", instructions="Stack", photo=self.image,
+        )
+        self.complex = ComplexItem.objects.create(
+            name="Ball Machine", quantity=1, location="Court", instructions="Load", photo=self.image,
+            condition=ComplexItem.FAIR_CONDITION,
+        )
+
+    # Tests that subclasses record their kind on the parent row.
+    def test_kind_set_on_save(self):
+        self.assertEqual(Item.objects.get(pk=self.simple.pk).kind, Item.SIMPLE)
+        self.assertEqual(Item.objects.get(pk=self.complex.pk).kind, Item.COMPLEX)
+
+    # Tests that the polymorphic loader returns typed instances, with child fields, in one query.
+    def test_polymorphic_single_query(self):
+        with self.assertNumQueries(1):
+            items = list(Item.objects.polymorphic().order_by('name'))
+            self.assertEqual([type(item) for item in items], [ComplexItem, SimpleItem])
+            self.assertEqual(items[0].get_condition_display(), "Fair")
+            self.assertTrue(items[1].is_simple)
+
+    # Tests that an item loaded polymorphically can be saved back without losing data.
+    def test_polymorphic_instance_saves(self):
+        item = Item.objects.polymorphic().get(pk=self.complex.pk)
+        item.quantity = 0
+        item.save()
+        self.complex.refresh_from_db()
+        self.assertEqual((self.complex.quantity, self.complex.condition), (0, ComplexItem.FAIR_CONDITION))
+
+    # Tests that the librarian item pages and request approval work off the kind column.
+    def test_librarian_views(self):
+        librarian = Librarian.objects.create(
+            user=User.objects.create_user(username="librarian", password="password"),
+            name="Librarian",
+            email="librarian@example.com"
+        )
+        self.client.login(username="librarian", password="password")
+        response = self.client.get(reverse('borrow:manage_items'))
+        self.assertEqual([item.name for item in response.context['items']], ["Ball Machine", "Cones"])
+        response = self.client.get(reverse('borrow:edit_item', args=[self.complex.pk]))
+        self.assertTemplateUsed(response, 'borrow/edit_complex_item.html')
+
+        borrow_request = BorrowRequest.objects.create(
+            borrower=librarian, item=self.simple, quantity=5, date=timezone.now()
+        )
+        self.client.post(reverse('borrow:approve_requests'), {'request_id': borrow_request.pk, 'action': 'approve'})
+        self.simple.refresh_from_db()
+        self.assertEqual(self.simple.quantity, 15)
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class InventoryTests(TestCase):
+    def setUp(self):
+        self.image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        self.patron = Patron.objects.create(
+            user=User.objects.create_user(username="patron", password="password"),
+            name="Patron",
+            email="patron@example.com"
+        )
+        self.item = SimpleItem.objects.create(
+            name="Cones", quantity=3, location="Field", instructions="Stack", photo=self.image,
+        )
+
+    def make_request(self, quantity):
+        return BorrowRequest.objects.create(borrower=self.patron, item=self.item, quantity=quantity, date=timezone.now())
+
+    # Tests that a request can only be approved once.
+    def test_approve_once(self):
+        borrow_request = self.make_request(2)
+        approve(borrow_request)
+        with self.assertRaises(InventoryError) as raised:
+            approve(BorrowRequest.objects.get(pk=borrow_request.pk))
+        self.assertEqual(raised.exception.code, InventoryError.NOT_PENDING)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity, 1)
+
+    # Tests that an approval without enough stock fails cleanly and leaves the request pending.
+    def test_out_of_stock_leaves_request_pending(self):
+        borrow_request = self.make_request(5)
+        with self.assertRaises(InventoryError) as raised:
+            approve(borrow_request)
+        self.assertEqual(raised.exception.code, InventoryError.OUT_OF_STOCK)
+        borrow_request.refresh_from_db()
+        self.item.refresh_from_db()
+        self.assertEqual((borrow_request.status, self.item.quantity), (BorrowRequest.PENDING, 3))
+        self.assertFalse(BorrowedItem.objects.exists())
+
+    # Tests that returning a loan twice only restores the stock once.
+    def test_return_once(self):
+        borrowed_item = approve(self.make_request(2))
+        return_borrowed_item(borrowed_item)
+        with self.assertRaises(InventoryError) as raised:
+            return_borrowed_item(BorrowedItem.objects.get(pk=borrowed_item.pk))
+        self.assertEqual(raised.exception.code, InventoryError.ALREADY_RETURNED)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity, 3)
+
+
+# Runs on every backend. SQLite serialises writers and fails a worker that
+# finds the database locked, so workers retry until they get their turn.
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class InventoryConcurrencyTests(TransactionTestCase):
+    WORKERS = 20
+    STOCK = 5
+
+    def setUp(self):
+        image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        self.item = SimpleItem.objects.create(
+            name="Cones", quantity=self.STOCK, location="Field", instructions="Stack", photo=image,
+        )
+        self.requests = []
+        for i in range(self.WORKERS):
+            patron = Patron.objects.create(
+                user=User.objects.create_user(username=f"patron{i}", password="password"),
+                name=f"Patron {i}",
+                email=f"patron{i}@example.com"
+            )
+            self.requests.append(
+                BorrowRequest.objects.create(borrower=patron, item=self.item, quantity=1, date=timezone.now())
+            )
+
+    # Tests that parallel approvals never hand out more than the stock on hand.
+    def test_parallel_approvals_do_not_oversell(self):
+        barrier = threading.Barrier(self.WORKERS)
+        errors = []
+
+        def worker(borrow_request):
+            try:
+                barrier.wait()
+                while True:
+                    try:
+                        result, = approvals.approve_borrow_requests([borrow_request.pk], None)
+                    except OperationalError:
+                        # Locked out (SQLite); back off a random while so the workers don't collide again
+                        time.sleep(random.uniform(0, 0.05))
+                        continue
+                    break
+                if not result.ok:
+                    errors.append(result.code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(r,)) for r in self.requests]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity, 0)
+        self.assertEqual(BorrowedItem.objects.filter(item=self.item).count(), self.STOCK)
+        self.assertEqual(BorrowRequest.objects.filter(status=BorrowRequest.APPROVED).count(), self.STOCK)
+        self.assertEqual(errors, [InventoryError.OUT_OF_STOCK] * (self.WORKERS - self.STOCK))
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class BulkApprovalTests(TestCase):
+    def setUp(self):
+        self.image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        self.librarian = Librarian.objects.create(
+            user=User.objects.create_user(username="librarian", password="password"),
+            name="Librarian",
+            email="librarian@example.com"
+        )
+        self.patrons = [
+            Patron.objects.create(
+                user=User.objects.create_user(username=f"patron{i}", password="password"),
+                name=f"Patron {i}",
+                email=f"patron{i}@example.com"
+            )
+            for i in range(6)
+        ]
+        self.item = SimpleItem.objects.create(
+            name="Cones", quantity=4, location="Field", instructions="Stack", photo=self.image,
+        )
+
+    def make_requests(self, count, quantity=2):
+        return [
+            BorrowRequest.objects.create(borrower=patron, item=self.item, quantity=quantity, date=timezone.now())
+            for patron in self.patrons[:count]
+        ]
+
+    # Tests that a bulk approval hands out stock oldest-first and reports each request.
+    def test_bulk_approve_summary(self):
+        requests = self.make_requests(3)
+        results = approvals.approve_borrow_requests([r.pk for r in requests] + [999], self.librarian)
+        self.assertEqual([result.ok for result in results], [True, True, False, False])
+        self.assertEqual(results[2].code, InventoryError.OUT_OF_STOCK)
+        self.assertEqual(results[3].code, InventoryError.NOT_PENDING)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity, 0)
+        self.assertEqual(BorrowedItem.objects.count(), 2)
+        self.assertEqual(Message.objects.filter(subject__startswith="Borrow Request Approved").count(), 2)
+
+    # Tests that the number of queries does not grow with the size of the selection.
+    def test_bulk_query_count_is_constant(self):
+        self.item.quantity = 100
+        self.item.save()
+        requests = self.make_requests(6, quantity=1)
+        with CaptureQueriesContext(connection) as small:
+            approvals.approve_borrow_requests([r.pk for r in requests[:2]], self.librarian)
+        with CaptureQueriesContext(connection) as large:
+            approvals.approve_borrow_requests([r.pk for r in requests[2:]], self.librarian)
+        self.assertEqual(len(small), len(large))
+
+    # Tests that bulk-approving collection requests grants access and renders the summary page.
+    def test_bulk_collection_approval_view(self):
+        collection = Collections.objects.create(
+            title="Varsity Gear", description="Team only", is_collection_private=True, creator=self.librarian,
+        )
+        requests = [
+            CollectionRequest.objects.create(user=patron, collection=collection, date=timezone.now(), notes="")
+            for patron in self.patrons[:3]
+        ]
+        self.client.login(username="librarian", password="password")
+        response = self.client.post(reverse('borrow:approve_collection_requests'), {
+            'action': 'approve', 'request_ids': [r.pk for r in requests],
+        })
+        self.assertEqual(response.context['succeeded'], 3)
+        self.assertEqual(set(collection.allowed_users.all()), set(self.patrons[:3]))
+        self.assertFalse(CollectionRequest.objects.filter(status=CollectionRequest.PENDING).exists())
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class ReservationTests(TestCase):
+    def setUp(self):
+        self.image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        self.patron = Patron.objects.create(
+            user=User.objects.create_user(username="patron", password="password"),
+            name="Patron",
+            email="patron@example.com"
+        )
+        self.item = SimpleItem.objects.create(
+            name="Goal Nets", quantity=4, location="Shed", instructions="Set up", photo=self.image,
+        )
+        self.now = timezone.now()
+
+    def make_request(self, quantity, start_days=None, end_days=None):
+        return BorrowRequest.objects.create(
+            borrower=self.patron, item=self.item, quantity=quantity, date=timezone.now(),
+            start_date=self.now + timedelta(days=start_days) if start_days is not None else None,
+            end_date=self.now + timedelta(days=end_days) if end_days is not None else None,
+        )
+
+    # Tests that availability accounts for loans coming back and overlapping reservations.
+    def test_units_free_sweep(self):
+        self.patron.borrow_simple_item(self.item, 2, days_to_return=3)  # back on day 3
+        approve(self.make_request(3, 5, 8))
+        self.assertEqual(units_free(self.item, self.now, self.now + timedelta(days=2)), 2)
+        self.assertEqual(units_free(self.item, self.now + timedelta(days=4), self.now + timedelta(days=5)), 4)
+        self.assertEqual(units_free(self.item, self.now + timedelta(days=4), self.now + timedelta(days=6)), 1)
+        self.assertEqual(units_free(self.item, self.now + timedelta(days=8), self.now + timedelta(days=9)), 4)
+
+    # Tests that approving a future reservation holds units without taking stock, and blocks conflicting loans.
+    def test_reservation_blocks_conflicting_loan(self):
+        self.assertIsNone(approve(self.make_request(3, 2, 4)))
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity, 4)
+        with self.assertRaises(InventoryError):
+            approve(self.make_request(2, None, 3))
+        approve(self.make_request(1, None, 3))
+        approve(self.make_request(4, 5, 6))
+
+    # Tests that the calendar endpoint serves a month of availability from one query.
+    def test_month_calendar(self):
+        approve(self.make_request(3, 1, 2))
+        first = (self.now + timedelta(days=1)).date()
+        with self.assertNumQueries(1):
+            days = dict(month_availability(self.item, first.year, first.month))
+        self.assertEqual(days[first], 1)
+        response = self.client.get(reverse('borrow:item_availability', args=[self.item.pk]), {'month': f'{first:%Y-%m}'})
+        self.assertEqual(len(response.json()['days']), len(days))
+        self.assertEqual(self.client.get(reverse('borrow:item_availability', args=[self.item.pk]), {'month': 'soon'}).status_code, 400)
+
+    # Tests that reservations whose window has started are turned into loans.
+    def test_start_reservations(self):
+        borrow_request = self.make_request(2, 1, 3)
+        approve(borrow_request)
+        BorrowRequest.objects.filter(pk=borrow_request.pk).update(start_date=self.now - timedelta(minutes=1))
+        call_command('start_reservations', stdout=StringIO())
+        borrow_request.refresh_from_db()
+        self.item.refresh_from_db()
+        self.assertEqual(borrow_request.loan.quantity, 2)
+        self.assertEqual(self.item.quantity, 2)
+
+@override_settings(DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage', MEDIA_ROOT='/tmp/django_test_media', MEDIA_URL='/media/')
+class WaitlistTests(TestCase):
+    def setUp(self):
+        self.image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        self.item = SimpleItem.objects.create(
+            name="Cones", quantity=2, location="Shed", instructions="Stack", photo=self.image,
+        )
+        self.patrons = []
+        for i in range(4):
+            self.patrons.append(Patron.objects.create(
+                user=User.objects.create_user(username=f"waiter{i}", password="password"),
+                name=f"Waiter {i}",
+                email=f"waiter{i}@example.com"
+            ))
+        self.holder = self.patrons[0]
+        self.holder.borrow_simple_item(self.item, 2)
+
+    def request_item(self, patron, quantity):
+        self.client.login(username=patron.user.username, password="password")
+        self.client.post(reverse('borrow:borrow_item', args=[self.item.pk]), {'quantity': quantity})
+        return BorrowRequest.objects.filter(borrower=patron).latest('pk')
+
+    # Tests that requests for an out-of-stock item join the waitlist instead of the librarians' queue.
+    def test_out_of_stock_request_is_waitlisted(self):
+        borrow_request = self.request_item(self.patrons[1], 1)
+        self.assertEqual(borrow_request.status, BorrowRequest.WAITLISTED)
+        self.assertEqual(waitlist.position(self.request_item(self.patrons[2], 1)), 2)
+
+    # Tests that returned stock is lent to waiters oldest first, and the head of the queue is never skipped.
+    def test_return_allocates_in_order(self):
+        first = self.request_item(self.patrons[1], 2)
+        second = self.request_item(self.patrons[2], 1)
+        self.holder.return_simple_item(self.item, 1)
+        first.refresh_from_db()
+        self.assertEqual(first.status, BorrowRequest.WAITLISTED)
+        self.assertEqual(BorrowRequest.objects.get(pk=second.pk).status, BorrowRequest.WAITLISTED)
+
+        self.holder.return_simple_item(self.item, 1)
+        first.refresh_from_db()
+        self.item.refresh_from_db()
+        self.assertEqual(first.status, BorrowRequest.APPROVED)
+        self.assertEqual(first.loan.quantity, 2)
+        self.assertEqual(self.item.quantity, 0)
+        self.assertTrue(Message.objects.filter(recipient=self.patrons[1], subject__startswith="Waitlist").exists())
+        self.assertEqual(BorrowRequest.objects.get(pk=second.pk).status, BorrowRequest.WAITLISTED)
+
+    # Tests that only out-of-stock requests are waitlisted, and none may ask for more than the library owns.
+    def test_waitlist_only_when_out_of_stock(self):
+        self.holder.return_simple_item(self.item, 1)
+        self.assertEqual(self.request_item(self.patrons[1], 2).status, BorrowRequest.PENDING)
+        self.client.post(reverse('borrow:borrow_item', args=[self.item.pk]), {'quantity': 3})
+        self.assertEqual(BorrowRequest.objects.filter(borrower=self.patrons[1]).count(), 1)
+
+    # Tests that cancelling or rejecting the head of the queue lends its units to the waiters behind it.
+    def test_cancel_and_reject_unblock_queue(self):
+        first = self.request_item(self.patrons[1], 2)
+        second = self.request_item(self.patrons[2], 1)
+        third = self.request_item(self.patrons[3], 1)
+        self.holder.return_simple_item(self.item, 1)
+        self.assertEqual(BorrowRequest.objects.get(pk=second.pk).status, BorrowRequest.WAITLISTED)
+
+        self.client.login(username="waiter1", password="password")
+        self.client.post(reverse('borrow:cancel_waitlist', args=[first.pk]))
+        self.assertEqual(BorrowRequest.objects.get(pk=first.pk).status, BorrowRequest.CANCELLED)
+        self.assertEqual(BorrowRequest.objects.get(pk=second.pk).status, BorrowRequest.APPROVED)
+
+        librarian = Librarian.objects.create(
+            user=User.objects.create_user(username="librarian", password="password"),
+            name="Librarian", email="librarian@example.com",
+        )
+        results = approvals.reject_borrow_requests([third.pk], librarian)
+        self.assertTrue(results[0].ok)
+        self.assertEqual(BorrowRequest.objects.get(pk=third.pk).status, BorrowRequest.REJECTED)
+
+    # Tests that restocking serves the waitlist, reading only as many waiters as there are free units.
+    def test_restock_reads_bounded_queue(self):
+        for patron in self.patrons[1:]:
+            self.request_item(patron, 1)
+        SimpleItem.objects.filter(pk=self.item.pk).update(quantity=2)
+        with CaptureQueriesContext(connection) as queries:
+            lent = waitlist.allocate([self.item.pk])
+        self.assertEqual([r.borrower for r in lent], self.patrons[1:3])
+        self.assertLessEqual(len(queries), 15)
+        self.assertEqual(waitlist.queue(self.item).count(), 1)
+
+@override_settings(DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage', MEDIA_ROOT='/tmp/django_test_media', MEDIA_URL='/media/')
+class LoanScanTests(TestCase):
+    def setUp(self):
+        self.image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        self.user = User.objects.create_user(username="patron", password="password")
+        self.patron = Patron.objects.create(user=self.user, name="Patron", email="patron@example.com")
+        self.item = SimpleItem.objects.create(
+            name="Hurdles", quantity=10, location="Track", instructions="Carry in pairs", photo=self.image,
+        )
+        now = timezone.now()
+        self.overdue = BorrowedItem.objects.create(
+            borrower=self.patron, item=self.item, quantity=1, due_date=now - timedelta(hours=2), item_type='SIMPLE'
+        )
+        self.due_soon = BorrowedItem.objects.create(
+            borrower=self.patron, item=self.item, quantity=1, due_date=now + timedelta(hours=3), item_type='SIMPLE'
+        )
+        self.later = BorrowedItem.objects.create(
+            borrower=self.patron, item=self.item, quantity=1, due_date=now + timedelta(days=5), item_type='SIMPLE'
+        )
+
+    # Tests that the migration backfilling statuses catches existing loans up without any reminders going out.
+    def test_status_backfill(self):
+        backfill = importlib.import_module('borrow.migrations.0032_backfill_loan_status').backfill_status
+        backfill(django_apps, None)
+        statuses = [BorrowedItem.objects.get(pk=loan.pk).status for loan in (self.overdue, self.due_soon, self.later)]
+        self.assertEqual(statuses, [BorrowedItem.OVERDUE, BorrowedItem.DUE_SOON, BorrowedItem.ON_LOAN])
+        self.assertEqual(scan_loans(), {BorrowedItem.OVERDUE: 0, BorrowedItem.DUE_SOON: 0})
+        self.assertFalse(Message.objects.filter(recipient=self.patron).exists())
+
+    # Tests that a scan moves loans forward in batches and reminds each borrower once per change.
+    def test_scan_is_batched_and_deduplicated(self):
+        moved = scan_loans(batch_size=1)
+        self.assertEqual(moved, {BorrowedItem.OVERDUE: 1, BorrowedItem.DUE_SOON: 1})
+        self.overdue.refresh_from_db()
+        self.later.refresh_from_db()
+        self.assertEqual(self.overdue.status, BorrowedItem.OVERDUE)
+        self.assertEqual(self.later.status, BorrowedItem.ON_LOAN)
+        self.assertEqual(Message.objects.filter(recipient=self.patron).count(), 2)
+
+        self.assertEqual(scan_loans(), {BorrowedItem.OVERDUE: 0, BorrowedItem.DUE_SOON: 0})
+        self.assertEqual(Message.objects.filter(recipient=self.patron).count(), 2)
+
+        # Once the due-soon loan is late it is reminded again, as overdue
+        scan_loans(now=timezone.now() + timedelta(hours=4))
+        self.due_soon.refresh_from_db()
+        self.assertEqual(self.due_soon.status, BorrowedItem.OVERDUE)
+        self.assertEqual(Message.objects.filter(recipient=self.patron, subject__startswith="Overdue").count(), 2)
+
+    # Tests that loans due within two days count as due soon, as on the dashboard before statuses were stored.
+    def test_due_soon_window(self):
+        now = timezone.now()
+        BorrowedItem.objects.filter(pk=self.due_soon.pk).update(due_date=now + timedelta(hours=40))
+        BorrowedItem.objects.filter(pk=self.later.pk).update(due_date=now + timedelta(hours=50))
+        self.assertEqual(scan_loans(now=now), {BorrowedItem.OVERDUE: 1, BorrowedItem.DUE_SOON: 1})
+        self.later.refresh_from_db()
+        self.assertEqual(self.later.status, BorrowedItem.ON_LOAN)
+
+    # Tests that the dashboard groups loans by their stored status.
+    def test_dashboard_reads_status(self):
+        call_command('scan_loans', stdout=StringIO())
+        self.client.login(username="patron", password="password")
+        response = self.client.get(reverse('home'))
+        self.assertEqual([b.pk for b in response.context['overdue']], [self.overdue.pk])
+        self.assertEqual([b.pk for b in response.context['due_soon']], [self.due_soon.pk])
+        self.assertEqual(len(response.context['borrowed_items']), 3)
+
+class LibrarianBroadcastTests(TestCase):
+    def setUp(self):
+        self.patron = Patron.objects.create(
+            user=User.objects.create_user(username="patron", password="password"),
+            name="Patron",
+            email="patron@example.com"
+        )
+        self.librarians = []
+        for i in range(2):
+            self.librarians.append(Librarian.objects.create(
+                user=User.objects.create_user(username=f"librarian{i}", password="password"),
+                name=f"Librarian {i}",
+                email=f"librarian{i}@example.com"
+            ))
+
+    def unread(self, patron):
+        self.client.login(username=patron.user.username, password="password")
+        return self.client.get(reverse('borrow:unread_message_count')).json()['count']
+
+    # Tests that notifying librarians costs the same number of queries however many librarians there are.
+    def test_broadcast_is_one_insert(self):
+        with CaptureQueriesContext(connection) as few:
+            send_message_to_librarians(subject="New request", content="Please review")
+        for i in range(2, 6):
+            Librarian.objects.create(
+                user=User.objects.create_user(username=f"librarian{i}"), name=f"Librarian {i}", email="l@example.com"
+            )
+        with self.assertNumQueries(len(few)):
+            send_message_to_librarians(subject="Another request", content="Please review")
+        self.assertEqual(Message.objects.count(), 2)
+
+    # Tests that each librarian sees broadcasts with their own read state, and patrons do not see them.
+    def test_read_state_is_per_librarian(self):
+        message = send_message_to_librarians(subject="New request", content="Please review")
+        self.assertEqual(self.unread(self.librarians[0]), 1)
+        self.assertEqual(self.unread(self.patron), 0)
+
+        self.client.login(username="librarian0", password="password")
+        self.client.post(reverse('borrow:mark_message_read', args=[message.pk]))
+        self.assertEqual(self.unread(self.librarians[0]), 0)
+        self.assertEqual(self.unread(self.librarians[1]), 1)
+
+        # Marking it unread again only affects that librarian
+        self.client.login(username="librarian0", password="password")
+        self.client.post(reverse('borrow:mark_message_read', args=[message.pk]))
+        self.assertEqual(self.unread(self.librarians[0]), 1)
+        self.client.login(username="patron", password="password")
+        self.assertEqual(self.client.post(reverse('borrow:mark_message_read', args=[message.pk])).status_code, 404)
+
+class EventStreamTests(TransactionTestCase):
+    def setUp(self):
+        self.librarian = Librarian.objects.create(
+            user=User.objects.create_user(username="librarian", password="password"),
+            name="Librarian",
+            email="librarian@example.com"
+        )
+
+    async def next_chunk(self, body):
+        return await asyncio.wait_for(anext(body), 5)
+
+    # Tests that the stream sends the unread count at once and again when a broadcast is committed.
+    def test_stream_publishes_after_commit(self):
+        async def scenario():
+            body = events.stream(self.librarian)
+            self.assertTrue((await self.next_chunk(body)).startswith("retry:"))
+            self.assertIn('"count": 0', await self.next_chunk(body))
+            await sync_to_async(send_message_to_librarians)(subject="New request", content="Please review")
+            self.assertIn('"count": 1', await self.next_chunk(body))
+            await body.aclose()
+            self.assertEqual(events.broker.subscribers, {})
+        async_to_sync(scenario)()
+
+    # Tests that an ASGI request gets an event stream.
+    def test_asgi_request_streams(self):
+        async def scenario():
+            client = AsyncClient()
+            await client.aforce_login(self.librarian.user)
+            response = await client.get(reverse('borrow:event_stream'))
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            body = aiter(response.streaming_content)
+            self.assertTrue((await self.next_chunk(body)).startswith(b"retry:"))
+            await body.aclose()
+        async_to_sync(scenario)()
+
+    # Tests that the endpoint declines to stream outside an ASGI server, so the page polls instead.
+    def test_wsgi_request_gets_no_content(self):
+        self.client.login(username="librarian", password="password")
+        self.assertEqual(self.client.get(reverse('borrow:event_stream')).status_code, 204)
+
+class UnreadCounterTests(TestCase):
+    def setUp(self):
+        self.patron = Patron.objects.create(
+            user=User.objects.create_user(username="patron", password="password"),
+            name="Patron",
+            email="patron@example.com"
+        )
+        self.librarian = Librarian.objects.create(
+            user=User.objects.create_user(username="librarian", password="password"),
+            name="Librarian",
+            email="librarian@example.com"
+        )
+
+    def stored(self, patron):
+        return Patron.objects.get(pk=patron.pk).unread_count
+
+    # Tests that sending and toggling messages keeps the counter in step, and the badge is a single read.
+    def test_counter_follows_messages(self):
+        send_message(self.patron, "Hello", "One")
+        send_messages([build_message(self.patron, "Hi", "Two"), build_message(self.librarian, "Hi", "Three")])
+        broadcast = send_message_to_librarians(subject="New request", content="Please review")
+        self.assertEqual(self.stored(self.patron), 2)
+        self.assertEqual(self.stored(self.librarian), 2)
+
+        message = Message.objects.filter(recipient=self.patron).first()
+        message.mark_read(self.patron)
+        message.mark_read(self.patron)
+        broadcast.mark_read(self.librarian)
+        broadcast.mark_read(self.librarian, read=False)
+        self.assertEqual(self.stored(self.patron), 1)
+        self.assertEqual(self.stored(self.librarian), 2)
+
+        self.client.login(username="patron", password="password")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('borrow:unread_message_count'))
+        self.assertEqual(response.json()['count'], 1)
+        self.assertEqual(sum('borrow_patron' in q['sql'] for q in queries.captured_queries), 1)
+        self.assertFalse(any('borrow_message' in q['sql'] for q in queries.captured_queries))
+
+    # Tests that the repair command fixes drifted counters, and new librarians inherit earlier broadcasts.
+    def test_repair_drifted_counters(self):
+        send_message(self.patron, "Hello", "One")
+        send_message_to_librarians(subject="New request", content="Please review")
+        Patron.objects.update(unread_count=7)
+        out = StringIO()
+        call_command('repair_unread_counts', stdout=out)
+        self.assertIn("Fixed 2", out.getvalue())
+        self.assertEqual(self.stored(self.patron), 1)
+        self.assertEqual(self.stored(self.librarian), 1)
+
+        newcomer = Librarian.objects.create(
+            user=User.objects.create_user(username="newcomer"), name="Newcomer", email="new@example.com"
+        )
+        self.assertEqual(self.stored(newcomer), 1)
+
+class InboxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="librarian", password="password")
+        self.librarian = Librarian.objects.create(user=self.user, name="Librarian", email="librarian@example.com")
+        for i in range(30):
+            send_message(self.librarian, f"Direct {i}", "Hello")
+        for i in range(5):
+            send_message_to_librarians(subject=f"Broadcast {i}", content="Please review")
+        self.client.login(username="librarian", password="password")
+
+    def stored(self):
+        return Patron.objects.get(pk=self.librarian.pk).unread_count
+
+    # Tests that the inbox is served in keyset pages that cover every message exactly once.
+    def test_inbox_pages(self):
+        seen = []
+        url = reverse('borrow:messages')
+        while url:
+            response = self.client.get(url)
+            seen.extend(message.pk for message in response.context['messages'])
+            url = response.context['next_page_url']
+        self.assertEqual(len(seen), 35)
+        self.assertEqual(len(set(seen)), 35)
+
+    # Tests that marking selected and then all messages read updates both kinds and the counter.
+    def test_bulk_mark_read(self):
+        direct = Message.objects.filter(recipient=self.librarian).first()
+        broadcast = Message.objects.filter(recipient__isnull=True).first()
+        self.client.post(reverse('borrow:mark_messages_read'), {'message_ids': [direct.pk, broadcast.pk]})
+        self.assertEqual(self.stored(), 33)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('borrow:mark_messages_read'), {'all': '1'})
+        self.assertEqual(sum(q['sql'].startswith('UPDATE "borrow_message"') for q in queries.captured_queries), 1)
+        self.assertEqual(self.stored(), 0)
+        self.assertEqual(Message.objects.inbox(self.librarian).filter(is_read=False).count(), 0)
+
+    # Tests that retention archives old read messages, and broadcasts only once every librarian has read them.
+    def test_archive_messages(self):
+        other = Librarian.objects.create(
+            user=User.objects.create_user(username="other", password="password"), name="Other", email="other@example.com"
+        )
+        ids = dict(Message.objects.values_list('subject', 'pk'))
+        read = ["Direct 0", "Direct 1", "Broadcast 0", "Broadcast 1", "Broadcast 2"]
+        self.client.post(reverse('borrow:mark_messages_read'), {'message_ids': [ids[subject] for subject in read]})
+        self.client.force_login(other.user)
+        self.client.post(reverse('borrow:mark_messages_read'), {'message_ids': [ids["Broadcast 0"], ids["Broadcast 3"]]})
+        Message.objects.update(created_at=timezone.now() - timedelta(days=100))
+        call_command('archive_messages', '--days', '90', '--batch-size', '2', stdout=StringIO())
+        self.assertEqual(
+            sorted(ArchivedMessage.objects.values_list('subject', flat=True)), ["Broadcast 0", "Direct 0", "Direct 1"]
+        )
+        self.assertEqual(Message.objects.count(), 32)
+        self.assertEqual(self.stored(), 30)
+        self.assertEqual(Patron.objects.get(pk=other.pk).unread_count, 3)
+        self.assertEqual(recount_unread(), 0)
+
+@override_settings(DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage', MEDIA_ROOT='/tmp/django_test_media', MEDIA_URL='/media/')
+class DigestTests(TestCase):
+    def setUp(self):
+        self.image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        self.librarian = Librarian.objects.create(
+            user=User.objects.create_user(username="librarian", password="password"),
+            name="Librarian",
+            email="librarian@example.com"
+        )
+        self.item = SimpleItem.objects.create(
+            name="Rackets", quantity=100, location="Court", instructions="Return strung", photo=self.image,
+        )
+        self.patrons = []
+        for i in range(12):
+            self.patrons.append(Patron.objects.create(
+                user=User.objects.create_user(username=f"borrower{i}", password="password"),
+                name=f"Borrower {i}",
+                email=f"borrower{i}@example.com"
+            ))
+
+    def request_item(self, patron):
+        self.client.login(username=patron.user.username, password="password")
+        self.client.post(reverse('borrow:borrow_item', args=[self.item.pk]), {'quantity': 1})
+
+    # Tests that a burst of borrow requests becomes one digest with a live queue count.
+    def test_burst_becomes_one_digest(self):
+        for patron in self.patrons:
+            self.request_item(patron)
+        digest = Message.objects.get()
+        self.assertEqual(digest.event_count, 12)
+        self.assertEqual(digest.subject, "12 new borrow requests")
+        self.assertEqual(Patron.objects.get(pk=self.librarian.pk).unread_count, 1)
+
+        BorrowRequest.objects.filter(borrower=self.patrons[0]).update(status=BorrowRequest.REJECTED)
+        self.client.login(username="librarian", password="password")
+        response = self.client.get(reverse('borrow:messages'))
+        self.assertContains(response, "11 pending now")
+
+    # Tests that a digest read before new events arrive becomes unread again, and a new window starts a new digest.
+    def test_digest_reopens_and_expires(self):
+        self.request_item(self.patrons[0])
+        digest = Message.objects.get()
+        digest.mark_read(self.librarian)
+        self.request_item(self.patrons[1])
+        self.assertEqual(Patron.objects.get(pk=self.librarian.pk).unread_count, 1)
+        self.assertEqual(Message.objects.inbox(self.librarian).filter(is_read=False).count(), 1)
+
+        Message.objects.update(digest_until=timezone.now() - timedelta(seconds=1))
+        self.request_item(self.patrons[2])
+        self.assertEqual(Message.objects.count(), 2)
+        self.assertEqual(Patron.objects.get(pk=self.librarian.pk).unread_count, 2)
+
+class RequestRoleTests(TestCase):
+    def setUp(self):
+        self.librarian = Librarian.objects.create(
+            user=User.objects.create_user(username="librarian", password="password", is_staff=True),
+            name="Librarian",
+            email="librarian@example.com"
+        )
+        self.admin = User.objects.create_user(username="admin", password="password", is_staff=True)
+
+    # Tests that middleware, view and base template share a single lookup of the user's Patron and Librarian rows.
+    def test_role_resolved_once_per_request(self):
+        self.client.login(username="librarian", password="password")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('borrow:approve_requests'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(str(response.context['current_role']), 'librarian')
+        self.assertContains(response, reverse('borrow:manage_items'))
+        lookups = [q for q in queries.captured_queries if '"borrow_patron"."user_id" =' in q['sql']]
+        self.assertEqual(len(lookups), 1)
+        self.assertIn('borrow_librarian', lookups[0]['sql'])
+
+    # Tests that staff accounts without a patron are still sent to the admin site.
+    def test_admin_only_redirect(self):
+        self.client.login(username="admin", password="password")
+        response = self.client.get(reverse('borrow:index'))
+        self.assertRedirects(response, reverse('admin:index'), fetch_redirect_response=False)
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        self.librarian = Librarian.objects.create(
+            user=User.objects.create_user(username="librarian", password="password"),
+            name="Librarian",
+            email="librarian@example.com"
+        )
+        self.patron = Patron.objects.create(
+            user=User.objects.create_user(username="patron", password="password"),
+            name="Patron",
+            email="patron@example.com"
+        )
+        self.items = [
+            SimpleItem.objects.create(
+                name=f"Ball {i}", quantity=i + 1, location="Gym", instructions="Kick", photo=self.image,
+            )
+            for i in range(3)
+        ]
+        self.private = Collections.objects.create(
+            title="Coaching", description="Staff", is_collection_private=True, creator=self.librarian,
+        )
+
+    def names(self, params=None):
+        return [item['name'] for item in self.client.get(reverse('borrow:item_page_json'), params or {}).json()['items']]
+
+    # Tests that a page cut from a stale id list (e.g. cached by another worker) still hides private items.
+    def test_stale_list_rechecks_visibility(self):
+        self.client.login(username="patron", password="password")
+        self.assertEqual(self.names(), ["Ball 0", "Ball 1", "Ball 2"])
+        # As if made private in another process: no signal reaches this cache
+        Collections.items_list.through.objects.bulk_create([
+            Collections.items_list.through(collections=self.private, item=self.items[1]),
+        ])
+        self.assertEqual(self.names(), ["Ball 0", "Ball 2"])
+
+    # Tests that a repeated page is cut from the cached id list and its cards come from the cache.
+    def test_repeat_page_cached(self):
+        url = reverse('borrow:item_page')
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(url)
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get(url)
+        self.assertContains(response, "Ball 2")
+        self.assertLess(len(second), len(first))
+        # Only the page's items are loaded, by primary key, with their collections
+        self.assertEqual(len(second), 2)
+
+    # Tests that saving an item, changing stock or changing collection membership invalidates cached pages.
+    def test_invalidation(self):
+        self.assertEqual(self.names(), ["Ball 0", "Ball 1", "Ball 2"])
+        self.items[0].name = "Ball 9"
+        self.items[0].save()
+        self.assertEqual(self.names(), ["Ball 1", "Ball 2", "Ball 9"])
+
+        self.private.items_list.add(self.items[1])
+        self.assertEqual(self.names(), ["Ball 2", "Ball 9"])
+
+        self.assertEqual(self.names({'min_quantity': 3}), ["Ball 2"])
+        reserve(self.patron, self.items[2], 1)
+        self.assertEqual(self.names({'min_quantity': 3}), [])
+
+    # Tests that patrons with the same grants share cache entries and a grant gives a patron their own.
+    def test_visibility_classes(self):
+        self.private.items_list.add(self.items[0])
+        self.client.login(username="patron", password="password")
+        self.assertEqual(self.names(), ["Ball 1", "Ball 2"])
+        self.private.allowed_users.add(self.patron)
+        self.assertEqual(self.names(), ["Ball 0", "Ball 1", "Ball 2"])
+        self.client.logout()
+        self.assertEqual(self.names(), ["Ball 1", "Ball 2"])
+        self.client.login(username="librarian", password="password")
+        self.assertEqual(self.names(), ["Ball 0", "Ball 1", "Ball 2"])
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class SingleFlightTests(TransactionTestCase):
+    WORKERS = 10
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        self.items = [
+            SimpleItem.objects.create(
+                name=f"Ball {i:02}", quantity=5, location="Gym", instructions="Kick", photo=image,
+            )
+            for i in range(30)
+        ]
+
+    # Tests that while one worker refreshes a stale entry, the others are served the previous value.
+    def test_stale_served_while_refreshing(self):
+        parts = ('test', 'stale')
+        self.assertEqual(catalog_cache.cached((catalog_cache.CATALOG,), parts, lambda: "old"), "old")
+        catalog_cache.bump(catalog_cache.CATALOG)
+        during = []
+
+        def refresh():
+            during.append(catalog_cache.cached((catalog_cache.CATALOG,), parts, lambda: "never"))
+            return "new"
+        self.assertEqual(catalog_cache.cached((catalog_cache.CATALOG,), parts, refresh), "new")
+        self.assertEqual(during, ["old"])
+        self.assertEqual(catalog_cache.cached((catalog_cache.CATALOG,), parts, lambda: "never"), "new")
+
+    # Tests that entries are refreshed once their soft timeout passes, even without a version bump.
+    def test_soft_timeout(self):
+        parts = ('test', 'soft')
+        catalog_cache.cached((catalog_cache.CATALOG,), parts, lambda: 1, fresh_for=0)
+        self.assertEqual(catalog_cache.cached((catalog_cache.CATALOG,), parts, lambda: 2, fresh_for=60), 2)
+        self.assertEqual(catalog_cache.cached((catalog_cache.CATALOG,), parts, lambda: 3), 2)
+
+    # Tests that concurrent requests right after an Item.save() recompute the catalog once, not once each.
+    def test_one_recomputation_under_load(self):
+        url = reverse('borrow:item_page_json')
+        self.client.get(url)
+        self.items[0].save()
+        barrier = threading.Barrier(self.WORKERS)
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        def fetch():
+            try:
+                with connection.execute_wrapper(record):
+                    barrier.wait()
+                    self.client_class().get(url)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=fetch) for _ in range(self.WORKERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        id_lists = [sql for sql in queries if sql.startswith('SELECT "borrow_item"."id" FROM')]
+        self.assertEqual(len(id_lists), 1)
+        # Otherwise one query per request: loading its page of items
+        self.assertEqual(len(queries), self.WORKERS + 1)
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class ReviewAggregateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        self.item = SimpleItem.objects.create(
+            name="Soccer Ball", quantity=5, location="Gym", instructions="Kick", photo=image,
+        )
+        self.patrons = [
+            Patron.objects.create(
+                user=User.objects.create_user(username=f"patron{i}", password="password"),
+                name=f"Patron {i}",
+                email=f"patron{i}@example.com"
+            )
+            for i in range(3)
+        ]
+
+    def aggregates(self):
+        self.item.refresh_from_db()
+        return self.item.review_count, self.item.rating_sum, [count for _, count, _ in self.item.rating_histogram]
+
+    # Tests that adding, changing and deleting reviews keep the item's count, sum and histogram in step.
+    def test_aggregates_maintained(self):
+        save_review(self.item, self.patrons[0], 5, "Great")
+        review, created = save_review(self.item, self.patrons[1], 2, "Flat")
+        self.assertTrue(created)
+        self.assertEqual(self.aggregates(), (2, 7, [1, 0, 0, 1, 0]))
+        self.assertEqual(self.item.average_rating, 3.5)
+
+        _, created = save_review(self.item, self.patrons[1], 4, "Pumped it up")
+        self.assertFalse(created)
+        self.assertEqual(self.aggregates(), (2, 9, [1, 1, 0, 0, 0]))
+
+        self.assertTrue(delete_review(review))
+        self.assertFalse(delete_review(review))
+        self.assertEqual(self.aggregates(), (1, 5, [1, 0, 0, 0, 0]))
+
+    # Tests that a first review that loses the race to a concurrent one from the same patron updates it instead.
+    def test_concurrent_first_review(self):
+        raced = []
+
+        def write_first(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if not raced and sql.startswith('SELECT') and Review._meta.db_table in sql:
+                # Another request's review lands between the lookup and the insert
+                raced.append(sql)
+                save_review(self.item, self.patrons[0], 5, "Great")
+            return result
+
+        with connection.execute_wrapper(write_first):
+            review, created = save_review(self.item, self.patrons[0], 2, "Actually flat")
+        self.assertTrue(raced)
+        self.assertFalse(created)
+        self.assertEqual((review.rating, review.comment), (2, "Actually flat"))
+        self.assertEqual(Review.objects.filter(item=self.item).count(), 1)
+        self.assertEqual(self.aggregates(), (1, 2, [0, 0, 0, 1, 0]))
+
+    # Tests that drifted aggregates are rebuilt from the reviews.
+    def test_recount(self):
+        save_review(self.item, self.patrons[0], 3, "Fine")
+        Item.objects.filter(pk=self.item.pk).update(review_count=7, rating_1=2)
+        self.assertEqual(recount_ratings(), 1)
+        self.assertEqual(self.aggregates(), (1, 3, [0, 0, 1, 0, 0]))
+        self.assertEqual(recount_ratings(), 0)
+
+    # Tests that the item page shows the patron's own review first and costs the same queries however many reviews there are.
+    def test_detail_page_fixed_queries(self):
+        save_review(self.item, self.patrons[0], 4, "Mine")
+        save_review(self.item, self.patrons[1], 3, "Theirs")
+        self.client.login(username="patron0", password="password")
+        url = reverse('borrow:detail', args=[self.item.pk])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get(url)
+        self.assertEqual([review.comment for review in response.context['reviews']], ["Mine", "Theirs"])
+        self.assertIsNone(response.context['next_reviews_url'])
+
+        for i in range(25):
+            patron = Patron.objects.create(
+                user=User.objects.create_user(username=f"reviewer{i}"), name=f"Reviewer {i}", email=f"r{i}@example.com",
+            )
+            save_review(self.item, patron, 5, f"Review {i}")
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+        self.assertEqual(len(many), len(few))
+        self.assertEqual(response.context['reviews'][0].comment, "Mine")
+        self.assertEqual(len(response.context['reviews']), 1 + views.REVIEWS_PER_PAGE)
+        self.assertContains(response, "Older reviews")
+        older = self.client.get(url + response.context['next_reviews_url'].split('#')[0])
+        self.assertNotIn("Mine", [review.comment for review in older.context['reviews']])
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class CollectionMembershipTests(TestCase):
+    def setUp(self):
+        self.image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        self.librarian = Librarian.objects.create(
+            user=User.objects.create_user(username="librarian", password="password"),
+            name="Librarian",
+            email="librarian@example.com"
+        )
+        self.ball, self.net, self.cone = [
+            SimpleItem.objects.create(name=name, quantity=5, location="Gym", instructions="-", photo=self.image)
+            for name in ("Ball", "Net", "Cone")
+        ]
+        self.private = Collections.objects.create(
+            title="Coaching", description="Staff", is_collection_private=True, creator=self.librarian,
+        )
+        self.public = Collections.objects.create(title="Field Day", description="All", creator=self.librarian)
+        self.private.items_list.add(self.ball)
+        self.public.items_list.add(self.net)
+
+    def owner_and_count(self, item):
+        item.refresh_from_db()
+        return item.private_collection_id, item.shared_count
+
+    # Tests that every conflict of a candidate set is reported with its collection title, from one query.
+    def test_conflicts_in_one_query(self):
+        with self.assertNumQueries(1):
+            conflicts = collection_conflicts([self.ball, self.net, self.cone], private=True)
+        self.assertEqual([(c.item_name, c.collection_title) for c in conflicts], [("Ball", "Coaching"), ("Net", "Field Day")])
+        self.assertEqual([c.collection_title for c in collection_conflicts([self.ball, self.net], private=False)], ["Coaching"])
+        # Items already in the collection being edited are not held against it
+        self.assertEqual(collection_conflicts([self.ball], private=True, collection=self.private), [])
+
+    # Tests that membership changes by any route keep the owner column and shared count in step.
+    def test_columns_follow_membership(self):
+        self.assertEqual(self.owner_and_count(self.ball), (self.private.pk, 0))
+        self.assertEqual(self.owner_and_count(self.net), (None, 1))
+        self.cone.collections.add(self.public)
+        self.assertEqual(self.owner_and_count(self.cone), (None, 1))
+        self.private.items_list.remove(self.ball)
+        self.public.items_list.clear()
+        self.assertEqual([self.owner_and_count(item) for item in (self.ball, self.net, self.cone)], [(None, 0)] * 3)
+
+        self.private.items_list.add(self.cone)
+        self.private.is_collection_private = False
+        self.private.save()
+        self.assertEqual(self.owner_and_count(self.cone), (None, 1))
+        self.private.delete()
+        self.assertEqual(self.owner_and_count(self.cone), (None, 0))
+
+    # Tests that a conflicting add is refused as a whole, and that the database itself rejects a broken row.
+    def test_invariant_enforced(self):
+        with self.assertRaises(CollectionConflict) as raised, transaction.atomic():
+            self.public.items_list.add(self.cone, self.ball)
+        self.assertEqual(raised.exception.messages, ["'Ball' lives in private 'Coaching'; public collections cannot include it."])
+        self.assertEqual(list(self.public.items_list.values_list('pk', flat=True)), [self.net.pk])
+        self.assertEqual(self.owner_and_count(self.cone), (None, 0))
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Item.objects.filter(pk=self.ball.pk).update(shared_count=1)
+
+        # Saving a stale instance leaves the maintained columns alone
+        stale = Item.objects.get(pk=self.cone.pk)
+        self.private.items_list.add(self.cone)
+        stale.save()
+        self.assertEqual(self.owner_and_count(self.cone), (self.private.pk, 0))
+
+    # Tests that removing an item from a collection it is not in leaves its counters alone.
+    def test_remove_non_member(self):
+        other = Collections.objects.create(title="Open Gym", description="All", creator=self.librarian)
+        other.items_list.remove(self.net)
+        self.net.collections.remove(other)
+        self.assertEqual(self.owner_and_count(self.net), (None, 1))
+        with self.assertRaises(CollectionConflict), transaction.atomic():
+            Collections.objects.create(
+                title="Varsity", description="Team", is_collection_private=True, creator=self.librarian,
+            ).items_list.add(self.net)
+
+    # Tests that a refused privacy switch names the collections the items conflict with.
+    def test_privacy_switch_conflict_reported(self):
+        team = Collections.objects.create(title="Team", description="-", creator=self.librarian)
+        team.items_list.add(self.net)
+        team.is_collection_private = True
+        with self.assertRaises(CollectionConflict) as raised:
+            team.save()
+        self.assertEqual(raised.exception.messages, ["'Net' is already in 'Field Day'; private collections must be disjoint."])
+        self.assertFalse(Collections.objects.get(pk=team.pk).is_collection_private)
+
+    # Tests that replacing the items of a large collection costs a fixed number of queries.
+    def test_bulk_edit(self):
+        items = [
+            SimpleItem.objects.create(name=f"Bib {i}", quantity=1, location="Gym", instructions="-", photo=self.image)
+            for i in range(100)
+        ]
+        with CaptureQueriesContext(connection) as few:
+            self.public.items_list.set(items[:10])
+        with CaptureQueriesContext(connection) as many:
+            self.public.items_list.set(items[10:])
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(Item.objects.filter(shared_count=1).count(), 90)
+
+    # Tests that the create form reports every conflict and creates nothing.
+    def test_create_collection_reports_conflicts(self):
+        self.client.login(username="librarian", password="password")
+        response = self.client.post(reverse('borrow:create_collection'), {
+            'title': "Varsity", 'description': "Team", 'is_collection_private': 'on',
+            'items_list': [self.ball.pk, self.net.pk, self.cone.pk],
+        }, follow=True)
+        errors = [str(message) for message in response.context['messages']]
+        self.assertEqual(len(errors), 2)
+        self.assertIn("'Ball' is already in 'Coaching'", errors[0])
+        self.assertFalse(Collections.objects.filter(title="Varsity").exists())
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class ImplicitAccessTests(TestCase):
+    def setUp(self):
+        self.librarian = Librarian.objects.create(
+            user=User.objects.create_user(username="librarian", password="password"),
+            name="Librarian",
+            email="librarian@example.com"
+        )
+        self.other_librarian = Librarian.objects.create(
+            user=User.objects.create_user(username="other", password="password"),
+            name="Other Librarian",
+            email="other@example.com"
+        )
+        self.patrons = [
+            Patron.objects.create(
+                user=User.objects.create_user(username=f"patron{i}", password="password"),
+                name=f"Patron {i}",
+                email=f"patron{i}@example.com"
+            )
+            for i in range(3)
+        ]
+        self.client.login(username="librarian", password="password")
+
+    def create(self, title, private=False, grants=()):
+        data = {'title': title, 'description': "-", 'allowed_users': [patron.pk for patron in grants]}
+        if private:
+            data['is_collection_private'] = 'on'
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('borrow:create_collection'), data)
+        return Collections.objects.get(title=title), len(queries)
+
+    # Tests that public collections store no grants and cost the same to create however many patrons exist.
+    def test_public_creation_constant(self):
+        collection, few = self.create("Field Day")
+        self.assertEqual(collection.allowed_users.count(), 0)
+        for i in range(3, 30):
+            Patron.objects.create(user=User.objects.create_user(username=f"patron{i}"), name=f"P{i}", email=f"p{i}@example.com")
+        collection, many = self.create("Open Gym")
+        self.assertEqual(collection.allowed_users.count(), 0)
+        self.assertEqual(many, few)
+        self.assertTrue(collection.is_open_to(None))
+        # Grants picked for a public collection are dropped
+        collection, _ = self.create("Bench", grants=self.patrons[:1])
+        self.assertEqual(collection.allowed_users.count(), 0)
+
+    # Tests that private collections keep only real grants, with librarians let in by role.
+    def test_private_grants(self):
+        collection, _ = self.create("Coaching", private=True, grants=self.patrons[:1])
+        self.assertEqual(list(collection.allowed_users.all()), [self.patrons[0]])
+        self.assertTrue(collection.is_open_to(self.other_librarian, is_librarian=True))
+        self.assertTrue(collection.is_open_to(self.patrons[0]))
+        self.assertFalse(collection.is_open_to(self.patrons[1]))
+
+        url = reverse('borrow:collection_detail', args=[collection.pk])
+        self.client.login(username="other", password="password")
+        self.assertTrue(self.client.get(url).context['has_access'])
+        self.client.login(username="patron1", password="password")
+        self.assertContains(self.client.get(url), "You do not have permission to view items")
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class CollectionPermissionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        self.librarian = Librarian.objects.create(
+            user=User.objects.create_user(username="librarian", password="password"),
+            name="Librarian",
+            email="librarian@example.com"
+        )
+        self.patron = Patron.objects.create(
+            user=User.objects.create_user(username="patron", password="password"),
+            name="Patron",
+            email="patron@example.com"
+        )
+        self.public = Collections.objects.create(title="Field Day", description="All", creator=self.librarian)
+        self.private = []
+        for i in range(12):
+            collection = Collections.objects.create(
+                title=f"Team {i}", description="-", is_collection_private=True, creator=self.librarian,
+            )
+            item = SimpleItem.objects.create(name=f"Bib {i}", quantity=5, location="Gym", instructions="-", photo=image)
+            collection.items_list.add(item)
+            self.private.append(collection)
+            self.public.items_list.add(SimpleItem.objects.create(
+                name=f"Cone {i}", quantity=5, location="Gym", instructions="-", photo=image,
+            ))
+        for collection in self.private[:6]:
+            collection.allowed_users.add(self.patron)
+        self.client.login(username="patron", password="password")
+
+    def grant_queries(self, queries):
+        # The visibility subqueries also join the grants; only count the lookups of the user's own
+        return [
+            q for q in queries.captured_queries
+            if q['sql'].startswith('SELECT "borrow_collections"."id"') and 'borrow_collections_allowed_users' in q['sql']
+        ]
+
+    # Tests that every card's collection check on a page shares one load of the user's grants, kept across requests.
+    def test_grants_loaded_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('borrow:index'))
+        self.assertContains(response, "Bib 5")
+        self.assertNotContains(response, "Bib 6")
+        self.assertLessEqual(len(self.grant_queries(queries)), 1)
+        # One query for all the cards' collection chips
+        chips = [q for q in queries.captured_queries if 'INNER JOIN "borrow_collections_items_list"' in q['sql']]
+        self.assertEqual(len(chips), 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('borrow:collection_detail', args=[self.private[0].pk]))
+        self.assertEqual(self.grant_queries(queries), [])
+
+    # Tests that a new grant is picked up on the next request.
+    def test_grant_invalidates(self):
+        self.assertFalse(self.client.get(reverse('borrow:collection_detail', args=[self.private[6].pk])).context['has_access'])
+        self.private[6].allowed_users.add(self.patron)
+        self.assertTrue(self.client.get(reverse('borrow:collection_detail', args=[self.private[6].pk])).context['has_access'])
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class CollectionPickerTests(TestCase):
+    def setUp(self):
+        self.librarian = Librarian.objects.create(
+            user=User.objects.create_user(username="librarian", password="password"),
+            name="Librarian",
+            email="librarian@example.com"
+        )
+        self.patron = Patron.objects.create(
+            user=User.objects.create_user(username="patron", password="password"),
+            name="Patron",
+            email="patron@example.com"
+        )
+        image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        self.items = [
+            SimpleItem.objects.create(name=f"Ball {i:02d}", quantity=5, location="Gym", instructions="-", photo=image)
+            for i in range(30)
+        ]
+        self.collection = Collections.objects.create(
+            title="Varsity", description="-", is_collection_private=True, creator=self.librarian,
+        )
+        self.collection.items_list.add(self.items[3])
+        self.collection.allowed_users.add(self.patron)
+        self.client.login(username="librarian", password="password")
+
+    def add_patrons(self, count):
+        for i in range(count):
+            Patron.objects.create(user=User.objects.create_user(username=f"extra{i}"), name=f"Extra {i}", email=f"extra{i}@example.com")
+
+    # Tests that the collection forms render only the selected rows, at a cost independent of catalog and patron count.
+    def test_form_renders_selection_only(self):
+        url = reverse('borrow:edit_collection', args=[self.collection.pk])
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get(url)
+        self.assertContains(response, "Ball 03")
+        self.assertNotContains(response, "Ball 04")
+        self.assertContains(response, f'<input type="hidden" name="allowed_users" value="{self.patron.pk}">', html=True)
+
+        image = SimpleUploadedFile("test.jpg", b"file_content", content_type="image/jpeg")
+        for i in range(30, 60):
+            SimpleItem.objects.create(name=f"Ball {i:02d}", quantity=5, location="Gym", instructions="-", photo=image)
+        self.add_patrons(20)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(url)
+        self.assertEqual(len(few), len(many))
+
+        response = self.client.get(reverse('borrow:create_collection'))
+        self.assertNotContains(response, "Ball 0")
+        self.assertNotContains(response, "Extra 0")
+
+    # Tests that posted ids are saved and unknown ids are rejected.
+    def test_post_selected_ids(self):
+        response = self.client.post(reverse('borrow:create_collection'), {
+            'title': "Club", 'description': "-", 'items_list': [self.items[0].pk, self.items[1].pk],
+        })
+        self.assertRedirects(response, reverse('borrow:manage_collections'))
+        club = Collections.objects.get(title="Club")
+        self.assertEqual(set(club.items_list.values_list('pk', flat=True)), {self.items[0].pk, self.items[1].pk})
+
+        response = self.client.post(reverse('borrow:create_collection'), {
+            'title': "Ghost", 'description': "-", 'items_list': [self.items[0].pk, 999999],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('items_list', response.context['form'].errors)
+        self.assertFalse(Collections.objects.filter(title="Ghost").exists())
+
+    # Tests that the item lookup searches and pages through the catalog by cursor.
+    def test_item_lookup_pages(self):
+        url = reverse('borrow:item_lookup')
+        first = self.client.get(url).json()
+        self.assertEqual(len(first['results']), views.LOOKUP_PAGE_SIZE)
+        self.assertEqual(first['results'][0], {'id': self.items[0].pk, 'label': "Ball 00", 'detail': "Gym"})
+        second = self.client.get(url, {'cursor': first['next_cursor']}).json()
+        self.assertEqual([row['label'] for row in second['results']], [f"Ball {i:02d}" for i in range(20, 30)])
+        self.assertIsNone(second['next_cursor'])
+
+        found = self.client.get(url, {'q': "ball 1"}).json()
+        self.assertEqual(len(found['results']), 10)
+        self.assertEqual(self.client.get(url, {'cursor': "garbage"}).status_code, 400)
+
+    # Tests that only librarians may look up patrons, and that the lookup matches names and emails.
+    def test_patron_lookup(self):
+        self.add_patrons(3)
+        url = reverse('borrow:patron_lookup')
+        found = self.client.get(url, {'q': "extra1@"}).json()
+        self.assertEqual([row['label'] for row in found['results']], ["Extra 1"])
+
+        self.client.login(username="patron", password="password")
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+def jpeg_upload(name="photo.jpg", size=(1200, 800), orientation=None):
+    image = Image.new('RGB', size, 'red')
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', exif=exif)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/jpeg")
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class PhotoVariantTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def create_item(self, photo):
+        with self.captureOnCommitCallbacks(execute=True):
+            item = SimpleItem.objects.create(name="Ball", quantity=5, location="Gym", instructions="-", photo=photo)
+        item.refresh_from_db()
+        return item
+
+    # Tests that an upload gets upright WebP and JPEG copies in each width bucket plus a placeholder.
+    def test_upload_makes_variants(self):
+        # Orientation 6: the camera was held sideways, so the photo is 800 wide once upright
+        item = self.create_item(jpeg_upload(orientation=6))
+        variants = item.photo_variants
+        self.assertEqual(variants['source'], item.photo.name)
+        self.assertEqual((variants['width'], variants['height']), (800, 1200))
+        self.assertEqual([width for width, _ in variants['webp']], [160, 320, 640])
+        self.assertTrue(variants['placeholder'].startswith('data:image/jpeg;base64,'))
+        width, name = variants['webp'][-1]
+        with fs.open(name) as f:
+            copy = Image.open(f)
+            self.assertEqual((copy.format, copy.size), ('WEBP', (640, 960)))
+
+        response = self.client.get(reverse('borrow:index'))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, f'{fs.url(name)} 640w')
+        self.assertContains(response, 'loading="lazy"')
+
+    # Tests that a photo that cannot be decoded is served as it is.
+    def test_undecodable_photo_falls_back(self):
+        item = self.create_item(SimpleUploadedFile("bad.jpg", b"file_content", content_type="image/jpeg"))
+        self.assertEqual(item.photo_variants, {'source': item.photo.name})
+        response = self.client.get(reverse('borrow:detail', args=[item.pk]))
+        self.assertContains(response, f'src="{item.photo.url}"')
+        self.assertNotContains(response, 'srcset=')
+
+    # Tests that replacing a photo serves the original until the new copies exist, then removes the old ones.
+    def test_replacing_photo(self):
+        item = self.create_item(jpeg_upload(size=(300, 200)))
+        # Smaller than every bucket but the first: one copy at its own width
+        self.assertEqual([width for width, _ in item.photo_variants['jpeg']], [160, 300])
+        old = [name for _, name in item.photo_variants['jpeg']]
+
+        item.photo = jpeg_upload("new.jpg")
+        item.save()
+        self.assertContains(self.client.get(reverse('borrow:detail', args=[item.pk])), f'src="{item.photo.url}"')
+        make_variants(item, 'photo')
+        self.assertIn('new', item.photo_variants['jpeg'][0][1])
+        self.assertFalse(any(fs.exists(name) for name in old))
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    MEDIA_ROOT='/tmp/django_test_media',
+    MEDIA_URL='/media/'
+)
+class PhotoBackfillTests(TransactionTestCase):
+    # Tests that the backfill command processes every photo without copies, in parallel, and skips them afterwards.
+    def test_backfill(self):
+        items = [
+            SimpleItem.objects.create(name=f"Ball {i}", quantity=5, location="Gym", instructions="-", photo=jpeg_upload())
+            for i in range(4)
+        ]
+        # As if uploaded before copies were made
+        Item.objects.update(photo_variants={})
+        patron = Patron.objects.create(
+            user=User.objects.create_user(username="patron"), name="Patron", email="patron@example.com",
+            profile_photo=jpeg_upload("me.jpg", size=(400, 400)),
+        )
+        Patron.objects.update(profile_photo_variants={})
+
+        out = StringIO()
+        call_command('make_photo_variants', workers=3, stdout=out)
+        self.assertIn("Processed 5 photo(s): 5 resized", out.getvalue())
+        for item in Item.objects.filter(pk__in=[item.pk for item in items]):
+            self.assertEqual(item.photo_variants['source'], item.photo.name)
+        patron.refresh_from_db()
+        self.assertEqual([width for width, _ in patron.profile_photo_variants['webp']], [32, 64, 128])
+
+        out = StringIO()
+        call_command('make_photo_variants', stdout=out)
+        self.assertIn("Processed 0 photo(s)", out.getvalue())
@@ -7,6 +7,13 @@ urlpatterns = [
     path("", views.IndexView.as_view(), name="index"), # search bar and all the options 
     path("item/<int:pk>/", views.DetailView.as_view(), name="detail"),
     path('collection/<int:pk>/', views.CollectionDetailView.as_view(), name='collection_detail'),
+    path('items/page/', views.item_page, name='item_page'),
+    path('collection/<int:pk>/items/page/', views.item_page, name='collection_item_page'),
+    path('api/items/', views.item_page_json, name='item_page_json'),
+    path('api/collection/<int:pk>/items/', views.item_page_json, name='collection_item_page_json'),
+    path('api/search/', views.search, name='search'),
+    path('api/autocomplete/', views.autocomplete, name='autocomplete'),
+    path('api/item/<int:pk>/availability/', views.item_availability, name='item_availability'),
     path('add_item/', views.add_item, name='add_item'),
     path('add_simple_item/', views.add_simple_item, name='add_simple_item'),
     path('add_complex_item/', views.add_complex_item, name='add_complex_item'),
@@ -17,11 +24,14 @@ urlpatterns = [
     path('create_collection/', views.create_collection, name='create_collection'),
     path('manage_collections/edit/<int:pk>/', views.edit_collection, name='edit_collection'),
     path('manage_collections/delete/<int:pk>/', views.delete_collection, name='delete_collection'),
+    path('api/lookup/items/', views.item_lookup, name='item_lookup'),
+    path('api/lookup/patrons/', views.patron_lookup, name='patron_lookup'),
     path("<int:pk>/review/", views.add_review, name="add_review"),
     path("review/<int:review_id>/delete/", views.delete_review, name="delete_review"),
     path('my_borrowed_items/', views.my_borrowed_items, name='my_borrowed_items'),
     path('all_borrowed_items/', views.all_borrowed_items, name='all_borrowed_items'),
     path('return_item/<int:borrowed_item_id>/', views.return_item, name='return_item'),
+    path('waitlist/<int:pk>/cancel/', views.cancel_waitlist, name='cancel_waitlist'),
     path('request_collection/<int:pk>/', views.request_collection, name='request_collection'),
     path('approve_collection_requests/', views.approve_collection_requests, name='approve_collection_requests'),
     path('manage_items/', views.manage_items, name='manage_items'),
@@ -29,5 +39,7 @@ urlpatterns = [
     path('manage_items/delete/<int:pk>/', views.delete_item, name='delete_item'),
     path('messages/', views.message_list, name='messages'),
     path('messages/<int:message_id>/read/', views.mark_message_read, name='mark_message_read'),
+    path('messages/read/', views.mark_messages_read, name='mark_messages_read'),
     path('messages/unread-count/', views.unread_message_count, name='unread_message_count'),
+    path('events/', views.event_stream, name='event_stream'),
 ]
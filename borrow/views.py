@@ -1,5 +1,9 @@
-from django.db.models import F
-from django.http import HttpResponseRedirect, HttpResponseForbidden, HttpResponseBadRequest, HttpResponseNotFound, JsonResponse
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, prefetch_related_objects
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseRedirect, HttpResponseForbidden, HttpResponseBadRequest, HttpResponseNotFound, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render, redirect
 from django.urls import reverse
 from django.views import generic
@@ -9,8 +13,18 @@ from django.contrib import messages
 from django.db.models import Q
 
 
-from .models import Librarian, SimpleItem, ComplexItem, Item, BorrowedItem, Patron, Collections, BorrowRequest, Review, CollectionRequest, Message
-from .forms import SimpleItemForm, ComplexItemForm, QuantityForm, CollectionForm, ReviewForm, CollectionRequestForm
+from .models import Librarian, ComplexItem, Item, BorrowedItem, Patron, Collections, BorrowRequest, Review, CollectionRequest, Message
+from .forms import SimpleItemForm, ComplexItemForm, QuantityForm, ReservationForm, CollectionForm, ReviewForm, CollectionRequestForm
+from .filters import ItemFilter
+from .pagination import KeysetPage, KeysetPaginator, InvalidCursor
+from .search import collection_search_q, search_catalog
+from .autocomplete import suggest
+from .facets import facet_counts, facet_context
+from .membership import CollectionConflict, collection_conflicts
+from .inventory import InventoryError, return_borrowed_item, total_stock
+from .notifications import live_digest_counts, send_message_to_librarians
+from . import approvals, catalog_cache, events, reviews, waitlist
+from .reservations import day_window, month_availability, units_free
 
 def index(request):
     return render(request, 'borrow/index.html')
@@ -20,57 +34,30 @@ class IndexView(generic.ListView):
     context_object_name = "borrow_items_list"
 
     def get_queryset(self):
-        # Always return items queryset for the main list
-        qs = Item.objects.all().order_by('name')
+        # Always return items queryset for the main list, limited to what the user may see
+        qs = Item.objects.visible_to(self.request.user)
         
         # Get the active tab
         tab = self.request.GET.get('tab', 'items')
         
         # Only apply item filters if we're on the items tab or no tab is specified
         if tab != 'collections':
-            # Category filtering
-            cat = self.request.GET.get('category')
-            if cat in dict(Item.CATEGORY_CHOICES):
-                qs = qs.filter(category=cat)
-            
-            # Search filtering
-            q = self.request.GET.get("q", "").strip()
-            if q:
-                qs = qs.filter(
-                    Q(name__icontains=q)
-                    | Q(location__icontains=q)
-                    | Q(instructions__icontains=q)
-                )
-            
-            # Add minimum quantity filtering
-            min_quantity = self.request.GET.get('min_quantity')
-            if min_quantity:
-                try:
-                    min_quantity = int(min_quantity)
-                    qs = qs.filter(quantity__gte=min_quantity)
-                except ValueError:
-                    pass
-            
-            # Add item type filtering
-            item_type = self.request.GET.get('item_type')
-            if item_type == 'simple':
-                # Filter for SimpleItems
-                qs = qs.filter(simpleitem__isnull=False)
-            elif item_type == 'complex':
-                # Filter for ComplexItems
-                qs = qs.filter(complexitem__isnull=False)
-                
-                # Add condition filtering for complex items
-                condition = self.request.GET.get('condition')
-                if condition:
-                    # Use complexitem__condition to filter by condition
-                    qs = qs.filter(complexitem__condition=condition)
+            qs = ItemFilter(self.request.GET).apply(qs)
         
         return qs
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
+        # Only render one keyset page; the rest is fetched as the user scrolls
+        tab = self.request.GET.get('tab', 'items')
+        item_filter = ItemFilter(self.request.GET) if tab != 'collections' else None
+        page = paginate_items(self.request, self.object_list, 'catalog', item_filter)
+        # Collection chips for every card on the page in one query
+        prefetch_related_objects(page.items, 'collections')
+        context['borrow_items_list'] = page.items
+        context.update(next_page_context(self.request, page, reverse('borrow:item_page')))
+        
         # Get current tab
         context['current_tab'] = self.request.GET.get('tab', 'items')
         
@@ -91,10 +78,7 @@ class IndexView(generic.ListView):
         # Apply collection filters if on collections tab
         if context['current_tab'] == 'collections':
             if context['collection_q']:
-                collections = collections.filter(
-                    Q(title__icontains=context['collection_q']) |
-                    Q(description__icontains=context['collection_q'])
-                )
+                collections = collections.filter(collection_search_q(context['collection_q']))
             
             if context['collection_visibility'] == 'public':
                 collections = collections.filter(is_collection_private=False)
@@ -111,6 +95,11 @@ class IndexView(generic.ListView):
         context['CategoryChoices'] = Item.CATEGORY_CHOICES
         context['ConditionChoices'] = ComplexItem.CONDITION_CHOICES
         
+        # Sidebar counts for every filter option, from one cached aggregate query
+        user = self.request.user
+        counts = facet_counts(self.request, 'catalog', Item.objects.visible_to(user), ItemFilter(self.request.GET))
+        context.update(facet_context(counts))
+        
         return context
 
 
@@ -118,210 +107,214 @@ class DetailView(generic.DetailView):
     model = Item
     template_name = "borrow/detail.html"
     
+    def get_queryset(self):
+        # Load the item as its SimpleItem/ComplexItem subclass
+        return Item.objects.polymorphic()
+    
+    def get_object(self, queryset=None):
+        # dispatch() and get() both need it; load it once
+        if not hasattr(self, '_item'):
+            self._item = super().get_object(queryset)
+        return self._item
+
     def dispatch(self, request, *args, **kwargs):
         item = self.get_object()
-        if not item.can_view(request.user):
+        if not Item.objects.visible_to(request.user).filter(pk=item.pk).exists():
             return HttpResponseForbidden("You do not have permission to view this item.")
         return super().dispatch(request, *args, **kwargs)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        item = self.get_object()
-        borrowed_items = BorrowedItem.objects.filter(item=item, returned=False)
-        borrowers_info = []
-        for borrowed_item in borrowed_items:
-            borrowers_info.append({
-                "borrower_name": borrowed_item.borrower.name,
-                "borrowed_quantity": borrowed_item.quantity,
-                "due_date": borrowed_item.due_date,
-                "is_late": borrowed_item.is_late()
-            })
-        context['borrowers_info'] = borrowers_info
-        reviews = item.reviews.all().order_by('-created_at')
-        avg_score = 0
-        if reviews.exists():
-            total_rating = sum(review.rating for review in reviews)
-            avg_score = round(total_rating / reviews.count(), 1)
-        context['avg_review_score'] = avg_score
-        context['review_count'] = reviews.count()
-        if self.request.user.is_authenticated:
-            try:
-                patron = Patron.objects.get(user=self.request.user)
-                user_review = None
-                for review in reviews:
-                    if review.reviewer.user == self.request.user:
-                        user_review = review
-                        break
-                if user_review:
-                    reviews_list = list(reviews)
-                    reviews_list.remove(user_review)
-                    reviews_list.insert(0, user_review)
-                    reviews = reviews_list
-                
-                has_borrowed = BorrowedItem.objects.filter(
-                    borrower=patron,
-                    item=item
-                ).exists()
-                has_reviewed = Review.objects.filter(
-                    reviewer=patron,
-                    item=item
-                ).exists()
-                
-                context['can_review'] = has_borrowed
-                context['has_reviewed'] = has_reviewed
-            except Patron.DoesNotExist:
-                context['can_review'] = False
-                context['has_reviewed'] = False
+        item = self.object
+        # The same for every viewer, so computed once and shared through the cache
+        context.update(catalog_cache.cached(
+            (catalog_cache.CATALOG, catalog_cache.STOCK), ('detail', item.pk), lambda: item_summary(item)
+        ))
+
+        # Average and histogram come from the aggregates stored on the item
+        context['avg_review_score'] = item.average_rating
+        context['review_count'] = item.review_count
+        context['rating_histogram'] = item.rating_histogram
+
+        # The patron's own review is fetched on its own and shown first; the
+        # rest are keyset-paginated, newest first
+        patron = self.request.role.patron
+        own_review = None
+        others = item.reviews.select_related('reviewer')
+        if patron is not None:
+            own_review = others.filter(reviewer=patron).first()
+            others = others.exclude(reviewer=patron)
+        paginator = KeysetPaginator(ordering=('-created_at', '-pk'), per_page=REVIEWS_PER_PAGE)
+        cursor = self.request.GET.get('reviews_cursor')
+        try:
+            page = paginator.paginate(others, cursor)
+        except InvalidCursor:
+            cursor = None
+            page = paginator.paginate(others)
+        review_list = page.items
+        if own_review is not None and not cursor:
+            review_list = [own_review] + review_list
+        context['reviews'] = review_list
+        context['own_review'] = own_review
+        context['next_reviews_url'] = f"?reviews_cursor={page.next_cursor}#reviews" if page.has_next else None
+
+        if patron is not None:
+            context['can_review'] = BorrowedItem.objects.filter(borrower=patron, item=item).exists()
+            context['has_reviewed'] = own_review is not None
         else:
             context['can_review'] = False
             context['has_reviewed'] = False
-        
-        context['reviews'] = reviews
-        context['is_complex_item'] = hasattr(item, 'complexitem')
+        context['is_complex_item'] = item.is_complex
         return context
 
+
+REVIEWS_PER_PAGE = 10
+
+
+def item_summary(item):
+    """Current loans of the item, for the item page."""
+    borrowers_info = []
+    for borrowed_item in BorrowedItem.objects.filter(item=item, returned=False).select_related('borrower'):
+        borrowers_info.append({
+            "borrower_name": borrowed_item.borrower.name,
+            "borrowed_quantity": borrowed_item.quantity,
+            "due_date": borrowed_item.due_date,
+            "is_late": borrowed_item.is_late()
+        })
+    return {'borrowers_info': borrowers_info}
+
 def borrow_item(request, pk):
     try:
-        patron = Patron.objects.get(user=request.user)
+        patron = request.role.get_patron()
     except Patron.DoesNotExist:
         return redirect('account:profile')  # Redirect if not a Patron
     
-    # Get item from the list
-    item = get_object_or_404(Item, pk=pk)
+    # Get item from the list, already loaded as its SimpleItem/ComplexItem subclass
+    item = get_object_or_404(Item.objects.polymorphic(), pk=pk)
     
     # Check if it's a simple item or complex item
-    is_simple_item = hasattr(item, 'simpleitem')
-    is_complex_item = hasattr(item, 'complexitem')
+    is_simple_item = item.is_simple
+    is_complex_item = item.is_complex
     
-    if is_simple_item:
-        # Create a form instance with POST data if the form is submitted for Simple Items
-        form = QuantityForm(request.POST or None)
+    # Quantity only applies to simple items; complex items are borrowed one at a time
+    form = QuantityForm(request.POST or None, max_quantity=total_stock(item)) if is_simple_item else None
+    # Optional dates to reserve the item ahead of time
+    window_form = ReservationForm(request.POST or None)
+    
+    if request.method == "POST" and (form is None or form.is_valid()) and window_form.is_valid():
+        quantity = form.cleaned_data['quantity'] if form else 1
+        start_date = end_date = None
+        if window_form.cleaned_data.get('start_date'):
+            start_date, end_date = day_window(window_form.cleaned_data['start_date'], window_form.cleaned_data['end_date'])
         
-        if request.method == "POST" and form.is_valid():
-            quantity = form.cleaned_data['quantity']
+        now = timezone.now()
+        # Out of stock: join the item's waitlist instead of the librarians' queue. With
+        # some units free the librarians decide, even if fewer than asked for
+        waitlisted = start_date is None and units_free(item, now, now + timedelta(days=item.days_to_return)) < 1
+        with transaction.atomic():
             borrow_request = BorrowRequest.objects.create(
                 borrower=patron, 
                 item=item, 
                 quantity=quantity, 
-                date=timezone.now()
+                date=now,
+                start_date=start_date,
+                end_date=end_date,
+                status=BorrowRequest.WAITLISTED if waitlisted else BorrowRequest.PENDING
             )
-            borrow_request.save()
-            send_message_to_librarians(
-                subject=f"New Borrow Request: {patron.name} - {item.name}",
-                content=f"{patron.name} has requested to borrow {quantity} {item.name}.",
-                link=reverse('borrow:approve_requests'),
-                sender=patron
+            # Stock may have come back since the check above
+            if waitlisted and borrow_request in waitlist.allocate([item.pk]):
+                messages.success(request, f"{item.name} has been lent to you.", extra_tags='current-page')
+                return redirect('borrow:detail', pk=pk)
+        if waitlisted:
+            messages.info(
+                request,
+                f"{item.name} is out of stock. You are number {waitlist.position(borrow_request)} on the waitlist "
+                "and it will be lent to you automatically when it comes back.",
+                extra_tags='current-page'
             )
-            messages.success(request, 'Your borrow request has been sent to the librarian.', extra_tags='current-page')
             return redirect('borrow:detail', pk=pk)
         
-        return render(request, 'borrow/borrow.html', {'form': form, 'item': item, 'is_simple_item': True})
+        amount = f"{quantity} " if form else ""
+        when = f" from {start_date:%b %d} to {window_form.cleaned_data['end_date']:%b %d}" if start_date else ""
+        send_message_to_librarians(
+            subject=f"New Borrow Request: {patron.name} - {item.name}",
+            content=f"{patron.name} has requested to borrow {amount}{item.name}{when}.",
+            link=reverse('borrow:approve_requests'),
+            sender=patron,
+            digest='borrow_requests'
+        )
+        messages.success(request, 'Your borrow request has been sent to the librarian.', extra_tags='current-page')
+        return redirect('borrow:detail', pk=pk)
     
-    else:
-        # For complex items - no quantity needed
-        if request.method == "POST":
-            # Default quantity to 1 for complex items
-            borrow_request = BorrowRequest.objects.create(
-                borrower=patron, 
-                item=item, 
-                quantity=1,  # Default quantity for complex items
-                date=timezone.now()
-            )
-            borrow_request.save()
-            send_message_to_librarians(
-                subject=f"New Borrow Request: {patron.name} - {item.name}",
-                content=f"{patron.name} has requested to borrow {item.name}.",
-                link=reverse('borrow:approve_requests'),
-                sender=patron
-            )
-            messages.success(request, 'Your borrow request has been sent to the librarian.', extra_tags='current-page')
-            return redirect('borrow:detail', pk=pk)
-        
-        return render(request, 'borrow/borrow.html', {
-            'item': item, 
-            'is_simple_item': is_simple_item, 
-            'is_complex_item': is_complex_item
-        })
+    return render(request, 'borrow/borrow.html', {
+        'form': form,
+        'window_form': window_form,
+        'item': item, 
+        'waiting': waitlist.queue(item).count() if item.quantity < 1 else 0,
+        'is_simple_item': is_simple_item, 
+        'is_complex_item': is_complex_item
+    })
 
 
 def approve_requests(request):
     try:
-        librarian = Librarian.objects.get(user=request.user) 
+        librarian = request.role.get_librarian() 
     except Librarian.DoesNotExist:
         return HttpResponseForbidden("You are not a librarian and cannot approve requests.")
 
     # Fetch all the borrow requests that are PENDING
     borrow_requests = BorrowRequest.objects.filter(status=BorrowRequest.PENDING)
+    # Waitlisted requests are lent automatically, but may be rejected to unblock a queue
+    waitlisted = BorrowRequest.objects.filter(status=BorrowRequest.WAITLISTED).select_related('item', 'borrower').order_by('item', 'date', 'pk')
 
     if request.method == "POST":
-        request_id = request.POST.get('request_id')
         action = request.POST.get('action')  # 'approve' or 'reject'
+        handlers = {'approve': approvals.approve_borrow_requests, 'reject': approvals.reject_borrow_requests}
+        return handle_queue_action(request, handlers.get(action), librarian, 'borrow:approve_requests', 'borrow/approve.html', {
+            'borrow_requests': borrow_requests,
+            'waitlisted': waitlisted,
+        })
 
-        try:
-            borrow_request = BorrowRequest.objects.get(id=request_id)
-        except BorrowRequest.DoesNotExist:
-            messages.error(request, "Borrow request not found.", extra_tags='current-page')
-            return redirect('borrow:approve_requests')
-
-        if action == 'approve':
-            try: 
-                item = borrow_request.item
-                success = False
-
-                try:
-                    # Try to get the item as a SimpleItem
-                    simple_item = SimpleItem.objects.get(id=item.id)
-                    success = borrow_request.borrower.borrow_simple_item(simple_item, borrow_request.quantity, simple_item.days_to_return)
-                except SimpleItem.DoesNotExist:
-                    # If it's not a SimpleItem, try ComplexItem
-                    try:
-                        complex_item = ComplexItem.objects.get(id=item.id)
-                        success = borrow_request.borrower.borrow_complex_item(complex_item, complex_item.days_to_return)
-                    except ComplexItem.DoesNotExist:
-                        messages.error(request, f"Item {item.name} not found in either Simple or Complex categories.", extra_tags='current-page')
-                        return redirect('borrow:approve_requests')
-                
-                if success:
-                    # Mark the BorrowRequest as approved
-                    borrow_request.status = BorrowRequest.APPROVED
-                    borrow_request.save()
-
-                    messages.success(request, f"Request for {borrow_request.quantity} of {item.name} has been approved.", extra_tags='current-page')
-                else:
-                    messages.error(request, f"Item borrowing failed for {borrow_request.item.name}. Please try again.", extra_tags='current-page')
-            except Exception as e:
-                messages.error(request, f"Error occurred while approving the request: {str(e)}", extra_tags='current-page')
-                return redirect('borrow:approve_requests')
-            
-            borrow_request.approve()
-            send_message(
-                recipient=borrow_request.borrower,
-                subject=f"Borrow Request Approved: {borrow_request.item.name}",
-                content=f"Your request to borrow {borrow_request.item.name} has been approved.",
-                sender=librarian
-            )
-
-        elif action == 'reject':
-            borrow_request.status = BorrowRequest.REJECTED
-            borrow_request.save()
-            messages.error(request, f"Request for {borrow_request.item.name} has been rejected.", extra_tags='current-page')
-            borrow_request.reject()
-            send_message(
-                recipient=borrow_request.borrower,
-                subject=f"Borrow Request Rejected: {borrow_request.item.name}",
-                content=f"Your request to borrow {borrow_request.item.name} has been rejected.",
-                sender=librarian
-            )
-
-        return redirect('borrow:approve_requests')
+    return render(request, 'borrow/approve.html', {'borrow_requests': borrow_requests, 'waitlisted': waitlisted})
 
-    return render(request, 'borrow/approve.html', {'borrow_requests': borrow_requests})
+def handle_queue_action(request, handler, librarian, queue_url, template, context):
+    """
+    Run a bulk approve/reject `handler` on the posted selection. A multi-select
+    (request_ids) re-renders the queue with a per-request summary; a single
+    row's buttons (request_id) report through messages and redirect as before.
+    """
+    if handler is None:
+        messages.error(request, "Unknown action.", extra_tags='current-page')
+        return redirect(queue_url)
+    
+    request_ids = request.POST.getlist('request_ids')
+    bulk = bool(request_ids)
+    if not bulk:
+        request_ids = [request.POST.get('request_id')]
+    
+    try:
+        results = handler(request_ids, librarian)
+    except InventoryError as e:
+        messages.error(request, e.message, extra_tags='current-page')
+        return redirect(queue_url)
+    
+    if bulk:
+        context['results'] = results
+        context['succeeded'] = sum(result.ok for result in results)
+        return render(request, template, context)
+    
+    for result in results:
+        if result.ok:
+            messages.success(request, f"{result.label} – {result.message}", extra_tags='current-page')
+        else:
+            messages.error(request, f"{result.label or 'Request'} – {result.message}", extra_tags='current-page')
+    return redirect(queue_url)
 
 @login_required
 def add_item(request):
     # Only librarians can reach this
     try:
-        Librarian.objects.get(user=request.user)
+        request.role.get_librarian()
     except Librarian.DoesNotExist:
         return HttpResponseForbidden("You are not a librarian and cannot add items.")
     
@@ -345,7 +338,7 @@ def add_item(request):
 def add_simple_item(request):
     # only librarians can add
     try:
-        Librarian.objects.get(user=request.user)
+        request.role.get_librarian()
     except Librarian.DoesNotExist:
         return HttpResponseForbidden("You are not a librarian and cannot add items.")
 
@@ -374,7 +367,7 @@ def add_simple_item(request):
 def add_complex_item(request):
     # only librarians can add
     try:
-        Librarian.objects.get(user=request.user)
+        request.role.get_librarian()
     except Librarian.DoesNotExist:
         return HttpResponseForbidden("You are not a librarian and cannot add items.")
 
@@ -400,7 +393,7 @@ def add_complex_item(request):
 
 def manage_users(request):
     try:
-        librarian = Librarian.objects.get(user=request.user)  # Try to get the librarian instance
+        librarian = request.role.get_librarian()  # Try to get the librarian instance
     except Librarian.DoesNotExist:
         return HttpResponseForbidden("You are not a librarian and cannot add items.")
         
@@ -447,10 +440,10 @@ def manage_users(request):
 @login_required
 def manage_collections(request):
     try:
-        creator = Librarian.objects.get(user=request.user)
+        creator = request.role.get_librarian()
         is_librarian = True
     except Librarian.DoesNotExist:
-        creator = Patron.objects.get(user=request.user)
+        creator = request.role.get_patron()
         is_librarian = False
     
     my_collections = Collections.objects.filter(creator=creator).order_by("title")
@@ -471,10 +464,10 @@ def manage_collections(request):
 @login_required
 def edit_collection(request, pk):
     try:
-        librarian = Librarian.objects.get(user=request.user)
+        librarian = request.role.get_librarian()
         is_librarian = True
     except Librarian.DoesNotExist:
-        creator = Patron.objects.get(user=request.user)
+        creator = request.role.get_patron()
         is_librarian = False
 
     if is_librarian:
@@ -487,30 +480,22 @@ def edit_collection(request, pk):
                               librarian=librarian if is_librarian else creator,
                               is_librarian=is_librarian, editing=True)
         if form.is_valid():
-            # compute newly‐added items only
-            old_set = set(coll.items_list.all())
-            new_set = set(form.cleaned_data['items_list']) - old_set
-            errs = []
-            for item in new_set:
-                existing = Collections.objects.exclude(pk=coll.pk).filter(items_list=item)
-                if coll.is_collection_private:
-                    if existing.exists():
-                        errs.append(
-                            f"'{item.name}' is in other collection(s). "
-                            "Remove it from all other collections before adding it to a private collection."
-                        )
-                else:
-                    priv = existing.filter(is_collection_private=True).first()
-                    if priv:
-                        errs.append(
-                            f"'{item.name}' is in private collection “{priv.title}”. "
-                            "Remove it from that collection before adding it to a public collection."
-                        )
+            # Only newly added items are checked, all in one query
+            errs = [
+                conflict.message
+                for conflict in collection_conflicts(form.cleaned_data['items_list'], coll.is_collection_private, coll)
+            ]
+            if not errs:
+                try:
+                    with transaction.atomic():
+                        form.save()
+                except CollectionConflict as e:
+                    # Another edit took one of the items in the meantime
+                    errs = e.messages
             if errs:
                 for e in errs:
                     messages.error(request, e, extra_tags='current-page')
             else:
-                form.save()
                 messages.success(request, f"Collection '{coll.title}' updated.", extra_tags='current-page')
                 return redirect('borrow:manage_collections')
     else:
@@ -526,10 +511,10 @@ def edit_collection(request, pk):
 @login_required
 def delete_collection(request, pk):
     try:
-        librarian = Librarian.objects.get(user=request.user)
+        librarian = request.role.get_librarian()
         is_librarian = True
     except Librarian.DoesNotExist:
-        creator = Patron.objects.get(user=request.user)
+        creator = request.role.get_patron()
         is_librarian = False
     
     if is_librarian:
@@ -556,89 +541,200 @@ class CollectionDetailView(generic.DetailView):
         return super().dispatch(request, *args, **kwargs)
     
     def get_visible_items(self):
-        collection = self.get_object()
-        user = self.request.user
-        
-        # Determine which items are visible to the user
-        if not collection.is_collection_private:
-            visible_items = collection.items_list.all()
-        else:
-            from .models import Librarian
-            if user.is_authenticated and Librarian.objects.filter(user=user).exists():
-                visible_items = collection.items_list.all()
-            elif user.is_authenticated and collection.allowed_users.filter(pk=user.patron.pk).exists():
-                visible_items = collection.items_list.all()
-            else:
-                visible_items = []
-                
-        return visible_items
+        # Private collections only expose their items to librarians and allowed users
+        return self.object.items_list.visible_to(self.request.user)
         
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Get visible items based on permissions
+        # Get visible items based on permissions and apply all filters
+        item_filter = ItemFilter(self.request.GET)
         visible_items = self.get_visible_items()
+        page = paginate_items(
+            self.request, item_filter.apply(visible_items), f'collection:{self.object.pk}', item_filter
+        )
         
-        # Apply all filters
-        # Category filtering
-        current_category = self.request.GET.get('category', '')
-        if current_category in dict(Item.CATEGORY_CHOICES):
-            visible_items = visible_items.filter(category=current_category)
-        
-        # Search filtering
-        q = self.request.GET.get("q", "").strip()
-        if q:
-            visible_items = visible_items.filter(
-                Q(name__icontains=q) |
-                Q(location__icontains=q) |
-                Q(instructions__icontains=q)
-            )
-        
-        # Item type filtering
-        item_type = self.request.GET.get('item_type', '')
-        if item_type == 'simple':
-            # Filter for SimpleItems
-            visible_items = visible_items.filter(simpleitem__isnull=False)
-        elif item_type == 'complex':
-            # Filter for ComplexItems
-            visible_items = visible_items.filter(complexitem__isnull=False)
-            
-            # Add condition filtering for complex items
-            condition = self.request.GET.get('condition', '')
-            if condition:
-                # Use complexitem__condition to filter by condition
-                visible_items = visible_items.filter(complexitem__condition=condition)
-        
-        # Minimum quantity filtering
-        min_quantity = self.request.GET.get('min_quantity', '')
-        if min_quantity:
-            try:
-                min_quantity = int(min_quantity)
-                visible_items = visible_items.filter(quantity__gte=min_quantity)
-            except ValueError:
-                pass
-        
-        # Add items to context
-        context['visible_items'] = visible_items
+        # Add the first page of items to context; the rest is fetched as the user scrolls
+        prefetch_related_objects(page.items, 'collections')
+        context['visible_items'] = page.items
+        context['has_access'] = self.request.role.can_open(self.object)
+        context.update(next_page_context(
+            self.request, page, reverse('borrow:collection_item_page', args=[self.object.pk])
+        ))
         
         # Add all filter parameters to context
-        context['q'] = q
-        context['current_category'] = current_category
-        context['item_type'] = item_type
+        context['q'] = item_filter.q
+        context['current_category'] = item_filter.category
+        context['item_type'] = self.request.GET.get('item_type', '')
         context['condition'] = self.request.GET.get('condition', '')
-        context['min_quantity'] = min_quantity
+        context['min_quantity'] = self.request.GET.get('min_quantity', '')
         
         # Add choices to context
         context['CategoryChoices'] = Item.CATEGORY_CHOICES
         context['ConditionChoices'] = ComplexItem.CONDITION_CHOICES
         
+        # Sidebar counts for every filter option, from one cached aggregate query
+        counts = facet_counts(self.request, f'collection:{self.object.pk}', visible_items, item_filter)
+        context.update(facet_context(counts))
+        
         return context
 
+
+ITEMS_PER_PAGE = 24
+
+
+def paginate_items(request, queryset, scope=None, item_filter=None):
+    """
+    Keyset-paginate catalog items by (name, id), continuing after ?cursor= if given.
+
+    With a `scope`, the ordered ids are cached (see catalog_cache.item_ids) and
+    each page is cut from that list, so a page costs one query by primary key.
+    That query still goes through `queryset`, so an item the user may no longer
+    see is dropped even if the cached list is stale.
+    """
+    paginator = KeysetPaginator(ordering=('name', 'pk'), per_page=ITEMS_PER_PAGE)
+    # Cards show bulk/individual details, so load each item as its subclass
+    queryset = queryset.polymorphic()
+    try:
+        cursor = request.GET.get('cursor')
+        cursor_values = paginator.decode_cursor(queryset, cursor) if cursor else None
+    except InvalidCursor:
+        cursor = cursor_values = None
+
+    ids = catalog_cache.item_ids(request, scope, queryset, item_filter, paginator.ordering) if scope else None
+    if ids is not None:
+        start = 0
+        if cursor_values is not None:
+            try:
+                start = ids.index(cursor_values[-1]) + 1
+            except ValueError:
+                # The cursor's item has left the list since; continue from the database instead
+                ids = None
+    if ids is None:
+        return paginator.paginate(queryset, cursor)
+
+    page_ids = ids[start:start + ITEMS_PER_PAGE]
+    by_pk = {item.pk: item for item in queryset.filter(pk__in=page_ids)}
+    items = [by_pk[pk] for pk in page_ids if pk in by_pk]
+    has_next = start + ITEMS_PER_PAGE < len(ids)
+    return KeysetPage(items, paginator.encode_cursor(items[-1]) if has_next and items else None)
+
+
+def next_page_context(request, page, fragment_url):
+    """Links to the next page: a full-page URL for plain navigation and a fragment URL for infinite scroll."""
+    if not page.has_next:
+        return {'next_page_url': None, 'next_fragment_url': None}
+    params = request.GET.copy()
+    params['cursor'] = page.next_cursor
+    query = params.urlencode()
+    return {
+        'next_page_url': f"{request.path}?{query}",
+        'next_fragment_url': f"{fragment_url}?{query}",
+    }
+
+
+def _catalog_page(request, pk=None):
+    if pk is None:
+        items = Item.objects.visible_to(request.user)
+        scope = 'catalog'
+    else:
+        collection = get_object_or_404(Collections, pk=pk)
+        items = collection.items_list.visible_to(request.user)
+        scope = f'collection:{pk}'
+    item_filter = ItemFilter(request.GET)
+    return paginate_items(request, item_filter.apply(items), scope, item_filter)
+
+
+def item_page(request, pk=None):
+    """HTML fragment with the next page of item cards, for infinite scroll."""
+    page = _catalog_page(request, pk)
+    prefetch_related_objects(page.items, 'collections')
+    fragment_url = reverse('borrow:collection_item_page', args=[pk]) if pk else reverse('borrow:item_page')
+    context = next_page_context(request, page, fragment_url)
+    response = render(request, 'borrow/item_cards.html', {'items': page.items})
+    if context['next_fragment_url']:
+        response['X-Next-Page'] = context['next_fragment_url']
+    return response
+
+
+def item_page_json(request, pk=None):
+    """JSON variant of item_page taking the same filters and cursor."""
+    page = _catalog_page(request, pk)
+    return JsonResponse({
+        'items': [
+            {
+                'id': item.id,
+                'name': item.name,
+                'quantity': item.quantity,
+                'location': item.location,
+                'category': item.category,
+                'photo': item.photo.url if item.photo else None,
+                'url': reverse('borrow:detail', args=[item.id]),
+            }
+            for item in page.items
+        ],
+        'next_cursor': page.next_cursor,
+    })
+
+def search(request):
+    """Ranked, highlighted full-text search across items and collections."""
+    q = request.GET.get('q', '').strip()
+    if not q:
+        return JsonResponse({'items': [], 'collections': []})
+
+    collections = Collections.objects.all()
+    if not request.user.is_authenticated:
+        collections = collections.filter(is_collection_private=False)
+    results = search_catalog(q, Item.objects.visible_to(request.user), collections)
+
+    return JsonResponse({
+        'items': [
+            {
+                'id': item.id,
+                'name': item.name,
+                'rank': item.search_rank,
+                'highlight': item.search_highlight,
+                'url': reverse('borrow:detail', args=[item.id]),
+            }
+            for item in results['items']
+        ],
+        'collections': [
+            {
+                'id': collection.id,
+                'title': collection.title,
+                'rank': collection.search_rank,
+                'highlight': collection.search_highlight,
+                'url': reverse('borrow:collection_detail', args=[collection.id]),
+            }
+            for collection in results['collections']
+        ],
+    })
+
+def autocomplete(request):
+    """Search-as-you-type suggestions, answered from the in-memory index without querying the catalog"""
+    q = request.GET.get('q', '')[:100]
+    return JsonResponse({'suggestions': suggest(q, request.user)})
+
+def item_availability(request, pk):
+    """Free units of an item for each day of ?month=YYYY-MM (default: this month), from one query."""
+    item = get_object_or_404(Item.objects.visible_to(request.user), pk=pk)
+    today = timezone.localdate()
+    try:
+        year, month = (int(part) for part in request.GET.get('month', f'{today:%Y-%m}').split('-'))
+        days = month_availability(item, year, month)
+    except ValueError:
+        return HttpResponseBadRequest("month must look like YYYY-MM")
+    return JsonResponse({
+        'item': item.pk,
+        'month': f'{year:04d}-{month:02d}',
+        'days': [{'date': day.isoformat(), 'available': available} for day, available in days],
+    })
+
 @login_required
 def add_review(request, pk):
     item = get_object_or_404(Item, pk=pk)
     try:
-        patron = Patron.objects.get(user=request.user)
+        patron = request.role.get_patron()
     except Patron.DoesNotExist:
         messages.error(request, "You need to be a patron to review items.", extra_tags='current-page')
         return redirect('borrow:detail', pk=pk)
@@ -658,12 +754,12 @@ def add_review(request, pk):
     if request.method == 'POST':
         form = ReviewForm(request.POST, instance=existing_review)
         if form.is_valid():
-            review = form.save(commit=False)
-            review.item = item
-            review.reviewer = patron
-            review.save()
+            # Keeps the item's rating aggregates in step, in the same transaction
+            _, created = reviews.save_review(
+                item, patron, form.cleaned_data['rating'], form.cleaned_data['comment']
+            )
             messages.success(request, 
-                "Your review has been updated." if existing_review else "Your review has been added.", 
+                "Your review has been added." if created else "Your review has been updated.", 
                 extra_tags='current-page'
             )
             return redirect('borrow:detail', pk=pk)
@@ -679,17 +775,29 @@ def add_review(request, pk):
 @login_required
 def my_borrowed_items(request):
     try:
-        patron = Patron.objects.get(user=request.user)
+        patron = request.role.get_patron()
         borrowed_items = BorrowedItem.objects.filter(borrower=patron, returned=False)
-        return render(request, 'borrow/my_borrowed_items.html', {'borrowed_items': borrowed_items})
+        waitlisted = BorrowRequest.objects.filter(borrower=patron, status=BorrowRequest.WAITLISTED).select_related('item')
+        return render(request, 'borrow/my_borrowed_items.html', {'borrowed_items': borrowed_items, 'waitlisted': waitlisted})
     except Patron.DoesNotExist:
         messages.error(request, "You need to be a patron to see borrowed items.", extra_tags='current-page')
         return redirect('home')
 
+@login_required
+def cancel_waitlist(request, pk):
+    """The borrower takes their request off an item's waitlist."""
+    borrow_request = get_object_or_404(BorrowRequest, pk=pk, borrower__user=request.user)
+    if request.method == "POST":
+        if waitlist.cancel(borrow_request):
+            messages.success(request, f"You have left the waitlist for {borrow_request.item.name}.", extra_tags='current-page')
+        else:
+            messages.error(request, "That request is no longer on the waitlist.", extra_tags='current-page')
+    return redirect('borrow:my_borrowed_items')
+
 @login_required
 def all_borrowed_items(request):
     try:
-        librarian = Librarian.objects.get(user=request.user)
+        librarian = request.role.get_librarian()
         borrowed_items = BorrowedItem.objects.filter(returned=False)
         return render(request, 'borrow/all_borrowed_items.html', {'borrowed_items': borrowed_items})
     except Librarian.DoesNotExist:
@@ -703,7 +811,7 @@ def return_item(request, borrowed_item_id):
     is_borrower = borrowed_item.borrower.user == request.user
     is_librarian = False
     try:
-        Librarian.objects.get(user=request.user)
+        request.role.get_librarian()
         is_librarian = True
     except Librarian.DoesNotExist:
         pass
@@ -712,11 +820,12 @@ def return_item(request, borrowed_item_id):
         return HttpResponseForbidden("You don't have permission to return this item.")
     
     item = borrowed_item.item
-    item.quantity += borrowed_item.quantity
-    item.save()
-    
-    borrowed_item.returned = True
-    borrowed_item.save()
+    try:
+        # Puts the stock back with a single conditional update, so it only happens once
+        return_borrowed_item(borrowed_item)
+    except InventoryError as e:
+        messages.error(request, e.message, extra_tags='current-page')
+        return redirect('borrow:all_borrowed_items' if is_librarian else 'borrow:my_borrowed_items')
     
     messages.success(request, f"Item '{item.name}' has been returned successfully.", extra_tags='current-page')
     
@@ -732,7 +841,7 @@ def return_item(request, borrowed_item_id):
 @login_required
 def approve_collection_requests(request):
     try:
-        librarian = Librarian.objects.get(user=request.user)
+        librarian = request.role.get_librarian()
     except Librarian.DoesNotExist:
         return HttpResponseForbidden("You are not a librarian and cannot approve collection requests.")
     
@@ -740,45 +849,11 @@ def approve_collection_requests(request):
     collection_requests = CollectionRequest.objects.filter(status=CollectionRequest.PENDING)
     
     if request.method == "POST":
-        request_id = request.POST.get('request_id')
         action = request.POST.get('action')  # 'approve' or 'reject'
-        
-        try:
-            collection_request = CollectionRequest.objects.get(id=request_id)
-        except CollectionRequest.DoesNotExist:
-            messages.error(request, "Request not found.", extra_tags='current-page')
-            return redirect('borrow:approve_collection_requests')
-        
-        if action == 'approve':
-            # Existing approval code
-            collection_request.approve()
-            collection = collection_request.collection
-            user = collection_request.user
-            collection.allowed_users.add(user)
-            collection.save()
-            
-            # Send message to user
-            send_message(
-                recipient=collection_request.user,
-                subject=f"Collection Request Approved: {collection_request.collection.title}",
-                content=f"Your request to join the collection '{collection_request.collection.title}' has been approved. You now have access to it.",
-                link=reverse('borrow:collection_detail', args=[collection_request.collection.id]),
-                sender=librarian
-            )
-            
-        elif action == 'reject':
-            # Existing rejection code
-            collection_request.reject()
-            
-            # Send message to user
-            send_message(
-                recipient=collection_request.user,
-                subject=f"Collection Request Rejected: {collection_request.collection.title}",
-                content=f"Your request to join the collection '{collection_request.collection.title}' has been rejected.",
-                sender=librarian
-            )
-        
-        return redirect('borrow:approve_collection_requests')
+        handlers = {'approve': approvals.approve_collection_requests, 'reject': approvals.reject_collection_requests}
+        return handle_queue_action(request, handlers.get(action), librarian, 'borrow:approve_collection_requests', 'borrow/approve_collection_requests.html', {
+            'collection_requests': collection_requests,
+        })
     
     return render(request, 'borrow/approve_collection_requests.html', {'collection_requests': collection_requests})
 
@@ -791,13 +866,13 @@ def request_collection(request, pk):
         return redirect('borrow:collection_detail', pk=collection.id)
     
     try:
-        patron = Patron.objects.get(user=request.user)
+        patron = request.role.get_patron()
     except Patron.DoesNotExist:
         messages.error(request, "You need to be logged in to request collection access.", extra_tags='current-page')
         return redirect('borrow:collection_detail', pk=collection.id)
     
     # Check if the user already has access
-    if collection.allowed_users.filter(pk=patron.pk).exists():
+    if request.role.can_open(collection):
         messages.info(request, "You already have access to this collection.", extra_tags='current-page')
         return redirect('borrow:collection_detail', pk=collection.id)
     
@@ -827,7 +902,8 @@ def request_collection(request, pk):
                 subject=f"Collection Access Request: {patron.name} - {collection.title}",
                 content=f"{patron.name} has requested to join the collection '{collection.title}'.\n\nReason: {form.cleaned_data['notes']}",
                 link=reverse('borrow:approve_collection_requests'),
-                sender=patron
+                sender=patron,
+                digest='collection_requests'
             )
             
             messages.success(request, "Your request to join this collection has been submitted.", extra_tags='current-page')
@@ -837,52 +913,73 @@ def request_collection(request, pk):
     
     return render(request, 'borrow/request_collection.html', {'collection': collection, 'form': form})
     
+LOOKUP_PAGE_SIZE = 20
+
+def _lookup_page(request, queryset, describe):
+    """One keyset page of `queryset` for a LazyMultipleSelect, as id/label/detail rows."""
+    paginator = KeysetPaginator(ordering=('name', 'pk'), per_page=LOOKUP_PAGE_SIZE)
+    try:
+        page = paginator.paginate(queryset, request.GET.get('cursor'))
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor")
+    return JsonResponse({
+        'results': [dict(zip(('id', 'label', 'detail'), (obj.pk, *describe(obj)))) for obj in page.items],
+        'next_cursor': page.next_cursor,
+    })
+
+@login_required
+def item_lookup(request):
+    """Items for the collection form's item picker, matching ?q= by name."""
+    items = Item.objects.visible_to(request.user).only('pk', 'name', 'location')
+    q = request.GET.get('q', '').strip()[:100]
+    if q:
+        items = items.filter(name__icontains=q)
+    return _lookup_page(request, items, lambda item: (item.name, item.location))
+
+@login_required
+def patron_lookup(request):
+    """Patrons for the collection form's allowed-users picker, matching ?q= by name or email."""
+    if not request.role.is_librarian:
+        return HttpResponseForbidden("Only librarians can grant access to collections.")
+    patrons = Patron.objects.only('pk', 'name', 'email')
+    q = request.GET.get('q', '').strip()[:100]
+    if q:
+        patrons = patrons.filter(Q(name__icontains=q) | Q(email__icontains=q))
+    return _lookup_page(request, patrons, lambda patron: (patron.name, patron.email))
+
 @login_required
 def create_collection(request):
     try:
-        creator = Librarian.objects.get(user=request.user)
+        creator = request.role.get_librarian()
         is_librarian = True
     except Librarian.DoesNotExist:
-        creator = Patron.objects.get(user=request.user)
+        creator = request.role.get_patron()
         is_librarian = False
     
     if request.method == "POST":
         form = CollectionForm(request.POST, librarian=creator, is_librarian=is_librarian)
         if form.is_valid():
-            new_items = list(form.cleaned_data['items_list'])
-            errs = []
-            for item in new_items:
-                existing = Collections.objects.filter(items_list=item)
-                if form.cleaned_data.get('is_collection_private'):
-                    if existing.exists():
-                        errs.append(f"'{item.name}' is already in '{existing.first().title}'; private collections must be disjoint.")
-                else:
-                    priv = existing.filter(is_collection_private=True).first()
-                    if priv:
-                        errs.append(f"'{item.name}' lives in private '{priv.title}'; public collections cannot include it.")
+            private = is_librarian and form.cleaned_data.get('is_collection_private')
+            # Every conflict of the whole selection, from one query
+            errs = [conflict.message for conflict in collection_conflicts(form.cleaned_data['items_list'], private)]
+            if not errs:
+                try:
+                    with transaction.atomic():
+                        coll = form.save(commit=False)
+                        if not is_librarian:
+                            coll.is_collection_private = False
+                        coll.save()
+                        # Only the grants picked in the form: everyone may see a public
+                        # collection, and librarians and the creator any private one
+                        form.save_m2m()
+                except CollectionConflict as e:
+                    # Another edit took one of the items in the meantime
+                    errs = e.messages
             
             if errs:
                 for e in errs:
                     messages.error(request, e, extra_tags='current-page')
             else:
-                coll = form.save(commit=False)
-                if not is_librarian:
-                    coll.is_collection_private = False
-                coll.save()
-                form.save_m2m()
-                
-                if coll.is_collection_private: 
-                    # Get all users who are librarians
-                    librarian_users = Librarian.objects.all()
-                    # Add all librarian patrons to the collection's allowed_users
-                    coll.allowed_users.add(*librarian_users)
-                    coll.allowed_users.add(creator)
-                else:
-                    patron_users = Patron.objects.all()
-                    coll.allowed_users.add(*patron_users)
-                    coll.allowed_users.add(creator)
-                    
-                
                 messages.success(request, f"Collection '{coll.title}' created.", extra_tags='current-page')
                 return redirect('borrow:manage_collections')
     else:
@@ -897,15 +994,13 @@ def create_collection(request):
 @login_required
 def manage_items(request):
     try:
-        librarian = Librarian.objects.get(user=request.user)
+        librarian = request.role.get_librarian()
     except Librarian.DoesNotExist:
         messages.error(request, "You don't have permission to manage items.", extra_tags='current-page')
         return redirect('home')
 
-    simple_items = SimpleItem.objects.all()
-    complex_items = ComplexItem.objects.all()
-    items = list(simple_items) + list(complex_items)
-    items.sort(key=lambda x: x.name)
+    # One query, sorted by the database, with each item loaded as its subclass
+    items = Item.objects.polymorphic().order_by('name')
     
     return render(request, 'borrow/manage_items.html', {
         'items': items,
@@ -914,28 +1009,29 @@ def manage_items(request):
 @login_required
 def edit_item(request, pk):
     try:
-        librarian = Librarian.objects.get(user=request.user)
+        librarian = request.role.get_librarian()
     except Librarian.DoesNotExist:
         messages.error(request, "You don't have permission to edit items.", extra_tags='current-page')
         return redirect('home')
     
-    try:
-        item = SimpleItem.objects.get(pk=pk)
+    item = Item.objects.polymorphic().filter(pk=pk).first()
+    if item is not None and item.is_simple:
         form_class = SimpleItemForm
         template = 'borrow/edit_simple_item.html'
-    except SimpleItem.DoesNotExist:
-        try:
-            item = ComplexItem.objects.get(pk=pk)
-            form_class = ComplexItemForm
-            template = 'borrow/edit_complex_item.html'
-        except ComplexItem.DoesNotExist:
-            messages.error(request, "Item not found.", extra_tags='current-page')
-            return redirect('borrow:manage_items')
+    elif item is not None and item.is_complex:
+        form_class = ComplexItemForm
+        template = 'borrow/edit_complex_item.html'
+    else:
+        messages.error(request, "Item not found.", extra_tags='current-page')
+        return redirect('borrow:manage_items')
     
     if request.method == 'POST':
         form = form_class(request.POST, request.FILES, instance=item)
         if form.is_valid():
-            form.save()
+            with transaction.atomic():
+                form.save()
+                # More stock goes to the waitlist first
+                waitlist.allocate([item.pk], sender=librarian)
             messages.success(request, f"Item '{item.name}' has been updated successfully.", extra_tags='current-page')
             return redirect('borrow:manage_items')
     else:
@@ -949,10 +1045,10 @@ def edit_item(request, pk):
 @login_required
 def delete_item(request, pk):
     try:
-        librarian = Librarian.objects.get(user=request.user)
+        librarian = request.role.get_librarian()
         is_librarian = True
     except Librarian.DoesNotExist:
-        creator = Patron.objects.get(user=request.user)
+        creator = request.role.get_patron()
         is_librarian = False
     
     if is_librarian:
@@ -978,34 +1074,64 @@ def delete_review(request, review_id):
         return redirect('borrow:detail', pk=item_id)
     
     if request.method == "POST":
-        review.delete()
+        reviews.delete_review(review)
         messages.success(request, "Your review has been deleted successfully.", extra_tags='current-page')
     
     return redirect('borrow:detail', pk=item_id)
 
+MESSAGES_PER_PAGE = 25
+
 @login_required
 def message_list(request):
     try:
-        patron = Patron.objects.get(user=request.user)
-        messages = Message.objects.filter(recipient=patron)
-        return render(request, 'borrow/messages.html', {'messages': messages})
+        patron = request.role.get_patron()
     except Patron.DoesNotExist:
         messages.error(request, "You need to be a patron to access messages.", extra_tags='current-page')
         return redirect('home')
 
+    # Newest first, one keyset page at a time over the (recipient, created_at) index
+    paginator = KeysetPaginator(ordering=('-created_at', '-pk'), per_page=MESSAGES_PER_PAGE)
+    inbox = Message.objects.inbox(patron).select_related('sender')
+    try:
+        page = paginator.paginate(inbox, request.GET.get('cursor'))
+    except InvalidCursor:
+        page = paginator.paginate(inbox)
+    context = {'messages': live_digest_counts(page.items)}
+    context.update(next_page_context(request, page, reverse('borrow:messages')))
+    return render(request, 'borrow/messages.html', context)
+
+@login_required
+def mark_messages_read(request):
+    """Mark the selected messages (message_ids), or the whole inbox (all), as read in one statement."""
+    try:
+        patron = request.role.get_patron()
+    except Patron.DoesNotExist:
+        messages.error(request, "You need to be a patron to access messages.", extra_tags='current-page')
+        return redirect('home')
+    if request.method != "POST":
+        return redirect('borrow:messages')
+
+    inbox = Message.objects.inbox(patron)
+    if not request.POST.get('all'):
+        ids = [value for value in request.POST.getlist('message_ids') if value.isdigit()]
+        inbox = inbox.filter(pk__in=ids)
+    if inbox.mark_read(patron):
+        events.unread_changed(recipients=[patron.pk])
+    return redirect('borrow:messages')
+
 @login_required
 def mark_message_read(request, message_id):
     try:
-        patron = Patron.objects.get(user=request.user)
-        message = get_object_or_404(Message, id=message_id, recipient=patron)
+        patron = request.role.get_patron()
+        message = get_object_or_404(Message.objects.inbox(patron), id=message_id)
         
         if request.method == "POST":
-            message.read = not message.read
-            message.save()
+            message.mark_read(patron, not message.is_read)
+            events.unread_changed(recipients=[patron.pk])
             return redirect('borrow:messages')
         
-        message.read = True
-        message.save()
+        message.mark_read(patron)
+        events.unread_changed(recipients=[patron.pk])
         
         if message.link and message.link.strip():
             return redirect(message.link)
@@ -1015,36 +1141,25 @@ def mark_message_read(request, message_id):
         messages.error(request, "You need to be a patron to access messages.", extra_tags='current-page')
         return redirect('home')
 
+async def event_stream(request):
+    """Server-Sent Events with the unread count and approval-queue changes; 204 tells the client to poll instead."""
+    user = await request.auser()
+    # A stream would pin a whole worker under WSGI
+    if not isinstance(request, ASGIRequest) or not user.is_authenticated:
+        return HttpResponse(status=204)
+    patron = await Patron.objects.filter(user=user).afirst()
+    if patron is None:
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(events.stream(patron), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 def unread_message_count(request):
     """API endpoint to get unread message count for AJAX calls"""
     if not request.user.is_authenticated:
         return JsonResponse({'count': 0})
     
-    try:
-        patron = Patron.objects.get(user=request.user)
-        count = Message.objects.filter(recipient=patron, read=False).count()
-        return JsonResponse({'count': count})
-    except Patron.DoesNotExist:
-        return JsonResponse({'count': 0})
-
-def send_message(recipient, subject, content, link='', sender=None):
-    """Helper function to send a message to a recipient"""
-    Message.objects.create(
-        recipient=recipient,
-        subject=subject,
-        content=content,
-        link=link,
-        sender=sender
-    )
-
-def send_message_to_librarians(subject, content, link='', sender=None):
-    """Helper function to send a message to all librarians"""
-    librarians = Librarian.objects.all()
-    for librarian in librarians:
-        Message.objects.create(
-            recipient=librarian,
-            subject=subject,
-            content=content,
-            link=link,
-            sender=sender
-        )
+    # One indexed single-row read; the counter is maintained as messages are sent and read
+    count = Patron.objects.filter(user=request.user).values_list('unread_count', flat=True).first()
+    return JsonResponse({'count': count or 0})
@@ -0,0 +1,117 @@
+"""
+First-come, first-served waitlists for items that are out of stock.
+
+A request filed while an item has no units free is stored as WAITLISTED
+instead of landing in the librarians' queue. Whenever stock comes back (a
+return, or a librarian raising the quantity) allocate() runs in the same
+transaction and lends the freed units to the oldest waiters. The head of the
+queue is never skipped: if it needs more units than are free, everyone behind
+it keeps waiting too. No request may ask for more than the library owns, so
+the head is always served once enough comes back, and the borrower can
+cancel() it or a librarian reject it to let the queue move on.
+
+Each waiter needs at least one unit, so no more waiters than there are units
+on the shelf are ever read. A long queue therefore costs nothing until its
+turn comes.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .catalog_cache import stock_changed
+from .inventory import InventoryError, lock_items
+from .models import BorrowedItem, BorrowRequest, Item
+from .notifications import build_message, send_messages
+from .reservations import ItemCalendar, request_window
+
+
+def queue(item):
+    """The item's waiting requests, oldest first."""
+    return BorrowRequest.objects.filter(item=item, status=BorrowRequest.WAITLISTED).order_by('date', 'pk')
+
+
+def position(borrow_request):
+    """1-based place of a waiting request in its item's queue."""
+    return queue(borrow_request.item_id).filter(date__lte=borrow_request.date).exclude(
+        date=borrow_request.date, pk__gt=borrow_request.pk
+    ).count()
+
+
+def cancel(borrow_request):
+    """
+    Take a waiting request off its queue, lending any units it was holding
+    back to the waiters behind it. Returns False if it was no longer waiting.
+    """
+    with transaction.atomic():
+        cancelled = BorrowRequest.objects.filter(pk=borrow_request.pk, status=BorrowRequest.WAITLISTED).update(
+            status=BorrowRequest.CANCELLED
+        )
+        if cancelled:
+            allocate([borrow_request.item_id])
+    return bool(cancelled)
+
+
+def allocate(item_ids, sender=None):
+    """
+    Lend whatever stock of `item_ids` is free to their waitlists, oldest first.
+    Call it inside the transaction that freed the stock. Returns the
+    BorrowRequests that were lent.
+    """
+    with transaction.atomic():
+        lock_items(item_ids)
+        on_shelf = dict(Item.objects.filter(pk__in=item_ids, quantity__gt=0).values_list('pk', 'quantity'))
+        waiting = {}
+        for item_pk, units in on_shelf.items():
+            waiters = list(
+                queue(item_pk).select_for_update().select_related('item', 'borrower')[:units]
+            )
+            if waiters:
+                waiting[item_pk] = waiters
+        if not waiting:
+            return []
+
+        windows = {r.pk: request_window(r) for waiters in waiting.values() for r in waiters}
+        calendars = ItemCalendar.load(list(waiting), timezone.now(), max(end for _, end in windows.values()))
+        lent, loans, notices = [], [], []
+        taken = {}
+        for item_pk, waiters in waiting.items():
+            item_calendar = calendars.get(item_pk, ItemCalendar(item_pk))
+            for borrow_request in waiters:
+                item = borrow_request.item
+                # Individual items are always lent one at a time
+                quantity = 1 if item.kind == Item.COMPLEX else borrow_request.quantity
+                start, end = windows[borrow_request.pk]
+                if item_calendar.free(start, end) < quantity:
+                    break
+                item_calendar.lend(end, quantity)
+                taken[item_pk] = taken.get(item_pk, 0) + quantity
+                borrow_request.status = BorrowRequest.APPROVED
+                lent.append(borrow_request)
+                loans.append(BorrowedItem(
+                    borrower=borrow_request.borrower,
+                    item=item,
+                    quantity=quantity,
+                    due_date=end,
+                    item_type=item.kind,
+                ))
+                notices.append(build_message(
+                    recipient=borrow_request.borrower,
+                    subject=f"Waitlist: {item.name} is yours",
+                    content=f"{item.name} is back in stock and has been lent to you. Please return it by {end:%b %d}.",
+                    sender=sender,
+                ))
+
+        for item_pk, quantity in taken.items():
+            updated = Item.objects.filter(pk=item_pk, quantity__gte=quantity).update(
+                quantity=F('quantity') - quantity
+            )
+            if not updated:
+                raise InventoryError(InventoryError.OUT_OF_STOCK, "Stock changed during waitlist allocation.")
+        if taken:
+            stock_changed()
+        BorrowedItem.objects.bulk_create(loans)
+        for borrow_request, loan in zip(lent, loans):
+            borrow_request.loan = loan
+        BorrowRequest.objects.bulk_update(lent, ['status', 'loan'])
+        send_messages(notices)
+    return lent
@@ -1,7 +1,19 @@
 from django.shortcuts import redirect
 from django.contrib import messages
 from django.urls import resolve, reverse
-from borrow.models import Patron
+from borrow.roles import RequestRole
+
+class RoleMiddleware:
+    """
+    Attach a lazy request.role (see borrow.roles) so the user's Patron and
+    Librarian rows are looked up at most once per request, by one query.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.role = RequestRole(request)
+        return self.get_response(request)
 
 class AdminRedirectMiddleware:
     """
@@ -11,7 +23,9 @@ class AdminRedirectMiddleware:
         self.get_response = get_response
 
     def __call__(self, request):
-        if request.user.is_authenticated and request.user.is_staff and not request.path.startswith('/admin/'):
+        # Staff with a Patron use the app normally; only admin-only accounts need the URL check
+        if (request.user.is_authenticated and request.user.is_staff and not request.path.startswith('/admin/')
+                and not request.role.is_patron):
             # Check if the current path is not a login/logout related path
             current_url = resolve(request.path)
             exempt_urls = [
@@ -22,17 +36,12 @@ class AdminRedirectMiddleware:
             ]
             
             if current_url.url_name not in exempt_urls:
-                # Check if the user is admin-only (has no associated Patron)
-                try:
-                    Patron.objects.get(user=request.user)
-                    # User has Patron record, so proceed normally
-                except Patron.DoesNotExist:
-                    # User is admin-only, redirect to admin
-                    messages.error(
-                        request, 
-                        "Admin accounts don't have access to the main app. Please log in with a normal account.",
-                        extra_tags='admin-only'
-                    )
-                    return redirect('admin:index')
+                # User is admin-only, redirect to admin
+                messages.error(
+                    request, 
+                    "Admin accounts don't have access to the main app. Please log in with a normal account.",
+                    extra_tags='admin-only'
+                )
+                return redirect('admin:index')
 
         return self.get_response(request)
\ No newline at end of file
@@ -3,9 +3,8 @@ from django.urls import reverse
 from django.contrib import messages
 from django.shortcuts import get_object_or_404, render, redirect
 from django.views import generic
-from django.utils import timezone
 from django.contrib.auth.decorators import login_required
-from borrow.models import Librarian, Patron, BorrowedItem, BorrowRequest, CollectionRequest 
+from borrow.models import Patron, BorrowedItem, BorrowRequest, CollectionRequest 
 from allauth.socialaccount.models import SocialAccount
 
 
@@ -21,7 +20,7 @@ def home(request):
     # — Handle admin-only users —
     if request.user.is_staff:
         try:
-            Patron.objects.get(user=request.user)
+            request.role.get_patron()
         except Patron.DoesNotExist:
             messages.error(
                 request, 
@@ -32,19 +31,21 @@ def home(request):
 
     # — Must be a Patron to see dashboard —
     try:
-        patron = Patron.objects.get(user=request.user)
+        patron = request.role.get_patron()
     except Patron.DoesNotExist:
         patron = Patron.objects.create(
             user=request.user,
             email=request.user.email,
             name=request.user.get_full_name(),
         )
+        request.role.forget()
 
-    # grab their borrowed items
-    borrowed_items = BorrowedItem.objects.filter(borrower=patron, returned=False)
-    now = timezone.now()
-    due_soon = [b for b in borrowed_items if 0 <= (b.due_date - now).days <= 1]
-    overdue  = [b for b in borrowed_items if b.is_late()]
+    # grab their borrowed items; due-soon/overdue status is kept current by scan_loans
+    borrowed_items = list(
+        BorrowedItem.objects.filter(borrower=patron, returned=False).select_related('item').order_by('due_date')
+    )
+    due_soon = [b for b in borrowed_items if b.status == BorrowedItem.DUE_SOON]
+    overdue  = [b for b in borrowed_items if b.status == BorrowedItem.OVERDUE]
 
     context = {
         "public":         False,
@@ -55,7 +56,7 @@ def home(request):
     }
 
     # if they're a librarian, show pending requests
-    if Librarian.objects.filter(user=request.user).exists():
+    if request.role.is_librarian:
         context["is_librarian"]       = True
         context["borrow_requests"]    = BorrowRequest.objects.filter(status=BorrowRequest.PENDING)
         context["collection_requests"]= CollectionRequest.objects.filter(status=CollectionRequest.PENDING)
@@ -69,7 +70,7 @@ def profile_view(request):
     
     # Try to get the existing Patron instance
     try:
-        patron = Patron.objects.get(user=request.user)
+        patron = request.role.get_patron()
     except Patron.DoesNotExist:
         # Only create a new one if it doesn't exist and is not a superuser
         if not is_superuser:
@@ -78,6 +79,7 @@ def profile_view(request):
                 email=request.user.email,
                 name=request.user.get_full_name(),
             )
+            request.role.forget()
         else:
             # For superusers without patron accounts, create a minimal context
             return render(request, 'account/profile.html', {
@@ -86,7 +88,7 @@ def profile_view(request):
             })
     
     # Check if the user has a Librarian instance
-    librarian = Librarian.objects.filter(user=request.user).first()
+    librarian = request.role.librarian
     
     # Determine user role: librarian > patron > unknown
     if is_superuser:
@@ -112,7 +114,7 @@ def redirect_to_home(request):
     # Check if the user is an admin-only user
     if request.user.is_authenticated and request.user.is_staff:
         try:
-            Patron.objects.get(user=request.user)
+            request.role.get_patron()
         except Patron.DoesNotExist:
             messages.error(
                 request, 